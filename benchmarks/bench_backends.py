@@ -0,0 +1,40 @@
+"""Wall time from process start to results of the pipeline: local (pandas) backend vs local-mode Spark.
+
+Every run is a fresh `python -m covid_unemp.pipeline` process, so the times
+include the imports and, for Spark, starting the JVM.
+
+    python -m benchmarks.bench_backends --claims coviddata/State_UI_claims_allstates_1987_Apr182020.csv \
+        --covid coviddata/us-states.csv --repeat 3
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.common import CLAIMS_FILE
+
+
+def run(backend, claims, covid):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-m', 'covid_unemp.pipeline', '--backend', backend, '--claims', claims,
+                    '--covid', covid], check=True, capture_output=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--claims', default=CLAIMS_FILE)
+    parser.add_argument('--covid', default='coviddata/us-states.csv')
+    parser.add_argument('--backends', nargs='+', default=['local', 'spark'])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print('%-8s %10s %10s %10s' % ('backend', 'median s', 'min s', 'max s'))
+    for backend in args.backends:
+        times = [run(backend, args.claims, args.covid) for _ in range(args.repeat)]
+        print('%-8s %10.2f %10.2f %10.2f' % (backend, statistics.median(times), min(times), max(times)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Throughput of the rolling-origin backtests (cutoffs evaluated per minute) with the number of cores.
+
+Backtests synthetic monthly series (see bench_forecasting) with yearly cutoffs
+and a 24 months horizon, with 1, 2, 4, ... workers on the local process pool
+or on local Spark, with and without warm starts within the chunks of cutoffs.
+
+    python -m benchmarks.bench_backtest --series 8 --backend local
+"""
+import argparse
+import os
+
+from benchmarks.bench_forecasting import monthly_series
+from benchmarks.common import local_spark, timed
+from covid_unemp.backtest import backtest_local, backtest_spark, rolling_cutoffs
+from covid_unemp.forecasting import CLAIMS_MODEL
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--series', type=int, default=8)
+    parser.add_argument('--months', type=int, default=400)
+    parser.add_argument('--horizon', type=int, default=24)
+    parser.add_argument('--period', type=int, default=12, help='observations between cutoffs')
+    parser.add_argument('--initial', type=int, default=120, help='observations before the first cutoff')
+    parser.add_argument('--chunk-size', type=int, default=4)
+    parser.add_argument('--backend', default='local', choices=['local', 'spark'])
+    parser.add_argument('--max-cores', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    history = monthly_series(args.series, args.months)
+    cutoffs = rolling_cutoffs(history['ds'], args.horizon, args.period, args.initial)
+    evaluated = args.series * len(cutoffs)
+    cores = [1]
+    while cores[-1] * 2 <= args.max_cores:
+        cores.append(cores[-1] * 2)
+
+    print('%d series x %d cutoffs' % (args.series, len(cutoffs)))
+    print('%6s %6s %10s %13s %8s' % ('cores', 'warm', 'seconds', 'cutoffs/min', 'speedup'))
+    for warm_start in (False, True):
+        baseline = None
+        for n in cores:
+            if args.backend == 'local':
+                _, elapsed = timed(backtest_local, history, CLAIMS_MODEL, cutoffs, args.horizon, args.chunk_size,
+                                   max_workers=n, warm_start=warm_start)
+            else:
+                spark = local_spark('bench_backtest', cores=n)
+                sdf = spark.createDataFrame(history)
+                _, elapsed = timed(lambda: backtest_spark(sdf, CLAIMS_MODEL, cutoffs, args.horizon, args.chunk_size,
+                                                          num_partitions=n, warm_start=warm_start).toPandas())
+                spark.stop()
+            baseline = baseline or elapsed
+            print('%6d %6s %10.2f %13.1f %7.1fx' % (n, warm_start, elapsed, 60 * evaluated / elapsed,
+                                                   baseline / elapsed))
+
+
+if __name__ == '__main__':
+    main()
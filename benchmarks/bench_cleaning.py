@@ -0,0 +1,64 @@
+"""Compare rows/sec of the native claims cleaning stage against the old commaRep UDF path.
+
+    python -m benchmarks.bench_cleaning --claims <claims csv> --factors 1 10
+"""
+import argparse
+import re
+
+from pyspark.sql.functions import UserDefinedFunction, col, from_unixtime, to_date, unix_timestamp
+from pyspark.sql.types import StringType
+
+from benchmarks.common import CLAIMS_FILE, clean_work_dir, consume, local_spark, replicated_inputs, timed
+from covid_unemp.cleaning import clean_claims
+
+RAW_COLUMNS = {
+    'State': 'State', 'Filed week ended': 'Filed_week_ended', 'Initial Claims': 'Initial_Claims',
+    'Reflecting Week Ended': 'Reflecting_Week_Ended', 'Continued Claims': 'Continued_Claims',
+    'Covered Employment': 'Covered_Employment', 'Insured Unemployment Rate': 'Insured_Unemployment_Rate',
+}
+
+
+def load_raw(spark, path):
+    df = spark.read.format('csv').option('header', 'true').option('inferSchema', 'true').load(path)
+    return df.select(*[col('`%s`' % c).alias(alias) for c, alias in RAW_COLUMNS.items()])
+
+
+def udf_cleaning(df):
+    """The cleaning used by the notebook before the native stage, kept here as the baseline."""
+    commaRep = UserDefinedFunction(lambda x: re.sub(',', '', str(x)), StringType())
+    df = df.select(*[commaRep(column).alias(column) for column in df.columns])
+    df = df.select('State', 'Initial_Claims', 'Continued_Claims', 'Covered_Employment', 'Insured_Unemployment_Rate',
+                   from_unixtime(unix_timestamp('Filed_week_ended', 'MM/dd/yyyy')).alias('Filed_week_ended_fixed'),
+                   from_unixtime(unix_timestamp('Reflecting_Week_Ended', 'MM/dd/yyyy')).alias('Reflecting_Week_Ended_fixed'))
+    return df.select(col('State').alias('state'), to_date(col('Filed_week_ended_fixed')).alias('date'),
+                     col('Initial_Claims').cast('Long'), to_date(col('Reflecting_Week_Ended_fixed')),
+                     col('Continued_Claims').cast('Long'), col('Covered_Employment').cast('Long'),
+                     col('Insured_Unemployment_Rate').cast('Double'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--claims', default=CLAIMS_FILE)
+    parser.add_argument('--factors', type=int, nargs='+', default=[1, 10])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--work-dir', default='/tmp/covid_unemp_bench')
+    args = parser.parse_args()
+
+    spark = local_spark('bench_cleaning')
+    inputs = replicated_inputs(args.claims, args.factors, args.work_dir)
+    print('%8s %10s %14s %14s %8s' % ('factor', 'rows', 'udf rows/s', 'native rows/s', 'speedup'))
+    for factor, path in inputs.items():
+        raw = load_raw(spark, path).cache()
+        rows = raw.count()
+        best = {}
+        for name, stage in (('udf', udf_cleaning), ('native', clean_claims)):
+            best[name] = min(timed(consume, stage(raw))[1] for _ in range(args.repeat))
+        raw.unpersist()
+        print('%8d %10d %14.0f %14.0f %7.1fx' % (factor, rows, rows / best['udf'], rows / best['native'],
+                                                 best['udf'] / best['native']))
+    spark.stop()
+    clean_work_dir(args.work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Prophet vs the batch least-squares forecaster: fit + predict time and holdout accuracy.
+
+The series of the notebook, unemp_delta_all_states_month (monthly UI claims
+over all states, last 24 months held out) and covid_all_states (daily COVID
+cases over all states, last 14 days held out), are built with the local
+pipeline backend from the source files, or from synthetic data with
+--synthetic. Both engines use the parameters of the notebook. The monthly
+claims of every state are then forecast with one Prophet model per state and
+with a single batch fit.
+
+    python -m benchmarks.bench_engines --claims coviddata/State_UI_claims_allstates_1987_Apr182020.csv \
+        --covid coviddata/us-states.csv
+    python -m benchmarks.bench_engines --synthetic
+"""
+import argparse
+
+import numpy as np
+
+from benchmarks.common import CLAIMS_FILE, clean_work_dir, timed
+from covid_unemp.backends.local import ALL_STATES
+from covid_unemp.batch_forecast import BatchForecaster, forecast_states_batch
+from covid_unemp.forecasting import CLAIMS_MODEL, forecast_states_local, prophet_class
+from covid_unemp.pipeline import run_pipeline
+
+COVID_MODEL = dict(interval_width=1, growth='linear', daily_seasonality=False, weekly_seasonality=True,
+                   yearly_seasonality=False, seasonality_mode='multiplicative')
+
+
+def notebook_series(rollups):
+    claims, covid = rollups['claims_rollup'], rollups['covid_rollup']
+    month = claims[(claims['grain'] == 'month') & (claims['state'] == ALL_STATES)]
+    day = covid[(covid['grain'] == 'day') & (covid['state'] == ALL_STATES)]
+    states = claims[(claims['grain'] == 'month') & (claims['state'] != ALL_STATES)]
+    return {
+        'unemp_delta_all_states_month': (month.rename(columns={'period': 'ds', 'Initial_Claims': 'y'}), CLAIMS_MODEL, 24),
+        'covid_all_states': (day.rename(columns={'period': 'ds', 'cases': 'y'}), COVID_MODEL, 14),
+    }, states.rename(columns={'period': 'ds', 'Initial_Claims': 'y'})[['state', 'ds', 'y']]
+
+
+def prophet_fit_predict(train, test, params):
+    model = prophet_class()(**params).fit(train)
+    return model.predict(test[['ds']])
+
+
+def batch_fit_predict(train, test, params):
+    model = BatchForecaster.from_params(params).fit(train)
+    return model.predict(test[['ds']])
+
+
+def accuracy(test, forecast):
+    y = test['y'].to_numpy(dtype='float64')
+    yhat = forecast['yhat'].to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mape = np.nanmean(np.where(y != 0, np.abs(y - yhat) / np.abs(y), np.nan))
+    rmse = np.sqrt(np.mean((y - yhat) ** 2))
+    coverage = np.mean((y >= forecast['yhat_lower'].to_numpy()) & (y <= forecast['yhat_upper'].to_numpy()))
+    return mape, rmse, coverage
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--claims', default=CLAIMS_FILE)
+    parser.add_argument('--covid', default='coviddata/us-states.csv')
+    parser.add_argument('--synthetic', action='store_true', help='use covid_unemp.synthetic data at state level')
+    parser.add_argument('--work-dir', default='/tmp/covid_unemp_bench/engines')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        from covid_unemp.synthetic import Scale, write_csv
+        paths = write_csv(Scale(), args.work_dir)
+        rollups = run_pipeline('local', paths['claims'], paths['covid_states'], paths['population'])
+        clean_work_dir(args.work_dir)
+    else:
+        rollups = run_pipeline('local', args.claims, args.covid)
+    series, states = notebook_series(rollups)
+
+    print('%-30s %-8s %6s %9s %9s %14s %9s' % ('series', 'engine', 'n', 'seconds', 'MAPE', 'RMSE', 'coverage'))
+    for name, (frame, params, holdout) in series.items():
+        frame = frame[['ds', 'y']].sort_values('ds').reset_index(drop=True)
+        train, test = frame.iloc[:-holdout], frame.iloc[-holdout:]
+        for engine, fit_predict in (('prophet', prophet_fit_predict), ('batch', batch_fit_predict)):
+            forecast, seconds = timed(fit_predict, train, test, params)
+            print('%-30s %-8s %6d %9.3f %9.4f %14.1f %9.2f' % ((name, engine, len(train), seconds)
+                                                              + accuracy(test, forecast)))
+
+    n = states['state'].nunique()
+    _, prophet_seconds = timed(forecast_states_local, states, CLAIMS_MODEL, 24, 'MS', max_workers=1)
+    _, batch_seconds = timed(forecast_states_batch, states, CLAIMS_MODEL, 24, 'MS')
+    print('\n%d state series, 24 months ahead' % n)
+    print('%-8s %9s %12s' % ('engine', 'seconds', 'series/s'))
+    for engine, seconds in (('prophet', prophet_seconds), ('batch', batch_seconds)):
+        print('%-8s %9.2f %12.1f' % (engine, seconds, n / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Scaling of the per-state Prophet forecasts with the number of cores.
+
+Fits one model per synthetic monthly series (trend + yearly seasonality + noise)
+with 1, 2, 4, ... workers, on the local process pool or on local Spark.
+
+    python -m benchmarks.bench_forecasting --series 52 --backend local
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.common import local_spark, timed
+from covid_unemp.forecasting import CLAIMS_MODEL, forecast_states_local, forecast_states_spark
+
+
+def monthly_series(n_series, n_months=400, seed=0):
+    rng = np.random.RandomState(seed)
+    ds = pd.date_range('1987-01-01', periods=n_months, freq='MS')
+    t = np.arange(n_months)
+    frames = []
+    for i in range(n_series):
+        level = rng.uniform(1e4, 1e6)
+        y = level * (1 + 0.001 * t) * (1 + 0.2 * np.sin(2 * np.pi * t / 12 + rng.uniform(0, 6))) \
+            + rng.normal(0, 0.05 * level, n_months)
+        frames.append(pd.DataFrame({'state': 'series_%03d' % i, 'ds': ds, 'y': y}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--series', type=int, default=52)
+    parser.add_argument('--backend', default='local', choices=['local', 'spark'])
+    parser.add_argument('--max-cores', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    history = monthly_series(args.series)
+    cores = [1]
+    while cores[-1] * 2 <= args.max_cores:
+        cores.append(cores[-1] * 2)
+
+    print('%6s %10s %14s %8s' % ('cores', 'seconds', 'models/min', 'speedup'))
+    baseline = None
+    for n in cores:
+        if args.backend == 'local':
+            (_, metrics), elapsed = timed(forecast_states_local, history, CLAIMS_MODEL, 24, 'MS', max_workers=n)
+        else:
+            spark = local_spark('bench_forecasting', cores=n)
+            sdf = spark.createDataFrame(history)
+            (_, metrics), elapsed = timed(lambda: [df.toPandas() for df in forecast_states_spark(
+                sdf, CLAIMS_MODEL, 24, 'MS', num_partitions=n)])
+            spark.stop()
+        baseline = baseline or elapsed
+        print('%6d %10.2f %14.1f %7.1fx' % (n, elapsed, 60 * args.series / elapsed, baseline / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Time a daily refresh of the claims table: full rewrite vs incremental merge.
+
+The table is first loaded without the latest week of claims, then refreshed with
+the complete file in both modes. A second incremental refresh checks that
+re-running the load is a no-op. Runs on Delta when delta-spark is installed
+(--format delta), otherwise on the Parquet stand-in.
+
+    python -m benchmarks.bench_incremental --claims <claims csv> --format parquet
+"""
+import argparse
+import os
+
+from pyspark.sql.functions import col, max as max_
+
+from benchmarks.bench_cleaning import load_raw
+from benchmarks.common import CLAIMS_FILE, clean_work_dir, local_spark, timed
+from covid_unemp.cleaning import clean_claims
+from covid_unemp.ingest import FULL, INCREMENTAL, write_table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--claims', default=CLAIMS_FILE)
+    parser.add_argument('--format', default='parquet', choices=['parquet', 'delta'])
+    parser.add_argument('--work-dir', default='/tmp/covid_unemp_bench')
+    args = parser.parse_args()
+
+    spark = local_spark('bench_incremental', delta=args.format == 'delta')
+    claims = clean_claims(load_raw(spark, args.claims)).cache()
+    latest = claims.agg(max_('date')).collect()[0][0]
+    previous = claims.where(col('date') < latest)
+
+    results = {}
+    for mode in (FULL, INCREMENTAL):
+        path = os.path.join(args.work_dir, '%s_claims' % mode)
+        write_table(spark, previous, path, mode=FULL, fmt=args.format, partition_by='state')
+        changed, elapsed = timed(lambda: write_table(spark, claims, path, mode=mode, fmt=args.format,
+                                                     partition_by='state', lookback_days=28).count())
+        results[mode] = elapsed
+        print('%-12s refresh: %8.2fs, %d rows written' % (mode, elapsed, changed))
+
+    path = os.path.join(args.work_dir, '%s_claims' % INCREMENTAL)
+    rerun = write_table(spark, claims, path, mode=INCREMENTAL, fmt=args.format, partition_by='state',
+                        lookback_days=28).count()
+    print('re-run of the incremental refresh wrote %d rows' % rerun)
+    print('speedup: %.1fx' % (results[FULL] / results[INCREMENTAL]))
+    spark.stop()
+    clean_work_dir(args.work_dir)
+
+
+if __name__ == '__main__':
+    main()
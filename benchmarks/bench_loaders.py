@@ -0,0 +1,94 @@
+"""Load time and peak memory of the CSV sources: inferSchema + cleanup vs the declared-schema loaders.
+
+Every measurement runs in a fresh process (and JVM) so the peak memory of one
+run does not leak into the next.
+
+    python -m benchmarks.bench_loaders --factors 1 10 100
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.common import (CLAIMS_FILE, clean_work_dir, consume, jvm_peak_rss_mb, local_spark,
+                               python_peak_rss_mb, replicated_inputs, timed)
+
+SOURCES = {
+    'claims': CLAIMS_FILE,
+    'population': 'data/emp_civilian_nonInstPop_states_1976_2020.csv',
+    'covid_states': 'coviddata/us-states.csv',
+}
+
+POPULATION_COLUMNS = {
+    'FIPS Code': 'FIPS_Code', 'State and area': 'State_and_area', 'Year': 'Year', 'Month': 'Month',
+    'Civilian non-institutional population': 'population', 'Total': 'Total',
+    'Percent of population': 'Percent_of_population', 'Total Employment ': 'Total_Employment',
+    'Employment As Percent of population': 'Employment_As_Percent_of_population',
+    'Total Unemployment': 'Total_Unemployment', 'Unemployment Rate': 'Unemployment_Rate',
+}
+
+
+def inferred(spark, source, path):
+    """How the notebook loaded the source before the declared-schema loaders."""
+    from pyspark.sql.functions import col
+    from pyspark.sql.types import StructType
+    from benchmarks.bench_cleaning import load_raw
+    from covid_unemp.cleaning import clean_claims
+    from covid_unemp.loaders import COVID_STATES_SCHEMA
+    if source == 'claims':
+        return clean_claims(load_raw(spark, path))
+    if source == 'population':
+        df = spark.read.format('csv').option('header', 'true').option('inferSchema', 'true').load(path)
+        return df.select(*[col('`%s`' % c).alias(alias) for c, alias in POPULATION_COLUMNS.items()])
+    # the COVID file always had a schema, only without the corrupt record column
+    schema = StructType(COVID_STATES_SCHEMA.fields[:-1])
+    return spark.read.format('csv').option('header', 'true').schema(schema).load(path)
+
+
+def declared(spark, source, path):
+    from covid_unemp import loaders
+    load = {'claims': loaders.load_claims, 'population': loaders.load_population,
+            'covid_states': loaders.load_covid_states}[source]
+    return load(spark, path).data
+
+
+def worker(variant, source, path):
+    spark = local_spark('bench_loaders')
+    load = inferred if variant == 'inferSchema' else declared
+    _, elapsed = timed(lambda: consume(load(spark, source, path)))
+    print(json.dumps({'seconds': elapsed, 'jvm_peak_mb': jvm_peak_rss_mb(spark),
+                      'python_peak_mb': python_peak_rss_mb()}))
+    spark.stop()
+
+
+def measure(variant, source, path):
+    out = subprocess.run([sys.executable, '-m', 'benchmarks.bench_loaders', '--worker', variant, source, path],
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--factors', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--work-dir', default='/tmp/covid_unemp_bench')
+    parser.add_argument('--worker', nargs=3, metavar=('VARIANT', 'SOURCE', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        return worker(*args.worker)
+
+    print('%-13s %7s %-12s %9s %13s %16s' % ('source', 'factor', 'loader', 'seconds', 'jvm peak MB', 'python peak MB'))
+    for source, src in SOURCES.items():
+        if not os.path.exists(src):
+            print('%-13s skipped, %s not found' % (source, src))
+            continue
+        for factor, path in replicated_inputs(src, args.factors, args.work_dir).items():
+            for variant in ('inferSchema', 'declared'):
+                r = measure(variant, source, path)
+                print('%-13s %7d %-12s %9.2f %13.0f %16.0f' % (source, factor, variant, r['seconds'],
+                                                                r['jvm_peak_mb'] or 0, r['python_peak_mb']))
+    clean_work_dir(args.work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Latency of state/period slices: group-by over the claims facts vs a slice of the materialized rollup.
+
+    python -m benchmarks.bench_rollups --claims <claims csv>
+"""
+import argparse
+import os
+import random
+
+from pyspark.sql import functions as F
+
+from benchmarks.common import CLAIMS_FILE, clean_work_dir, local_spark, timed
+from covid_unemp.ingest import PERIODS
+from covid_unemp.loaders import load_claims
+from covid_unemp.rollups import ALL_STATES, refresh_rollup, rollup_slice
+
+MEASURES = ['Initial_Claims', 'Continued_Claims', 'Insured_Unemployment_Rate']
+
+
+def group_by(facts, grain, state):
+    if state != ALL_STATES:
+        facts = facts.where(F.col('state') == state)
+    return facts.groupBy(PERIODS[grain]('date').alias('period')).agg(*[F.sum(m).alias(m) for m in MEASURES])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--claims', default=CLAIMS_FILE)
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--work-dir', default='/tmp/covid_unemp_bench')
+    args = parser.parse_args()
+
+    spark = local_spark('bench_rollups')
+    facts_path = os.path.join(args.work_dir, 'claims')
+    rollup_path = os.path.join(args.work_dir, 'claims_rollup')
+    load_claims(spark, args.claims).data.write.mode('overwrite').partitionBy('state').parquet(facts_path)
+    facts = spark.read.parquet(facts_path)
+    _, build = timed(refresh_rollup, spark, facts, rollup_path, MEASURES, fmt='parquet')
+    rollup = spark.read.parquet(rollup_path)
+    print('rollup built in %.2fs' % build)
+
+    states = [r.state for r in facts.select('state').distinct().collect()] + [ALL_STATES]
+    random.seed(0)
+    queries = [(random.choice(['week', 'month']), random.choice(states)) for _ in range(args.queries)]
+    for name, query in (('group-by', lambda g, s: group_by(facts, g, s)),
+                        ('rollup', lambda g, s: rollup_slice(rollup, g, s))):
+        latencies = sorted(timed(lambda: query(grain, state).collect())[1] for grain, state in queries)
+        print('%-9s median %.3fs  max %.3fs' % (name, latencies[len(latencies) // 2], latencies[-1]))
+    spark.stop()
+    clean_work_dir(args.work_dir)
+
+
+if __name__ == '__main__':
+    main()
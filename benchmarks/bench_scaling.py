@@ -0,0 +1,168 @@
+"""Every stage of the pipeline on synthetic data at 1x, 10x, 100x the state level data.
+
+For each factor the synthetic claims, population and COVID files are generated
+(covid_unemp.synthetic) and a fresh process runs the stages one after the
+other on a local Spark session: cleaning (the loaders), population joins,
+rollups, weekly join and Prophet fits. Each stage records its wall time, rows,
+the shuffle / spill bytes and peak execution memory of its Spark stages and the
+peak resident memory of the driver JVM and Python process so far. The results
+are appended to a JSON file to track regressions across commits.
+
+    python -m benchmarks.bench_scaling --factors 1 10 100 --output bench_scaling.json
+    python -m benchmarks.bench_scaling --factors 1 --freq D --years 5
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+
+from benchmarks.common import clean_work_dir, consume, jvm_peak_rss_mb, local_spark, python_peak_rss_mb, timed
+from covid_unemp.profiling import spark_stage_metrics
+from covid_unemp.synthetic import Scale, write_csv
+
+STAGES = ['cleaning', 'population_joins', 'rollups', 'weekly_join', 'prophet_fits']
+
+
+def run_stages(spark, paths, stages, max_series):
+    """Run the stages in order, yielding (stage, rows); every stage materializes what the next ones need."""
+    from pyspark.sql.functions import col, max as max_
+
+    from covid_unemp import loaders
+    from covid_unemp.forecasting import CLAIMS_MODEL, forecast_states_spark
+    from covid_unemp.joins import claims_with_population, covid_with_population, weekly_claims_covid
+    from covid_unemp.pipeline import CLAIMS_MEASURES, COVID_MEASURES
+    from covid_unemp.population import population_dim
+    from covid_unemp.rollups import ALL_STATES, build_rollup
+
+    frames = {}
+
+    def materialize(name, df):
+        frames[name] = df.cache()
+        consume(frames[name])
+        return frames[name].count()
+
+    # stages that are not selected still run when a later stage needs their output, only unmeasured
+    selected = set(stages)
+    needed = set(STAGES[:max(STAGES.index(s) for s in stages) + 1])
+
+    if 'cleaning' in needed:
+        rows = materialize('claims', loaders.load_claims(spark, paths['claims']).data)
+        rows += materialize('covid', loaders.load_covid_states(spark, paths['covid_states']).data)
+        rows += materialize('population', loaders.load_population(spark, paths['population']).data)
+        yield 'cleaning', rows, 'cleaning' in selected
+    if 'population_joins' in needed:
+        latest = max(frames['claims'].agg(max_('date')).collect()[0][0],
+                     frames['covid'].agg(max_('date')).collect()[0][0])
+        materialize('dim', population_dim(frames['population'], latest))
+        rows = materialize('claims_joined', claims_with_population(frames['claims'], frames['dim']))
+        rows += materialize('covid_joined', covid_with_population(frames['covid'], frames['dim']))
+        yield 'population_joins', rows, 'population_joins' in selected
+    if 'rollups' in needed:
+        rows = materialize('claims_rollup', build_rollup(spark, frames['claims'], CLAIMS_MEASURES))
+        rows += materialize('covid_rollup', build_rollup(spark, frames['covid_joined'], COVID_MEASURES))
+        yield 'rollups', rows, 'rollups' in selected
+    if 'weekly_join' in needed:
+        rows = materialize('covid_unemp', weekly_claims_covid(frames['claims_joined'], frames['covid_rollup']))
+        yield 'weekly_join', rows, 'weekly_join' in selected
+    if 'prophet_fits' in needed:
+        rollup = frames['claims_rollup']
+        states = [r[0] for r in rollup.where(col('state') != ALL_STATES).select('state').distinct()
+                  .orderBy('state').limit(max_series).collect()]
+        history = rollup.where((col('grain') == 'month') & col('state').isin(states))\
+            .select('state', col('period').alias('ds'), col('Initial_Claims').alias('y'))
+        forecasts, metrics = forecast_states_spark(history, CLAIMS_MODEL, periods=24, freq='MS')
+        rows = forecasts.count()
+        metrics.toPandas()
+        yield 'prophet_fits', rows, True
+
+
+def worker(factor, args_json):
+    args = json.loads(args_json)
+    scale = Scale.factor(factor, years=args['years'], freq=args['freq'], seed=args['seed'])
+    work_dir = os.path.join(args['work_dir'], '%dx' % factor)
+    paths, generate_seconds = timed(write_csv, scale, work_dir)
+
+    spark = local_spark('bench_scaling')
+    results = [{'factor': factor, 'stage': 'generate', 'entities': scale.entities, 'seconds': generate_seconds}]
+    stages = iter(run_stages(spark, paths, args['stages'], args['max_series']))
+    for n in itertools.count():
+        group = 'bench_scaling_%d_%d' % (factor, n)
+        spark.sparkContext.setJobGroup(group, group)
+        try:
+            (stage, rows, measured), seconds = timed(next, stages)
+        except StopIteration:
+            break
+        if not measured:
+            continue
+        results.append(dict({'factor': factor, 'stage': stage, 'entities': scale.entities, 'rows': rows,
+                             'seconds': seconds, 'jvm_peak_mb': jvm_peak_rss_mb(spark),
+                             'python_peak_mb': python_peak_rss_mb()},
+                            **spark_stage_metrics(spark, group)))
+    spark.stop()
+    clean_work_dir(work_dir)
+    print(json.dumps(results))
+
+
+def measure(factor, args):
+    config = json.dumps({k: getattr(args, k) for k in ('years', 'freq', 'seed', 'work_dir', 'stages', 'max_series')})
+    out = subprocess.run([sys.executable, '-m', 'benchmarks.bench_scaling', '--worker', str(factor), config],
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--factors', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--years', type=int, default=33)
+    parser.add_argument('--freq', default='W-SAT', help="claims frequency: W-SAT (weekly, as filed) or D (daily)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+    parser.add_argument('--max-series', type=int, default=50, help='states fitted by the prophet_fits stage')
+    parser.add_argument('--output', default='bench_scaling.json')
+    parser.add_argument('--work-dir', default='/tmp/covid_unemp_bench/scaling')
+    parser.add_argument('--worker', nargs=2, metavar=('FACTOR', 'CONFIG'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        return worker(int(args.worker[0]), args.worker[1])
+
+    run = {
+        'run_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'config': {'years': args.years, 'freq': args.freq, 'seed': args.seed, 'max_series': args.max_series},
+        'results': [],
+    }
+    print('%7s %-17s %9s %9s %12s %12s %12s' % ('factor', 'stage', 'rows', 'seconds', 'shuffle MB', 'spill MB',
+                                                'jvm peak MB'))
+    for factor in args.factors:
+        for r in measure(factor, args):
+            run['results'].append(r)
+            print('%7d %-17s %9s %9.2f %12.1f %12.1f %12s' % (
+                factor, r['stage'], r.get('rows', ''), r['seconds'],
+                (r.get('shuffle_read_bytes', 0) + r.get('shuffle_write_bytes', 0)) / 1e6,
+                r.get('spill_bytes', 0) / 1e6, '%.0f' % r['jvm_peak_mb'] if r.get('jvm_peak_mb') else ''))
+
+    runs = []
+    if os.path.exists(args.output):
+        with open(args.output) as f:
+            runs = json.load(f)
+    runs.append(run)
+    with open(args.output, 'w') as f:
+        json.dump(runs, f, indent=1, default=str)
+    clean_work_dir(args.work_dir)
+
+
+if __name__ == '__main__':
+    main()
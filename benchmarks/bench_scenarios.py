@@ -0,0 +1,59 @@
+"""Latency of what-if scenarios of the COVID cases regressor: vectorized vs one predict call per scenario.
+
+Fits the causal UI claims model of the notebook (weekly claims with COVID cases
+as additional regressor) on synthetic data and evaluates sampled case paths
+with covid_unemp.scenarios.ScenarioEngine and with Prophet's predict per
+scenario (on --loop scenarios, extrapolated).
+
+    python -m benchmarks.bench_scenarios --scenarios 100 1000 10000
+"""
+import argparse
+import logging
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.common import timed
+from covid_unemp.forecasting import prophet_class
+from covid_unemp.scenarios import ScenarioEngine, sampled_paths
+
+CAUSAL_MODEL = dict(daily_seasonality=False, yearly_seasonality=True, weekly_seasonality=True)
+
+
+def causal_history(weeks=70, seed=0):
+    rng = np.random.RandomState(seed)
+    ds = pd.date_range('2019-01-05', periods=weeks, freq='W-SAT')
+    cases = np.r_[np.zeros(weeks - 10), np.cumsum(rng.uniform(0, 1e4, 10))]
+    y = 2e5 + 3 * cases + 1e4 * np.sin(2 * np.pi * np.arange(weeks) / 52) + rng.normal(0, 2e3, weeks)
+    return pd.DataFrame({'ds': ds, 'y': y, 'causal': cases})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--periods', type=int, default=30, help='weeks forecast')
+    parser.add_argument('--loop', type=int, default=20, help='scenarios evaluated with one predict call each')
+    args = parser.parse_args()
+    logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
+
+    history = causal_history()
+    model = prophet_class()(**CAUSAL_MODEL)
+    model.add_regressor('causal')
+    model.fit(history)
+    future = model.make_future_dataframe(periods=args.periods, freq='W-SAT')
+    future['causal'] = np.r_[history['causal'].to_numpy(), np.full(args.periods, history['causal'].iloc[-1])]
+
+    engine = ScenarioEngine(model, future)
+    print('setup (2 predict calls): %.3f s' % engine.setup_seconds)
+    print('%10s %18s %18s %10s' % ('scenarios', 'vectorized ms/1k', 'predict ms/1k', 'speedup'))
+    loop_paths = sampled_paths(engine.baseline(), args.loop, start=len(history))
+    _, loop_seconds = timed(lambda: [model.predict(future.assign(causal=path)) for path in loop_paths])
+    loop_per_1000 = loop_seconds * 1000.0 / args.loop
+    for n in args.scenarios:
+        paths = sampled_paths(engine.baseline(), n, start=len(history))
+        per_1000 = engine.latency_per_1000(paths)
+        print('%10d %18.3f %18.0f %9.0fx' % (n, 1000 * per_1000, 1000 * loop_per_1000, loop_per_1000 / per_1000))
+
+
+if __name__ == '__main__':
+    main()
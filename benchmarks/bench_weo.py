@@ -0,0 +1,35 @@
+"""Load time of the IMF WEO data: parsing the CSV (cold, building the Parquet cache) vs reading the cache.
+
+    python -m benchmarks.bench_weo --repeat 5
+"""
+import argparse
+import statistics
+
+from benchmarks.common import clean_work_dir, timed
+from covid_unemp.weo import GDP_GROWTH, UNEMPLOYMENT_RATE, WEO_FILE, load_weo
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--weo', default=WEO_FILE)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--chunksize', type=int, default=256)
+    parser.add_argument('--work-dir', default='/tmp/covid_unemp_bench/weo_cache')
+    args = parser.parse_args()
+
+    runs = {
+        'cold': lambda: load_weo(args.weo, args.work_dir, refresh=True, chunksize=args.chunksize),
+        'cached': lambda: load_weo(args.weo, args.work_dir),
+        'cached, 2 indicators of USA': lambda: load_weo(args.weo, args.work_dir, subjects=[UNEMPLOYMENT_RATE, GDP_GROWTH],
+                                                        isos=['USA']),
+    }
+    print('%-28s %10s %10s %9s' % ('load', 'median s', 'min s', 'rows'))
+    for name, run in runs.items():
+        results = [timed(run) for _ in range(args.repeat)]
+        times = [elapsed for _, elapsed in results]
+        print('%-28s %10.3f %10.3f %9d' % (name, statistics.median(times), min(times), len(results[-1][0])))
+    clean_work_dir(args.work_dir)
+
+
+if __name__ == '__main__':
+    main()
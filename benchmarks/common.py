@@ -0,0 +1,89 @@
+"""Helpers shared by the benchmark scripts.
+
+The benchmarks run against a local Spark session, e.g.
+
+    python -m benchmarks.bench_cleaning --claims coviddata/State_UI_claims_allstates_1987_Apr182020.csv
+"""
+import os
+import shutil
+import time
+
+CLAIMS_FILE = 'coviddata/State_UI_claims_allstates_1987_Apr182020.csv'
+
+
+def local_spark(app_name, cores='*', delta=False):
+    """Local Spark session; with delta=True the delta-spark package is configured."""
+    from pyspark.sql import SparkSession
+    builder = (SparkSession.builder
+               .master('local[%s]' % cores)
+               .appName(app_name)
+               .config('spark.ui.showConsoleProgress', 'false'))
+    if delta:
+        from delta import configure_spark_with_delta_pip
+        builder = configure_spark_with_delta_pip(
+            builder.config('spark.sql.extensions', 'io.delta.sql.DeltaSparkSessionExtension')
+                   .config('spark.sql.catalog.spark_catalog', 'org.apache.spark.sql.delta.catalog.DeltaCatalog'))
+    return builder.getOrCreate()
+
+
+def timed(fn, *args, **kwargs):
+    """Run fn and return (result, elapsed seconds)."""
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def consume(df):
+    """Force full evaluation of df without collecting it to the driver."""
+    df.write.format('noop').mode('overwrite').save()
+
+
+def replicate_csv(src, dst, factor):
+    """Write a copy of the CSV file src to dst with its data rows repeated factor times."""
+    if os.path.exists(dst):
+        return dst
+    os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+    with open(src) as f:
+        header = f.readline()
+        body = f.read()
+    if body and not body.endswith('\n'):
+        body += '\n'
+    with open(dst, 'w') as out:
+        out.write(header)
+        for _ in range(factor):
+            out.write(body)
+    return dst
+
+
+def replicated_inputs(src, factors, work_dir):
+    """Return {factor: path} for src replicated by each factor (1 is src itself)."""
+    paths = {}
+    for factor in factors:
+        if factor == 1:
+            paths[factor] = src
+        else:
+            name = '%dx_%s' % (factor, os.path.basename(src))
+            paths[factor] = replicate_csv(src, os.path.join(work_dir, name), factor)
+    return paths
+
+
+def clean_work_dir(work_dir):
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def python_peak_rss_mb():
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def jvm_peak_rss_mb(spark):
+    """Peak resident memory of the driver JVM (VmHWM), None when /proc is not available."""
+    pid = spark.sparkContext._jvm.java.lang.ProcessHandle.current().pid()
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        return None
+
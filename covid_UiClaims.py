@@ -1,7 +1,6 @@
 # Databricks notebook source
 # MAGIC %sh 
 # MAGIC pip install --upgrade pip
-# MAGIC pip3 install wget 
 # MAGIC #pip3 to install for python 3
 
 # COMMAND ----------
@@ -13,355 +12,346 @@ logging.getLogger("py4j").setLevel(logging.ERROR)
 
 # COMMAND ----------
 
-import wget
-url = 'https://covid.ourworldindata.org/data/owid-covid-data.csv'
+# DBTITLE 1,Download UI claims (1987 to April 18 2020), COVID19 state wise data and population of US states
+# the files are kept in a content-addressed cache: a file is only downloaded again when the server reports a change
+# (ETag/Last-Modified), and not even checked within an hour of the last check. fetch_mode cached: no requests for
+# files already cached; offline: cached files or the files bundled in data/ (population) only. A file that cannot be
+# revalidated because the server is unreachable or answers with a 5xx error is used from the cache (status stale)
+from covid_unemp.fetch import fetch_all
+
+dbutils.widgets.dropdown("fetch_mode", "revalidate", ["revalidate", "cached", "offline"])
+dataFiles = fetch_all(["ui_claims", "covid_states", "population"], "/dbfs/FileStore/fetch_cache", mode=dbutils.widgets.get("fetch_mode"), max_age=3600)
+for name, (path, status) in dataFiles.items():
+  print(name + ": " + status + " " + path)
 
 # COMMAND ----------
 
-# DBTITLE 1,Load Unemployment Insurance (UI) Claims data (from 1987 to April 18 2020) of US states
-# MAGIC %sh
-# MAGIC wget 'https://raw.githubusercontent.com/Roopana/CovidAnalysis/master/data/State_UI_claims_allstates_1987_Apr182020.csv'
-# MAGIC mkdir coviddata
-# MAGIC mv *.csv coviddata/
-# MAGIC ls coviddata
+# DBTITLE 1,Load mode
+# incremental: only new or changed rows (keyed on state, date) are merged into the DELTA tables
+# full: the DELTA tables are rewritten from scratch (needed once when a table schema changes)
+from covid_unemp.ingest import write_table, register_table, affected_periods, restrict_to
+from covid_unemp.profiling import Profiler
+
+dbutils.widgets.dropdown("load_mode", "incremental", ["incremental", "full"])
+load_mode = dbutils.widgets.get("load_mode")
+
+# profile=true records the time, memory and Spark metrics of every stage of this run (see the Run profile cell)
+dbutils.widgets.dropdown("profile", "false", ["false", "true"])
+profiler = Profiler(spark=spark, enabled=dbutils.widgets.get("profile") == "true")
+
+# rows of the CSV files that cannot be parsed are added to this table (once per source and row) instead of being loaded
+rejectedRowsPath = "/FileStore/tables/rejected_rows_delta"
 
 # COMMAND ----------
 
+# DBTITLE 1,Load and clean UI claims data
 # define path to file
-filepath = 'file:/databricks/driver/coviddata/State_UI_claims_allstates_1987_Apr182020.csv'
+filepath = 'file:' + dataFiles["ui_claims"][0]
 
-# load CSV data using sqlContext 
+# load CSV data with a declared schema in a single pass
 #Not Seasonally adjusted unemployment claim data
-unempClaimData = sqlContext.read.format("csv")\
-      .option("header", "true")\
-      .option("inferSchema", "true")\
-      .load(filepath)
+# few numbers have commas in their values and dates are strings (MM/dd/yyyy). They are cleaned with
+# native column expressions while loading, only the numeric columns are stripped of commas
+from pyspark.sql.functions import col
+from covid_unemp.loaders import load_claims, load_covid_states, load_population, quarantine
+
+with profiler.stage("load claims", "load") as s:
+  unempClaimData_cleaned, unempClaimData_rejected = load_claims(spark, filepath)
+  quarantine(unempClaimData_rejected, rejectedRowsPath)
+  s.output(unempClaimData_cleaned)
 
-display(unempClaimData)
+display(unempClaimData_cleaned)
 
 # COMMAND ----------
 
 # DBTITLE 1,Create DELTA table of UI Claims and partition by State for query optimization
-from pyspark.sql.functions import col
-
-unempClaimData = unempClaimData.select(col("State"), col('Filed week ended').alias("Filed_week_ended"), col("Initial Claims").alias("Initial_Claims"), col("Reflecting Week Ended").alias("Reflecting_Week_Ended"), col("Continued Claims").alias("Continued_Claims"), col("Covered Employment").alias("Covered_Employment"), col("Insured Unemployment Rate").alias("Insured_Unemployment_Rate"))
-
-dbutils.fs.rm("dbfs:/FileStore/tables/unempClaimData_delta", True)
-spark.sql("DROP TABLE IF EXISTS unempClaimData_delta")
-
-unempClaimData.write.partitionBy("State").format("delta").save("/FileStore/tables/unempClaimData_delta")
-spark.sql("CREATE TABLE unempClaimData_delta USING DELTA LOCATION '/FileStore/tables/unempClaimData_delta/'")
+# the department of labor revises the last weeks of claims, hence compare 4 weeks back from the latest stored week
+with profiler.stage("write claims", "write") as s:
+  claimsChanged = write_table(spark, unempClaimData_cleaned, "/FileStore/tables/unempClaimData_delta", mode=load_mode, partition_by="state", lookback_days=28)
+  register_table(spark, "unempClaimData_delta", "/FileStore/tables/unempClaimData_delta/")
+  claimsChangedRows = claimsChanged.count()
+  s.output(claimsChangedRows)
+print("UI claim rows added or updated: " + str(claimsChangedRows))
 
 spark.sql("SELECT * from unempClaimData_delta").show(5)
 # display data in table format
 
 # COMMAND ----------
 
-unempClaimData_partd = spark.sql("SELECT * from unempClaimData_delta")
-
-# COMMAND ----------
-
-# DBTITLE 1,Data cleaning
-import re
-from pyspark.sql.functions import UserDefinedFunction
-from pyspark.sql.types import *
+# DBTITLE 1,Stages shared by several cells
+# every action recomputes the lineage of a DataFrame back to the source unless it is persisted. The intermediates used
+# by several cells are declared here with their storage level, partitioning and consuming cells. Each one is persisted
+# and cached with a count() on first use and unpersisted when its last consumer finished (the report at the end gives
+# how often each is expected to be computed; StageGraph(measure=True) also counts the computations, at the cost of
+# a Python worker pass over every stage)
+from pyspark import StorageLevel
+from covid_unemp.stages import StageGraph
 
-# few numbers have commas in their values, remove them
-commaRep = UserDefinedFunction(lambda x: re.sub(',','',str(x)), StringType())
-unempClaimData_partd_c = unempClaimData_partd.select(*[commaRep(column).alias(column) for column in unempClaimData_partd.columns])
-
-from pyspark.sql.functions import unix_timestamp
-from pyspark.sql.functions import from_unixtime
-
-unempClaimData_partd_cleaned = unempClaimData_partd_c.select('State', 'Filed_week_ended', 'Initial_Claims', 'Reflecting_Week_Ended', 'Continued_Claims', 'Covered_Employment', 'Insured_Unemployment_Rate', from_unixtime(unix_timestamp('Filed_week_ended', 'MM/dd/yyy')).alias('Filed_week_ended_fixed'), from_unixtime(unix_timestamp('Reflecting_Week_Ended', 'MM/dd/yyy')).alias('Reflecting_Week_Ended_fixed'))
-
-unempClaimData_partd_cleaned.show(3)
+stages = StageGraph()
+stages.add("claims", lambda: spark.sql("SELECT * from unempClaimData_delta"), partition_by="state",
+           consumers=["final view", "claims rollup", "weekly join"])
 
 # COMMAND ----------
 
 # DBTITLE 1,create final view for partioned and cleaned UI claims data
-from pyspark.sql.types import StructField, StructType, StringType, LongType, TimestampType
-from pyspark.sql.functions import col, to_date
+from pyspark.sql.functions import max as max_
 
-unempClaimData_final = unempClaimData_partd_cleaned.select( col('state'), to_date(col('Filed_week_ended_fixed')).alias('date'), col('Initial_Claims').cast('Long'), to_date(col('Reflecting_Week_Ended_fixed')), col('Continued_Claims').cast('Long'), col('Covered_Employment').cast('Long'), col('Insured_Unemployment_Rate').cast('Double') )
-unempClaimData_final.repartition("state")
-unempClaimData_final.show(5)
-unempClaimData_final.createOrReplaceTempView("unemp_table")
+with stages.consume("final view", "claims", actions=2) as (unempClaimData_final,):
+  unempClaimData_final.show(5)
+  unempClaimData_final.createOrReplaceTempView("unemp_table")
+  maxClaimDate = unempClaimData_final.agg(max_("date")).collect()[0][0]
 
-maxClaimDate = spark.sql("SELECT MAX(date) FROM unemp_table").collect()[0][0]
 print("UI Claim data is available till: "+ str(maxClaimDate))
 # the unemployment claims data is available till 2020-04-18
 
 # COMMAND ----------
 
+# DBTITLE 1,Rollup of UI claims by state and day/week/month
+# aggregated once per refresh (only the periods with changed claims), the views below query this table
+from covid_unemp.rollups import refresh_rollup
+
+with profiler.stage("claims rollup", "aggregate"), stages.consume("claims rollup", "claims") as (unempClaimData_final,):
+  refresh_rollup(spark, unempClaimData_final, "/FileStore/tables/claims_rollup_delta", ["Initial_Claims", "Continued_Claims", "Insured_Unemployment_Rate"], changed=claimsChanged, mode=load_mode)
+  register_table(spark, "claims_rollup_delta", "/FileStore/tables/claims_rollup_delta/")
+
+# COMMAND ----------
+
 # DBTITLE 1,Plot state wise UI claims in 2020(Result #4 in the report)
-# MAGIC %matplotlib inline
-# MAGIC import matplotlib.pyplot as plt
-# MAGIC 
-# MAGIC unempClaim2020 = unempClaimData_final.where(col("date")>= "2020-01-01").toPandas()
-# MAGIC 
-# MAGIC unempClaim2020.set_index('date', inplace=True)
-# MAGIC unempClaim2020.groupby('state')['Initial_Claims'].plot(figsize=(15,7), rot = 90, title='UI cliams across US states in 2020')
-# MAGIC plt.legend(bbox_to_anchor=(1.05,1))
-# MAGIC plt.show()
+# the plotted points are selected per state by Spark (covid_unemp.plots), only they are transferred to the driver.
+# Every figure is also added to reportFigures, which are written to results/ at the end of the notebook
+from covid_unemp.plots import PlotSpec, draw
+
+reportFigures = []
+unempClaim2020Plot = PlotSpec("ui_claims_states_2020", lambda: spark.sql("SELECT state, period as date, Initial_Claims from claims_rollup_delta where grain = 'day' and state != 'All States' and period >= '2020-01-01'"), "date", "Initial_Claims", series="state", title='UI cliams across US states in 2020')
+reportFigures.append(unempClaim2020Plot)
+display(draw(unempClaim2020Plot))
 
 # COMMAND ----------
 
 # DBTITLE 1,Display UI claims in 2020 (top 20 states)
-display(spark.sql("SELECT state, SUM(Initial_Claims), date FROM unemp_table where date> '2020-03-01' GROUP BY state, date ORDER BY date, sum(Initial_Claims) DESC"))
+display(spark.sql("SELECT state, Initial_Claims, period as date FROM claims_rollup_delta where grain = 'day' and state != 'All States' and period > '2020-03-01' ORDER BY date, Initial_Claims DESC"))
 
 # COMMAND ----------
 
 # DBTITLE 1,Get Statistics on UI claims by states (Result #4 in the report)
-result3 = spark.sql("SELECT state, SUM(Initial_Claims) as Initial_Claims, sum(Insured_Unemployment_Rate) as Insured_Unemployment_Rate FROM unemp_table where date> '2020-03-01' GROUP BY state ORDER BY SUM(Initial_Claims) DESC")
-result3.describe(['Initial_Claims', 'Insured_Unemployment_Rate']).show()
+result3 = spark.sql("SELECT state, SUM(Initial_Claims) as Initial_Claims, sum(Insured_Unemployment_Rate) as Insured_Unemployment_Rate FROM claims_rollup_delta where grain = 'day' and state != 'All States' and period > '2020-03-01' GROUP BY state ORDER BY SUM(Initial_Claims) DESC")
+
+# describe() statistics in a single pass over result3, then the states with the min/max of both metrics (all tied
+# states, as lists) in one more
+from covid_unemp.summary import summarize
 
-result3.createOrReplaceTempView("result3")
+result3Summary = summarize(result3, ['Initial_Claims', 'Insured_Unemployment_Rate'], keys=['state'])
+display(result3Summary.describe().reset_index())
 
-max_Initial_Claims_State = spark.sql("SELECT * FROM result3 where Initial_Claims == (SELECT MAX(Initial_Claims) FROM result3) ").collect()
+max_Initial_Claims_State = result3Summary['Initial_Claims'].argmax
 print(max_Initial_Claims_State)
-min_Initial_Claims_State = spark.sql("SELECT * FROM result3 where Initial_Claims == (SELECT MIN(Initial_Claims) FROM result3) ").collect()
+min_Initial_Claims_State = result3Summary['Initial_Claims'].argmin
 print(min_Initial_Claims_State)
-max_IUR_State = spark.sql("SELECT * FROM result3 where Insured_Unemployment_Rate == (SELECT MAX(Insured_Unemployment_Rate) FROM result3) ").collect()
+max_IUR_State = result3Summary['Insured_Unemployment_Rate'].argmax
 print(max_IUR_State)
-min_IUR_State = spark.sql("SELECT * FROM result3 where Insured_Unemployment_Rate == (SELECT MIN(Insured_Unemployment_Rate) FROM result3) ").collect()
+min_IUR_State = result3Summary['Insured_Unemployment_Rate'].argmin
 print(min_IUR_State)
 
 # COMMAND ----------
 
-# DBTITLE 1,Download COVID19 US state wise data
-# MAGIC %sh
-# MAGIC wget https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-states.csv
-# MAGIC 
-# MAGIC mv *.csv coviddata/
-# MAGIC ls coviddata
-
-# COMMAND ----------
-
 # DBTITLE 1,Load COVID state wise data
-filepath = 'file:/databricks/driver/coviddata/us-states.csv'
-
-#Schema to load data
-covidStatesSchema = StructType([StructField("date", DateType(), nullable= True), StructField("state", StringType(), True), StructField("fips", IntegerType(), True),StructField("cases", LongType(), True), StructField("deaths", LongType(), True)])
-                                
-# load CSV data based on given schema
-covid_states_raw = sqlContext.read.format("csv")\
-      .option("header", "true").schema(covidStatesSchema).load(filepath)
-covid_states_raw.show(5)
-covid_states_raw.describe()
+filepath = 'file:' + dataFiles["covid_states"][0]
 
-# COMMAND ----------
+# load CSV data based on the declared schema (covid_unemp.loaders.COVID_STATES_SCHEMA)
+with profiler.stage("load covid", "load") as s:
+  covidStatesLoaded = load_covid_states(spark, filepath)
+  quarantine(covidStatesLoaded.rejected, rejectedRowsPath)
+  s.output(covidStatesLoaded.data)
 
-# DBTITLE 1,Get Population Data of US States
-# MAGIC %sh
-# MAGIC rm coviddata/emp_civilian_nonInstPop_state_1976_2020.csv
-# MAGIC wget https://github.com/Roopana/CovidAnalysis/raw/master/data/emp_civilian_nonInstPop_states_1976_2020.csv
-# MAGIC mv *.csv coviddata/
-# MAGIC ls coviddata
+stages.add("covid_raw", lambda: covidStatesLoaded.data, consumers=["covid view", "population dim"])
+with stages.consume("covid view", "covid_raw") as (covid_states_raw,):
+  covid_states_raw.show(5)
+  covid_states_raw.describe()
 
 # COMMAND ----------
 
 # DBTITLE 1,Load Population Data
 # define path to file
-filepath = 'file:/databricks/driver/coviddata/emp_civilian_nonInstPop_states_1976_2020.csv'
-
-unempPopData = sqlContext.read.format("csv")\
-      .option("header", "true")\
-      .option("inferSchema", "true")\
-      .load(filepath)
-#Rename columns appropriately
-unempPopData = unempPopData.select(col("FIPS Code").alias("FIPS_Code"), col('State and area').alias("State_and_area"), col("Year"), col("Month"), col("Civilian non-institutional population").alias("population"), col("Total"), col("Percent of population").alias("Percent_of_population"), col("Total Employment ").alias("Total_Employment"), col("Employment As Percent of population").alias("Employment_As_Percent_of_population"), col("Total Unemployment").alias("Total_Unemployment"), col("Unemployment Rate").alias("Unemployment_Rate"))
+filepath = 'file:' + dataFiles["population"][0]
+
+# load with the declared schema, columns are renamed by the schema and padded values like "56.8   " are trimmed
+with profiler.stage("load population", "load") as s:
+  unempPopData, unempPopData_rejected = load_population(spark, filepath)
+  quarantine(unempPopData_rejected, rejectedRowsPath)
+  s.output(unempPopData)
 # display data in table format
 display(unempPopData)
 
 # COMMAND ----------
 
 # DBTITLE 1,Create DELTA Table for population
-dbutils.fs.rm("dbfs:/FileStore/tables/unempPopData_delta", True)
-spark.sql("DROP TABLE IF EXISTS unempPopData_delta")
+with profiler.stage("write population", "write"):
+  popChanged = write_table(spark, unempPopData, "/FileStore/tables/unempPopData_delta", keys=("State_and_area", "Year", "Month"), mode=load_mode, partition_by="State_and_area")
+  register_table(spark, "unempPopData_delta", "/FileStore/tables/unempPopData_delta/")
 
-unempPopData.write.partitionBy("State_and_area").format("delta").save("/FileStore/tables/unempPopData_delta")
-spark.sql("CREATE TABLE unempPopData_delta USING DELTA LOCATION '/FileStore/tables/unempPopData_delta/'")
+# months of the facts that have to be joined again because their population changed
+from pyspark.sql.functions import expr
+popChangedMonths = popChanged.select(col("State_and_area").alias("state"), expr("make_date(Year, Month, 1)").alias("month")).distinct()
 
 spark.sql("SELECT * from unempPopData_delta").show(5)
 
 # COMMAND ----------
 
-# DBTITLE 1,Extrapolate Population Data for April and May 2020
-# Population data is available only till March 2002 while UI claim data and COVID is till April, May 2020. Hence extrapolate population data
+# DBTITLE 1,Population dimension (extrapolated up to the latest UI claim / COVID date)
+# Population data is available only till March 2020 while UI claim data and COVID is till April, May 2020. Hence the
+# population of the months missing up to the latest date of the facts is filled forward from the last available month
+from covid_unemp.population import population_dim
+from covid_unemp.joins import claims_with_population, covid_with_population, weekly_claims_covid
 
-from pyspark.sql.functions import lit
-unempPopData = spark.sql("SELECT * from unempPopData_delta")
-popDataApr2020 = unempPopData.where(col("Year") == 2020).where(col("Month") ==3).withColumn("Month", lit(4))
-popDataMay2020 = unempPopData.where(col("Year") == 2020).where(col("Month") ==3).withColumn("Month", lit(5))
-popDataApr2020 = popDataApr2020.unionAll(popDataMay2020)
+# the stages are declared before covid_raw is read here: covid_pop keeps it cached until covid_pop is built (a stage
+# declared after its input was released would read the CSV again). The dimension is tiny and broadcast to the joins,
+# it is kept in memory; latestFactDate is read when it is built
+stages.add("population_dim", lambda: population_dim(spark.sql("SELECT * from unempPopData_delta"), until=latestFactDate),
+           storage=StorageLevel.MEMORY_ONLY, consumers=["population dim view"])
+stages.add("claims_joined", claims_with_population, inputs=["claims", "population_dim"], partition_by="state",
+           consumers=["claims joined view", "weekly join"])
+stages.add("covid_pop", covid_with_population, inputs=["covid_raw", "population_dim"], partition_by="state",
+           consumers=["covid pop view", "covid delta"])
 
-#append April and May data to available population data
-unempPopData = unempPopData.unionAll(popDataApr2020)
-unempPopData.show(5)
+with stages.consume("population dim", "covid_raw") as (covid_states_raw,):
+  # the max of an empty or fully rejected load is None; without any fact date the dimension ends with the population data
+  factDates = [d for d in (maxClaimDate, covid_states_raw.agg(max_("date")).collect()[0][0]) if d is not None]
+  latestFactDate = max(factDates) if factDates else None
+
+with profiler.stage("population dim", "join"), stages.consume("population dim view", "population_dim") as (popDim,):
+  popDim.createOrReplaceTempView("population_dim")
+  popDim.where(col("extrapolated")).show(5)
 
 # COMMAND ----------
 
 # DBTITLE 1,Calculate UI claims as % of population
-from pyspark.sql.functions import year, month, expr
-
-joinExpression = [year(unempClaimData_final['date']) == unempPopData['Year'] , month(unempClaimData_final['date']) == unempPopData['Month'] , unempClaimData_final['state'] == unempPopData['State_and_area']]
-
-unempClaimData_joined = unempClaimData_final.join(unempPopData, joinExpression, 'left_outer').select("state", "date", "Initial_Claims", "Continued_Claims", col("population"), col("Total_Employment"), col("Total_Unemployment"), (col("Initial_Claims")*100/col("population")).alias("Inital_Claims_as_%_of_population"), (col("Continued_Claims")*100/col("population")).alias("Continued_Claims_as_%_of_population"), (col("Total_Employment")*100/col("population")).alias("Employment_Rate"))
-
-display(unempClaimData_joined)
+# population is joined on (state, year_month) to the broadcast population dimension
+with stages.consume("claims joined view", "claims_joined") as (unempClaimData_joined,):
+  display(unempClaimData_joined)
 
 # COMMAND ----------
 
 # DBTITLE 1,Time series graph of UI claims in a given state from 1987- 2020 
-from pyspark.sql.functions import concat, lit, format_string
-
-unemp_delta_NJ = unempClaimData_joined.where(col("state") == 'New Jersey').withColumn("month", concat( year(col("date")), lit("-"), format_string("%02d", month(col("date"))) ))
-unemp_delta_NJ.createOrReplaceTempView("unemp_delta_NJ_view")
-
 #aggregat UI claims by month
-unemp_delta_NJ_month = spark.sql("SELECT to_date(month) as month, sum(Initial_Claims)as monthly_ui_claims, first(state) as state from unemp_delta_NJ_view group by month order by month")
+unemp_delta_NJ_month = spark.sql("SELECT period as month, Initial_Claims as monthly_ui_claims, state from claims_rollup_delta where grain = 'month' and state = 'New Jersey' order by month")
 display(unemp_delta_NJ_month)
 
 # COMMAND ----------
 
 # DBTITLE 1,Monthly UI claim data aggregated over all states since 1987 
-from pyspark.sql.functions import concat, lit, format_string
-
-unemp_delta_all_states = unempClaimData_joined.withColumn("year_month", concat( year(col("date")), lit("-"), format_string("%02d", month(col("date"))) ))
-unemp_delta_all_states.createOrReplaceTempView("unemp_delta_all_states_view")
-
 #aggregat UI claims by year_month
-unemp_delta_all_states_month = spark.sql("SELECT to_date(year_month) as year_month, sum(Initial_Claims)as monthly_ui_claims from unemp_delta_all_states_view group by year_month order by year_month")
+unemp_delta_all_states_month = spark.sql("SELECT period as year_month, Initial_Claims as monthly_ui_claims from claims_rollup_delta where grain = 'month' and state = 'All States' order by year_month")
 display(unemp_delta_all_states_month)
 
 # COMMAND ----------
 
 # DBTITLE 1,Plot Monthly UI claims data aggregated over all states since 1987(Result #3 in the report)
-# MAGIC %matplotlib inline
-# MAGIC import matplotlib.pyplot as plt
-# MAGIC 
-# MAGIC unemp_delta_all_states_months_pandas = unemp_delta_all_states_month.toPandas()
-# MAGIC 
-# MAGIC unemp_delta_all_states_months_pandas.set_index('year_month', inplace=True)
-# MAGIC unemp_delta_all_states_months_pandas['monthly_ui_claims'].plot(figsize=(20,7), title='#Monthly UI claim data over all states in US', kind = 'line', fontsize = 10)
-# MAGIC plt.legend(bbox_to_anchor=(1.05,1))
-# MAGIC plt.show()
+unempAllStatesMonthPlot = PlotSpec("ui_claims_all_states_monthly", lambda: unemp_delta_all_states_month, "year_month", "monthly_ui_claims", title='#Monthly UI claim data over all states in US', figsize=(20,7))
+reportFigures.append(unempAllStatesMonthPlot)
+display(draw(unempAllStatesMonthPlot))
 
 # COMMAND ----------
 
 # DBTITLE 1,Calculate COVID cases as % of population
-from pyspark.sql.functions import year, month, expr
-
-joinExpression1 = [year(covid_states_raw['date']) == unempPopData['Year'] , month(covid_states_raw['date']) == unempPopData['Month'] , covid_states_raw['state'] == unempPopData['State_and_area']]
-
-covid_states_pop = covid_states_raw.join(unempPopData, joinExpression1, 'left_outer').select("date", "state", "cases", "deaths", (col("cases")*100/col("population")).alias("cases_as_%_of_population"), (col("deaths")*100/col("population")).alias("deaths_as_%_of_population"))
-
-covid_states_pop.show(5)
-
-# COMMAND ----------
-
-#Partition data by state
-covid_states_pop.repartition("state")
-print("No of partitions after partitioning: "+ str(unempClaimData_partd.rdd.getNumPartitions()))
+# partitioned by state by its stage
+with stages.consume("covid pop view", "covid_pop") as (covid_states_pop,):
+  covid_states_pop.show(5)
+print("No of partitions after partitioning: "+ str(covid_states_pop.rdd.getNumPartitions()))
 
 # COMMAND ----------
 
 # DBTITLE 1,Create DELTA table for COVID data joined with Population
-result2 = covid_states_pop.select("date", "state", "cases", "deaths", col("cases_as_%_of_population").alias("cases_as_p_of_population"), col("deaths_as_%_of_population").alias("deaths_as_p_of_population"))
+# NYT revises the counts of the last days, compare 2 weeks back plus the months with changed population
+with profiler.stage("write covid", "write") as s, stages.consume("covid delta", "covid_pop") as (result2,):
+  covidChanged = write_table(spark, result2, "/FileStore/tables/covidPop_delta", mode=load_mode, lookback_days=14, refresh=popChangedMonths)
+  register_table(spark, "covidPop_delta", "/FileStore/tables/covidPop_delta/")
+  covidChangedRows = covidChanged.count()
+  s.output(covidChangedRows)
+print("COVID rows added or updated: " + str(covidChangedRows))
 
-dbutils.fs.rm("dbfs:/FileStore/tables/covidPop_delta", True)
-spark.sql("DROP TABLE IF EXISTS covidPop_delta")
+spark.sql("SELECT * from covidPop_delta").show(5)
 
-result2.write.format("delta").save("/FileStore/tables/covidPop_delta")
-spark.sql("CREATE TABLE covidPop_delta USING DELTA LOCATION '/FileStore/tables/covidPop_delta/'")
+# COMMAND ----------
 
-spark.sql("SELECT * from covidPop_delta").show(5)
+# DBTITLE 1,Rollup of COVID cases by state and day/week/month
+with profiler.stage("covid rollup", "aggregate"):
+  refresh_rollup(spark, spark.sql("SELECT * from covidPop_delta"), "/FileStore/tables/covid_rollup_delta", ["cases", "deaths", "cases_as_p_of_population", "deaths_as_p_of_population"], changed=covidChanged, mode=load_mode)
+  register_table(spark, "covid_rollup_delta", "/FileStore/tables/covid_rollup_delta/")
 
 # COMMAND ----------
 
 # DBTITLE 1,State wise statistics on COVID cases (Result #2 in the report)
-print(spark.sql("SELECT * FROM covidPop_delta where cases == (SELECT MAX(cases) from covidPop_delta where date == (SELECT MAX(date) from covidPop_delta))").collect())
-print(spark.sql("SELECT * FROM covidPop_delta where cases == (SELECT MIN(cases) from covidPop_delta where date == (SELECT MAX(date) from covidPop_delta)) and date == (SELECT MAX(date) from covidPop_delta)").collect())
+# states with the most and the fewest cases on the latest date (all tied states), in two passes over covidPop_delta
+covidSummary = summarize(spark.sql("SELECT * FROM covidPop_delta"), ['cases'], latest='date', quantiles=None)
+print(covidSummary['cases'].argmax)
+print(covidSummary['cases'].argmin)
 
 # COMMAND ----------
 
 # DBTITLE 1,Plot State wise trends of COVID19 cases
-# MAGIC %matplotlib inline
-# MAGIC import matplotlib.pyplot as plt
-# MAGIC 
-# MAGIC result2P = result2.toPandas()
-# MAGIC 
-# MAGIC result2P.set_index('date', inplace=True)
-# MAGIC result2P.groupby('state')['cases'].plot(figsize=(15,7), rot = 90, title='cases across US states in 2020')
-# MAGIC plt.legend(bbox_to_anchor=(1.05,1))
-# MAGIC plt.show()
+covidStatesPlot = PlotSpec("covid_cases_states", lambda: spark.sql("SELECT state, period as date, cases from covid_rollup_delta where grain = 'day' and state != 'All States'"), "date", "cases", series="state", title='cases across US states in 2020')
+reportFigures.append(covidStatesPlot)
+display(draw(covidStatesPlot))
 
 # COMMAND ----------
 
 # DBTITLE 1,Aggregate COVID data over all states
-covid_all_states = covid_states_pop.sort("date").groupby(col("date")).sum().select(col("date"), col("sum(cases)").alias("cases"), col("sum(deaths)").alias("deaths"), col("sum(cases_as_%_of_population)").alias("cases_as_%_of_population"), col("sum(deaths_as_%_of_population)").alias("deaths_as_%_of_population"))
+covid_all_states = spark.sql("SELECT period as date, cases, deaths, cases_as_p_of_population as `cases_as_%_of_population`, deaths_as_p_of_population as `deaths_as_%_of_population` from covid_rollup_delta where grain = 'day' and state = 'All States' order by date")
 display(covid_all_states)
 
 # COMMAND ----------
 
 # DBTITLE 1,Result #1 in the report - Daily COVID cases aggregated over all states- Statistics
-covid_all_states.describe().show()
+display(summarize(covid_all_states, ['cases', 'deaths', 'cases_as_%_of_population', 'deaths_as_%_of_population']).describe().reset_index())
 
 # COMMAND ----------
 
 # DBTITLE 1,Plot Aggregated COVID data over all states
-# MAGIC %matplotlib inline
-# MAGIC import matplotlib.pyplot as plt
-# MAGIC 
-# MAGIC covid_all_states_pandas = covid_all_states.toPandas()
-# MAGIC 
-# MAGIC covid_all_states_pandas.set_index('date', inplace=True)
-# MAGIC covid_all_states_pandas['cases'].plot(figsize=(18,7), rot = 90, title='# COVID19 Cases aggregated over all states in US', kind = 'bar', fontsize = 8)
-# MAGIC plt.legend(bbox_to_anchor=(1.05,1))
-# MAGIC plt.show()
+covidAllStatesPlot = PlotSpec("covid_cases_all_states", lambda: covid_all_states, "date", "cases", kind='bar', title='# COVID19 Cases aggregated over all states in US', figsize=(18,7))
+reportFigures.append(covidAllStatesPlot)
+display(draw(covidAllStatesPlot))
 
 # COMMAND ----------
 
 # DBTITLE 1,Join UI claims data and COVID state wise data on week of the year 2020
-from pyspark.sql.functions import weekofyear
+with profiler.stage("weekly join", "join") as s, stages.consume("weekly join", "claims_joined", "claims") as (unempClaimData_joined, unempClaimData_final):
+  unempClaimData_2020 = unempClaimData_joined.where(col("date")>= '2020-01-01')
+  if load_mode == "incremental":
+    # only the weeks with new or changed claims, cases or population are joined again
+    popChangedKeys = restrict_to(unempClaimData_final.select("state", "date"), popChangedMonths)
+    changedWeeks = affected_periods(claimsChanged.unionByName(covidChanged).unionByName(popChangedKeys), "week")
+    unempClaimData_2020 = restrict_to(unempClaimData_2020, changedWeeks)
 
-covid_states_week = covid_states_pop.withColumn("week_of_year", weekofyear("date"))
-# Aggregate cases for each week in 2020
-covid_states_week_sum = covid_states_week.groupby("week_of_year", "state").sum().select(col("week_of_year"), col("state"), col("sum(cases)").alias("cases"), col("sum(deaths)").alias("deaths"), col("sum(cases_as_%_of_population)").alias("cases_as_%_of_population"), col("sum(deaths_as_%_of_population)").alias("deaths_as_%_of_population"))
+  # cases of each state and week come from the COVID rollup. Weeks without cases (the initial weeks of 2020) get 0
+  covid_unemp_2020 = weekly_claims_covid(unempClaimData_2020, spark.sql("SELECT * from covid_rollup_delta"))
 
-unempClaimData_2020 = unempClaimData_joined.where(col("date")>= '2020-01-01').withColumn("week_of_year", weekofyear("date"))
+  covidUnempChanged = write_table(spark, covid_unemp_2020, "/FileStore/tables/covid_unemp_2020_delta", mode=load_mode)
+  register_table(spark, "covid_unemp_2020_delta", "/FileStore/tables/covid_unemp_2020_delta")
+  s.output(covidUnempChanged)
 
-covid_unemp_2020 = unempClaimData_2020.join(covid_states_week_sum,['state','week_of_year'],'left_outer')
-# this df has null values for #cases, #deaths in the initial week sof 2020. Fill them with 0
-covid_unemp_2020 = covid_unemp_2020.na.fill(0)
-
-dbutils.fs.rm("dbfs:/FileStore/tables/covid_unemp_2020_delta", True)
-spark.sql("DROP TABLE IF EXISTS covid_unemp_2020_delta")
+spark.sql("SELECT * from covid_unemp_2020_delta").show(5)
 
-covid_unemp_2020.write.format("delta").save("/FileStore/tables/covid_unemp_2020_delta")
-spark.sql("CREATE TABLE covid_unemp_2020_delta USING DELTA LOCATION '/FileStore/tables/covid_unemp_2020_delta'")
+# COMMAND ----------
 
-spark.sql("SELECT * from covid_unemp_2020_delta").show(5)
+# DBTITLE 1,Rollup of UI claims and COVID cases in 2020 by state and day/week/month
+with profiler.stage("covid unemp rollup", "aggregate"):
+  refresh_rollup(spark, spark.sql("SELECT * from covid_unemp_2020_delta"), "/FileStore/tables/covid_unemp_rollup_delta", ["Initial_Claims", "cases", "deaths"], changed=covidUnempChanged, mode=load_mode)
+  register_table(spark, "covid_unemp_rollup_delta", "/FileStore/tables/covid_unemp_rollup_delta/")
 
 # COMMAND ----------
 
-covid_unemp_2020_agg = spark.sql("SELECT week_of_year, sum(Initial_Claims) as Initial_Claims, sum(cases) as cases, sum(deaths) as deaths, first(date) as date from covid_unemp_2020_delta GROUP BY week_of_year ORDER BY week_of_year")
+covid_unemp_2020_agg = spark.sql("SELECT weekofyear(period) as week_of_year, Initial_Claims, cases, deaths, first_date as date from covid_unemp_rollup_delta where grain = 'week' and state = 'All States' ORDER BY week_of_year")
 covid_unemp_2020_agg.show()
 
 # COMMAND ----------
 
 # DBTITLE 1,Plot Cases Vs UI claims
-# MAGIC %matplotlib inline
-# MAGIC import matplotlib.pyplot as plt
-# MAGIC covid_unemp_agg_all_states = covid_unemp_2020.sort("date").groupby(col("date")).sum().select(col("date"), col("sum(Initial_Claims)").alias("Initial_Claims"), col("sum(cases)").alias("cases"))
-# MAGIC display(covid_unemp_agg_all_states)
-# MAGIC covid_unemp_agg_all_states_pandas = covid_unemp_agg_all_states.toPandas()
-# MAGIC 
-# MAGIC covid_unemp_agg_all_states_pandas.set_index('cases', inplace=True)
-# MAGIC covid_unemp_agg_all_states_pandas['Initial_Claims'].plot(figsize=(12,7), title='#UI claim data over all states in US', kind = 'line', fontsize = 1)
-# MAGIC plt.legend(bbox_to_anchor=(1.05,1))
-# MAGIC plt.show()
+covid_unemp_agg_all_states = spark.sql("SELECT period as date, Initial_Claims, cases from covid_unemp_rollup_delta where grain = 'day' and state = 'All States' order by date")
+display(covid_unemp_agg_all_states)
+
+casesVsClaimsPlot = PlotSpec("ui_claims_vs_cases", lambda: covid_unemp_agg_all_states, "cases", "Initial_Claims", title='#UI claim data over all states in US', figsize=(12,7))
+reportFigures.append(casesVsClaimsPlot)
+display(draw(casesVsClaimsPlot))
 
 # COMMAND ----------
 
@@ -372,41 +362,137 @@ covid_unemp_2020_agg.show()
 
 # COMMAND ----------
 
+# DBTITLE 1,Store of fitted Prophet models
+# a model is reused when its training data did not change and refitted from the previous parameters (warm start)
+# when only new weeks/days were added. Least recently used models are evicted above 1GB
+from covid_unemp.model_store import ModelStore
+from covid_unemp.batch_forecast import BatchForecaster
+
+modelStore = ModelStore("/dbfs/FileStore/prophet_models", max_bytes=1024 * 1024 * 1024)
+
+# prophet: the Stan models of the report. batch: linear trend + Fourier seasonality fitted by least squares for all
+# series at once (covid_unemp/batch_forecast.py), milliseconds instead of seconds per model
+dbutils.widgets.dropdown("forecast_engine", "prophet", ["prophet", "batch"])
+forecast_engine = dbutils.widgets.get("forecast_engine")
+
+def fit_model(name, history, params, regressors=[]):
+  # returns (model, cache status); the batch models are not stored, refitting them is cheaper than loading
+  if forecast_engine == "batch":
+    return BatchForecaster.from_params(params, regressors).fit(history), "batch"
+  return modelStore.fit(name, history, params, regressors=regressors)
+
+# COMMAND ----------
+
 # DBTITLE 1,Prophet model to fit UI claims Time series data (Result #6, #7 in the report)
-from fbprophet import Prophet
+# model parameters: interval_width= 1, growth='linear', daily_seasonality=False, weekly_seasonality=True,
+# yearly_seasonality=True, seasonality_mode='multiplicative'
+from covid_unemp.forecasting import CLAIMS_MODEL
 
-# instantiate the model and set parameters
-model = Prophet(
-    interval_width= 1,
-    growth='linear',
-    daily_seasonality=False,
-    weekly_seasonality=True,
-    yearly_seasonality=True,
-    seasonality_mode='multiplicative'
-)
 # fit the model to historical data
 formatteddf = unemp_delta_all_states_month.select(col("year_month").alias("ds"), col("monthly_ui_claims").alias("y")).toPandas()
-model.fit(formatteddf)
+with profiler.stage("fit UI claims model", "fit") as s:
+  s.input(formatteddf)
+  model, modelCache = fit_model("ui_claims_all_states_month", formatteddf, CLAIMS_MODEL)
+print("UI claims model: " + modelCache)
 
 # COMMAND ----------
 
 # DBTITLE 1,Calculate UI claims - future predictions
+import pandas as pd
+
 future_pd = model.make_future_dataframe(
   periods=24, 
   freq='m', 
   include_history=True
   )
 # predict over the dataset
-forecast_pd = model.predict(future_pd)
+with profiler.stage("predict UI claims", "predict") as s:
+  forecast_pd = model.predict(future_pd)
+  s.output(forecast_pd)
 trends_fig = model.plot_components(forecast_pd)
 display(trends_fig)
 
+# forecast with the observed values, for the report figure
+claimsForecast = forecast_pd.merge(formatteddf.assign(ds=pd.to_datetime(formatteddf["ds"])), on="ds", how="left")
+
+# COMMAND ----------
+
+# DBTITLE 1,UI claims with macro regressors from the IMF World Economic Outlook (unemployment rate, GDP growth)
+# the WEO file of the repo is parsed once into a Parquet cache partitioned by indicator, later runs only read the
+# cached indicators. The yearly values (IMF projections for 2020-2021) are regressors of the monthly UI claims model
+from covid_unemp.weo import GDP_GROWTH, UNEMPLOYMENT_RATE, WEO_FILE, load_weo, macro_regressors
+
+weo = load_weo(WEO_FILE, cache_dir="/dbfs/FileStore/weo_cache", subjects=[UNEMPLOYMENT_RATE, GDP_GROWTH], isos=["USA"])
+display(weo)
+
+macroHistory = formatteddf.assign(ds=pd.to_datetime(formatteddf["ds"]))
+macroHistory = macroHistory.merge(macro_regressors(weo, macroHistory["ds"]), on="ds")
+with profiler.stage("fit UI claims model with macro regressors", "fit"):
+  macroModel, macroModelCache = fit_model("ui_claims_all_states_month_macro", macroHistory, CLAIMS_MODEL, regressors=[UNEMPLOYMENT_RATE, GDP_GROWTH])
+print("UI claims model with macro regressors: " + macroModelCache)
+
+macroFuture = macroModel.make_future_dataframe(periods=24, freq='MS', include_history=True)
+macroForecast = macroModel.predict(macroFuture.merge(macro_regressors(weo, macroFuture["ds"]), on="ds"))
+display(macroModel.plot_components(macroForecast))
+
+# COMMAND ----------
+
+# DBTITLE 1,Forecast monthly UI claims of every state (one Prophet model per state fitted in parallel, or one batch fit)
+from pyspark.sql.functions import current_timestamp
+from covid_unemp.forecasting import FORECAST_SCHEMA, METRIC_SCHEMA, forecast_states_spark
+from covid_unemp.batch_forecast import forecast_states_batch
+
+stateClaimsHistory = spark.sql("SELECT state, period as ds, Initial_Claims as y from claims_rollup_delta where grain = 'month' and state != 'All States'")
+# the forecasts are computed by the write, the fit jobs of the workers are attributed to this stage
+with profiler.stage("forecast states", "fit"):
+  if forecast_engine == "batch":
+    # all states in one least-squares fit on the driver, the monthly history of the states is small
+    stateForecastsPd, stateForecastMetricsPd = forecast_states_batch(stateClaimsHistory.toPandas(), CLAIMS_MODEL, periods=24, freq='MS')
+    stateForecasts, stateForecastMetrics = spark.createDataFrame(stateForecastsPd, FORECAST_SCHEMA), spark.createDataFrame(stateForecastMetricsPd, METRIC_SCHEMA)
+  else:
+    stateForecasts, stateForecastMetrics = forecast_states_spark(stateClaimsHistory, CLAIMS_MODEL, periods=24, freq='MS', store=modelStore)
+  stateForecasts.write.format("delta").mode("overwrite").partitionBy("state").save("/FileStore/tables/state_forecasts_delta")
+  register_table(spark, "state_forecasts_delta", "/FileStore/tables/state_forecasts_delta/")
+# fit time of every model, kept for each run
+stateForecastMetrics.withColumn("run_at", current_timestamp()).write.format("delta").mode("append").save("/FileStore/tables/forecast_metrics_delta")
+register_table(spark, "forecast_metrics_delta", "/FileStore/tables/forecast_metrics_delta/")
+
+display(stateForecastMetrics.orderBy(col("fit_seconds").desc()))
+
+# COMMAND ----------
+
+# DBTITLE 1,Backtest the state forecasts (rolling cutoffs, APE/absolute error/coverage per cutoff, horizon and state)
+# every cutoff is fitted once for all horizons; the chunks of consecutive cutoffs of a state run as parallel tasks,
+# warm-started from the model of the previous cutoff. UI claims: a cutoff every year after 10 years, 24 months ahead.
+# COVID cases: a cutoff every week after 30 days, 14 days ahead
+import datetime
+from pyspark.sql.functions import lit
+from covid_unemp.backtest import backtest_spark, performance, rolling_cutoffs
+
+backtestRunAt = datetime.datetime.now()
+
+claimsCutoffs = rolling_cutoffs([r[0] for r in stateClaimsHistory.select("ds").distinct().collect()], horizon=24, period=12, initial=120)
+with profiler.stage("backtest UI claims", "fit"):
+  claimsBacktest = backtest_spark(stateClaimsHistory, CLAIMS_MODEL, claimsCutoffs, horizon=24, chunk_size=4).withColumn("model", lit("ui_claims_state_month"))
+  claimsBacktest.withColumn("run_at", lit(backtestRunAt)).write.format("delta").mode("append").option("mergeSchema", "true").partitionBy("model").save("/FileStore/tables/backtest_delta")
+
+stateCovidHistory = spark.sql("SELECT state, period as ds, cases as y from covid_rollup_delta where grain = 'day' and state != 'All States'")
+covidCutoffs = rolling_cutoffs([r[0] for r in stateCovidHistory.select("ds").distinct().collect()], horizon=14, period=7, initial=30)
+with profiler.stage("backtest COVID cases", "fit"):
+  covidBacktest = backtest_spark(stateCovidHistory, dict(weekly_seasonality=True, yearly_seasonality=False, daily_seasonality=False), covidCutoffs, horizon=14, chunk_size=4, min_train=14).withColumn("model", lit("covid_cases_state_day"))
+  covidBacktest.withColumn("run_at", lit(backtestRunAt)).write.format("delta").mode("append").option("mergeSchema", "true").partitionBy("model").save("/FileStore/tables/backtest_delta")
+register_table(spark, "backtest_delta", "/FileStore/tables/backtest_delta/")
+
+# accuracy by horizon over all states and cutoffs of this run (ape and abs_error, the errors of one point, were named
+# mape and rmse in earlier runs; mergeSchema adds the columns to an existing table)
+backtestRun = spark.table("backtest_delta").where(col("run_at") == lit(backtestRunAt))
+display(performance(backtestRun, by=["model", "horizon"]).orderBy("model", "horizon"))
+
 # COMMAND ----------
 
 # DBTITLE 1,Time series Analysis of COVID cases in US (Result #5 in the report)
-from fbprophet import Prophet
-# instantiate the model and set parameters
-covid_model = Prophet(
+# model parameters
+covidModelParams = dict(
     interval_width= 1,
     growth='linear',
     daily_seasonality=False,
@@ -417,7 +503,10 @@ covid_model = Prophet(
 # fit the model to historical data
 #covid_states_pop_NJ = covid_states_pop.where(col("state") == "New Jersey")
 formatteddf = covid_all_states.select(col("date").alias("ds"), col("cases").alias("y")).toPandas()
-covid_model.fit(formatteddf)
+with profiler.stage("fit COVID cases model", "fit") as s:
+  s.input(formatteddf)
+  covid_model, covidModelCache = fit_model("covid_cases_all_states_day", formatteddf, covidModelParams)
+print("COVID cases model: " + covidModelCache)
 
 future_pd = covid_model.make_future_dataframe(
   periods=130, 
@@ -425,30 +514,31 @@ future_pd = covid_model.make_future_dataframe(
   include_history=True
   )
 # predict over the dataset
-forecast_pd = covid_model.predict(future_pd)
+with profiler.stage("predict COVID cases", "predict") as s:
+  forecast_pd = covid_model.predict(future_pd)
+  s.output(forecast_pd)
 trends_fig = covid_model.plot_components(forecast_pd)
 display(trends_fig)
 
+covidForecast = forecast_pd.merge(formatteddf.assign(ds=pd.to_datetime(formatteddf["ds"])), on="ds", how="left")
+
 # COMMAND ----------
 
 # DBTITLE 1,Analysis of UI claims using Covid Cases as an additional regressor (Result#8 in the report)
 import pandas as pd
-from fbprophet import Prophet
 from pyspark.sql.functions import col 
 formatteddf = covid_unemp_2020_agg.select(col("date").alias("ds"), col("cases").alias("y"), col("Initial_Claims").alias("z")).toPandas()
 # data is weekly: weekly_seasonality=True, data available for only 1 year:  yearly_seasonality= False,
-m = Prophet(daily_seasonality = False, yearly_seasonality= False, weekly_seasonality=True, interval_width=0.95, n_changepoints= 10)
 #INFO:fbprophet:n_changepoints greater than number of observations. Using 11.
-m.fit(formatteddf)
+m, mCache = fit_model("covid_cases_all_states_week", formatteddf, dict(daily_seasonality = False, yearly_seasonality= False, weekly_seasonality=True, interval_width=0.95, n_changepoints= 10))
 future = m.make_future_dataframe(periods=30, freq='W')
 forecast = m.predict(future)
 
 #Add additional regressor
 dff = formatteddf.rename(columns={'y':'causal','z':'y'})
 # data is weekly, for multiple years hence daily_seasonality = False,yearly_seasonality= True, weekly_seasonality=True
-p = Prophet(daily_seasonality = False,yearly_seasonality= True, weekly_seasonality=True)
-p.add_regressor('causal')
-p.fit(dff)
+with profiler.stage("fit causal UI claims model", "fit"):
+  p, pCache = fit_model("ui_claims_all_states_week_causal", dff, dict(daily_seasonality = False,yearly_seasonality= True, weekly_seasonality=True), regressors=['causal'])
 future1 = m.make_future_dataframe(periods=80)
 
 kk = forecast['yhat']
@@ -460,6 +550,74 @@ display(future1)
 future1['causal']=z
 
 future1 = future1.fillna(0)
-forecast1 = p.predict(future1)
+with profiler.stage("predict causal UI claims", "predict"):
+  forecast1 = p.predict(future1)
 fig = m.plot_components(forecast1)
 display(fig)
+
+causalForecast = forecast1.merge(dff[["ds", "y"]].assign(ds=pd.to_datetime(dff["ds"])), on="ds", how="left")
+
+# COMMAND ----------
+
+# DBTITLE 1,What-if scenarios of COVID cases: quantile bands of the UI claims per week
+# the claims forecast is linear in the cases regressor, the scenarios are evaluated together from the intercept and
+# slope of every date (2 predict calls) instead of one predict call per scenario. Scenarios: the forecast cases
+# scaled by 0.5 to 2, shifted by up to 4 weeks and 1000 sampled paths (log-normal random walk around the forecast)
+import numpy as np
+from covid_unemp.scenarios import ScenarioEngine, sampled_paths, scaled_paths, shifted_paths
+
+scenarioEngine = ScenarioEngine(p, future1, regressors=["causal"])
+baseCases = scenarioEngine.baseline()
+firstFuture = len(dff)
+casePaths = np.vstack([
+  scaled_paths(baseCases, np.linspace(0.5, 2, 16), start=firstFuture),
+  shifted_paths(baseCases, range(-28, 29, 7), start=firstFuture),
+  sampled_paths(baseCases, 1000, sigma=0.05, start=firstFuture),
+])
+scenarioBands = scenarioEngine.bands(casePaths)
+print("%d scenarios, %.2f ms per 1,000 scenarios (setup %.2f s)" % (len(casePaths), 1000 * scenarioEngine.latency_per_1000(casePaths), scenarioEngine.setup_seconds))
+display(scenarioBands)
+
+reportFigures.append(PlotSpec("ui_claims_covid_scenarios", lambda: scenarioBands, "week", "q50", band=("q05", "q95"), title="UI claims per week under COVID cases scenarios (median, 5-95% of the scenarios)"))
+
+# COMMAND ----------
+
+# DBTITLE 1,Write the report figures to results/ (headless, driver process memory per figure)
+from covid_unemp.plots import render_report
+
+reportFigures += [
+  PlotSpec("COVIDcases_future_predictions", lambda: covidForecast, "ds", "yhat", band=("yhat_lower", "yhat_upper"), points="y", title="COVID19 cases - future predictions"),
+  PlotSpec("timeseries_ui_claims", lambda: claimsForecast, "ds", "yhat", band=("yhat_lower", "yhat_upper"), points="y", title="Time series predictions - UI claims"),
+  PlotSpec("multivar_timeseries_ui_claims", lambda: causalForecast, "ds", "yhat", band=("yhat_lower", "yhat_upper"), points="y", title="UI claims with COVID cases as regressor"),
+]
+with profiler.stage("report figures", "plot") as s:
+  reportRendered = pd.DataFrame(render_report(reportFigures, "results"))
+  s.output(reportRendered)
+display(reportRendered)
+
+# COMMAND ----------
+
+# DBTITLE 1,Model store report (hit rate and time saved in this run)
+from pyspark.sql.functions import count, sum as sum_
+
+print(modelStore.report())
+# models of the states are fitted on the workers, their cache status is in the fit metrics
+display(stateForecastMetrics.groupBy("cache").agg(count("*").alias("models"), sum_("seconds_saved").alias("seconds_saved")))
+
+# COMMAND ----------
+
+# DBTITLE 1,Stage report (how many times each shared intermediate was computed in this run)
+import pandas as pd
+
+stages.close()
+display(pd.DataFrame(stages.report()))
+
+# COMMAND ----------
+
+# DBTITLE 1,Run profile (time, memory and Spark metrics of every stage, with profile=true)
+# the Spark metrics are read from the Spark UI once, after the run; every run is kept as profile-<run id>.json
+if profiler.enabled:
+  runProfile = profiler.profile()
+  print(profiler.export("/dbfs/FileStore/profiles", runProfile))
+  print(profiler.flame_table(runProfile))
+  display(pd.DataFrame(runProfile))
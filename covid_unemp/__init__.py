@@ -0,0 +1,5 @@
+"""Reusable stages of the COVID-19 / UI claims analysis notebook (covid_UiClaims.py)."""
+import os
+
+# files bundled with the repo, resolved from the package so they are found from any working directory
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
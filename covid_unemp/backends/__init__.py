@@ -0,0 +1,26 @@
+"""Execution backends of the pipeline (see covid_unemp.pipeline).
+
+spark: the PySpark implementation used by the notebook.
+local: pandas, for data that fits in memory; needs neither Spark nor Databricks.
+
+A backend implements the stages of the pipeline on its own frame type:
+load_claims, load_population, load_covid_states (returning Loaded),
+population_dim, claims_with_population, covid_with_population, build_rollup,
+weekly_claims_covid, max_value and to_pandas.
+"""
+import importlib
+from collections import namedtuple
+
+# Loaded.data is the typed data, Loaded.rejected the quarantined rows (source, reason, record, values, loaded_at)
+Loaded = namedtuple('Loaded', ['data', 'rejected'])
+
+BACKENDS = {
+    'spark': 'covid_unemp.backends.spark.SparkBackend',
+    'local': 'covid_unemp.backends.local.LocalBackend',
+}
+
+
+def get_backend(name, **kwargs):
+    """Instantiate the backend registered under name; the module is imported only when needed."""
+    module, cls = BACKENDS[name].rsplit('.', 1)
+    return getattr(importlib.import_module(module), cls)(**kwargs)
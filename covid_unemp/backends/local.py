@@ -0,0 +1,195 @@
+"""Local backend: the stages of the notebook on pandas frames.
+
+Meant for data that fits in memory (the state level data of the notebook does),
+for tests and for profiling without a cluster. The results have the same
+columns as the Spark backend; dates are pandas timestamps.
+"""
+import pandas as pd
+
+from covid_unemp.backends import Loaded
+
+# same values as covid_unemp.rollups, which needs pyspark
+GRAINS = ('day', 'week', 'month')
+ALL_STATES = 'All States'
+
+CLAIMS_RAW_COLUMNS = ['State', 'Filed_week_ended', 'Initial_Claims', 'Reflecting_Week_Ended', 'Continued_Claims',
+                      'Covered_Employment', 'Insured_Unemployment_Rate']
+CLAIMS_NUMERIC_COLUMNS = {'Initial_Claims': 'Int64', 'Continued_Claims': 'Int64', 'Covered_Employment': 'Int64',
+                          'Insured_Unemployment_Rate': 'float64'}
+CLAIMS_DATE_FORMAT = '%m/%d/%Y'
+
+POPULATION_COLUMNS = {'FIPS_Code': None, 'State_and_area': None, 'Year': 'Int64', 'Month': 'Int64',
+                      'population': 'Int64', 'Total': 'Int64', 'Percent_of_population': 'float64',
+                      'Total_Employment': 'Int64', 'Employment_As_Percent_of_population': 'float64',
+                      'Total_Unemployment': 'Int64', 'Unemployment_Rate': 'float64'}
+POPULATION_DIM_COLUMNS = ['population', 'Total', 'Total_Employment', 'Total_Unemployment', 'Unemployment_Rate']
+
+COVID_STATES_COLUMNS = {'date': None, 'state': None, 'fips': 'Int64', 'cases': 'Int64', 'deaths': 'Int64'}
+
+
+def _read_csv(path, names):
+    # columns are taken by position like the declared Spark schemas, every value is read as a string first
+    return pd.read_csv(path, header=0, names=names, dtype=str, keep_default_na=False, na_values=[''])
+
+
+def _number(values, dtype):
+    parsed = pd.to_numeric(values.str.replace(',', '', regex=False).str.strip(), errors='coerce')
+    if dtype == 'Int64':
+        # values like 12.5 in an integer column are unparsable, not rounded
+        parsed = parsed.where(parsed.isna() | (parsed % 1 == 0))
+    return parsed.astype(dtype)
+
+
+def _date(values, fmt=None):
+    return pd.to_datetime(values.str.strip(), format=fmt, errors='coerce')
+
+
+def _split(raw, parsed, required, sources, source):
+    """Split parsed into the valid rows and the rejected rows (same rules as covid_unemp.loaders)."""
+    reason = pd.Series(None, index=raw.index, dtype=object)
+    for name in required:
+        reason = reason.mask(reason.isna() & parsed[name].isna(), 'missing ' + name)
+    for name, raw_column in sources.items():
+        reason = reason.mask(reason.isna() & parsed[name].isna() & raw[raw_column].notna(), 'unparsable ' + raw_column)
+    rejected = reason.notna()
+    quarantined = pd.DataFrame({
+        'source': source,
+        'reason': reason[rejected],
+        'record': None,
+        'values': [row.to_json() for _, row in raw[rejected].iterrows()],
+        'loaded_at': pd.Timestamp.now(),
+    })
+    return Loaded(parsed[~rejected].reset_index(drop=True), quarantined.reset_index(drop=True))
+
+
+def _typed(raw, columns, dates=()):
+    parsed = pd.DataFrame(index=raw.index)
+    for name, dtype in columns.items():
+        if name in dates:
+            parsed[name] = _date(raw[name])
+        elif dtype is None:
+            parsed[name] = raw[name].str.strip()
+        else:
+            parsed[name] = _number(raw[name], dtype)
+    return parsed
+
+
+def week_start(dates):
+    return dates - pd.to_timedelta(dates.dt.weekday, unit='D')
+
+
+def month_start(dates):
+    return dates.dt.to_period('M').dt.start_time
+
+
+class LocalBackend(object):
+    name = 'local'
+
+    def load_claims(self, path):
+        raw = _read_csv(path, CLAIMS_RAW_COLUMNS)
+        parsed = pd.DataFrame({'state': raw['State'].str.strip(),
+                               'date': _date(raw['Filed_week_ended'], CLAIMS_DATE_FORMAT)})
+        for name, dtype in CLAIMS_NUMERIC_COLUMNS.items():
+            parsed[name] = _number(raw[name], dtype)
+        parsed['Reflecting_Week_Ended'] = _date(raw['Reflecting_Week_Ended'], CLAIMS_DATE_FORMAT)
+        sources = dict({'date': 'Filed_week_ended', 'Reflecting_Week_Ended': 'Reflecting_Week_Ended'},
+                       **{c: c for c in CLAIMS_NUMERIC_COLUMNS})
+        return _split(raw, parsed, ['state', 'date'], sources, 'claims')
+
+    def load_population(self, path):
+        raw = _read_csv(path, list(POPULATION_COLUMNS))
+        parsed = _typed(raw, POPULATION_COLUMNS)
+        sources = {c: c for c, dtype in POPULATION_COLUMNS.items() if dtype is not None}
+        return _split(raw, parsed, ['State_and_area', 'Year', 'Month'], sources, 'population')
+
+    def load_covid_states(self, path):
+        raw = _read_csv(path, list(COVID_STATES_COLUMNS))
+        parsed = _typed(raw, COVID_STATES_COLUMNS, dates=('date',))
+        sources = {c: c for c, dtype in COVID_STATES_COLUMNS.items() if dtype is not None}
+        sources['date'] = 'date'
+        return _split(raw, parsed, ['date', 'state'], sources, 'covid_states')
+
+    def population_dim(self, pop, until=None, columns=POPULATION_DIM_COLUMNS):
+        """Same as covid_unemp.population.population_dim: one row per state and month, filled forward."""
+        base = pd.DataFrame({'state': pop['State_and_area'],
+                             'month': pd.to_datetime(pd.DataFrame({'year': pop['Year'], 'month': pop['Month'],
+                                                                   'day': 1}))})
+        for c in columns:
+            base[c] = pop[c].values
+        last_month = pd.Timestamp(until).to_period('M').start_time if until is not None else None
+        frames = []
+        for state, group in base.groupby('state', sort=True):
+            group = group.drop(columns='state').drop_duplicates('month', keep='last').set_index('month').sort_index()
+            end = group.index.max() if last_month is None else max(group.index.max(), last_month)
+            filled = group.reindex(pd.date_range(group.index.min(), end, freq='MS'))
+            extrapolated = filled[columns].isna().all(axis=1)
+            filled = filled.ffill()
+            filled.insert(0, 'state', state)
+            filled['extrapolated'] = extrapolated
+            frames.append(filled)
+        dim = pd.concat(frames).rename_axis('month').reset_index()
+        dim['year_month'] = dim['month'].dt.year * 100 + dim['month'].dt.month
+        dim['Year'] = dim['month'].dt.year
+        dim['Month'] = dim['month'].dt.month
+        return dim[['state', 'year_month', 'Year', 'Month'] + list(columns) + ['extrapolated']]
+
+    def join_population(self, facts, dim, date_col='date'):
+        keyed = facts.assign(year_month=facts[date_col].dt.year * 100 + facts[date_col].dt.month)
+        dim = dim.drop(columns=['Year', 'Month', 'extrapolated'])
+        return keyed.merge(dim, on=['state', 'year_month'], how='left').drop(columns='year_month')
+
+    def claims_with_population(self, claims, dim):
+        df = self.join_population(claims, dim)
+        out = df[['state', 'date', 'Initial_Claims', 'Continued_Claims', 'population', 'Total_Employment',
+                  'Total_Unemployment']].copy()
+        out['Inital_Claims_as_%_of_population'] = df['Initial_Claims'] * 100 / df['population']
+        out['Continued_Claims_as_%_of_population'] = df['Continued_Claims'] * 100 / df['population']
+        out['Employment_Rate'] = df['Total_Employment'] * 100 / df['population']
+        return out
+
+    def covid_with_population(self, covid, dim):
+        df = self.join_population(covid, dim)
+        out = df[['date', 'state', 'cases', 'deaths']].copy()
+        out['cases_as_p_of_population'] = df['cases'] * 100 / df['population']
+        out['deaths_as_p_of_population'] = df['deaths'] * 100 / df['population']
+        return out
+
+    def build_rollup(self, facts, measures, date_col='date', state_col='state'):
+        """Same as covid_unemp.rollups.build_rollup: sums per (grain, state, period) and per (grain, period)."""
+        dates = facts[date_col]
+        periods = {'day': dates, 'week': week_start(dates), 'month': month_start(dates)}
+        aggregations = dict(n_rows=(date_col, 'size'), first_date=(date_col, 'min'), last_date=(date_col, 'max'),
+                            **{m: (m, 'sum') for m in measures})
+        frames = []
+        for grain in GRAINS:
+            keyed = facts.assign(period=periods[grain])
+            per_state = keyed.groupby([state_col, 'period']).agg(**aggregations).reset_index()\
+                .rename(columns={state_col: 'state'})
+            total = keyed.groupby('period').agg(**aggregations).reset_index()
+            total.insert(0, 'state', ALL_STATES)
+            for frame in (per_state, total):
+                frame.insert(0, 'grain', grain)
+                frames.append(frame)
+        return pd.concat(frames, ignore_index=True)[['grain', 'state', 'period', 'n_rows', 'first_date', 'last_date']
+                                                    + list(measures)]
+
+    def weekly_claims_covid(self, claims_joined, covid_rollup, since='2020-01-01'):
+        """Same as covid_unemp.joins.weekly_claims_covid."""
+        covid_week = covid_rollup[(covid_rollup['grain'] == 'week') & (covid_rollup['state'] != ALL_STATES)]
+        covid_week = covid_week[['state', 'period', 'cases', 'deaths', 'cases_as_p_of_population',
+                                 'deaths_as_p_of_population']].rename(columns={
+                                     'period': 'week', 'cases_as_p_of_population': 'cases_as_%_of_population',
+                                     'deaths_as_p_of_population': 'deaths_as_%_of_population'})
+        claims = claims_joined[claims_joined['date'] >= pd.Timestamp(since)].copy()
+        claims['week'] = week_start(claims['date'])
+        claims['week_of_year'] = claims['date'].dt.isocalendar().week.astype('int32')
+        joined = claims.merge(covid_week, on=['state', 'week'], how='left').drop(columns='week')
+        numeric = joined.select_dtypes('number').columns
+        joined[numeric] = joined[numeric].fillna(0)
+        return joined
+
+    def max_value(self, df, column):
+        return df[column].max()
+
+    def to_pandas(self, df):
+        return df
@@ -0,0 +1,44 @@
+"""PySpark backend: the stages of the notebook on Spark DataFrames."""
+from pyspark.sql.functions import max as max_
+
+from covid_unemp import joins, loaders, population, rollups
+
+
+class SparkBackend(object):
+    name = 'spark'
+
+    def __init__(self, spark=None, master='local[*]'):
+        if spark is None:
+            from pyspark.sql import SparkSession
+            spark = SparkSession.builder.master(master).appName('covid_unemp').getOrCreate()
+        self.spark = spark
+
+    def load_claims(self, path):
+        return loaders.load_claims(self.spark, path)
+
+    def load_population(self, path):
+        return loaders.load_population(self.spark, path)
+
+    def load_covid_states(self, path):
+        return loaders.load_covid_states(self.spark, path)
+
+    def population_dim(self, pop, until=None):
+        return population.population_dim(pop, until)
+
+    def claims_with_population(self, claims, dim):
+        return joins.claims_with_population(claims, dim)
+
+    def covid_with_population(self, covid, dim):
+        return joins.covid_with_population(covid, dim)
+
+    def build_rollup(self, facts, measures):
+        return rollups.build_rollup(self.spark, facts, measures)
+
+    def weekly_claims_covid(self, claims_joined, covid_rollup, since='2020-01-01'):
+        return joins.weekly_claims_covid(claims_joined, covid_rollup, since)
+
+    def max_value(self, df, column):
+        return df.agg(max_(column)).collect()[0][0]
+
+    def to_pandas(self, df):
+        return df.toPandas()
@@ -0,0 +1,187 @@
+"""Rolling-origin backtests of the Prophet forecasts, evaluated in parallel.
+
+For every cutoff a model is fitted on the history up to the cutoff and
+predicts the next `horizon` observations, which are compared to the observed
+values. One fit covers every horizon of its cutoff (1 to horizon observations
+ahead), and the cutoffs of a series are evaluated in chunks of consecutive
+cutoffs: the first fit of a chunk is cold, the next ones are warm-started from
+the model of the previous cutoff (covid_unemp.model_store.warm_start_params).
+The (series, chunk) tasks are independent and run in parallel on a
+ProcessPoolExecutor or as applyInPandas groups on Spark
+(benchmarks/bench_backtest.py measures the throughput per number of cores).
+
+The result has one row per state, cutoff and horizon (BACKTEST_COLUMNS) with
+the error measures of the point: ape (absolute percentage error), abs_error
+(|y - yhat|) and coverage (1.0 when y is inside the forecast interval).
+`performance` averages them over the cutoffs, e.g. per state and horizon, into
+MAPE, MAE, RMSE (root of the mean of the squared abs_error) and coverage.
+"""
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from covid_unemp.forecasting import prophet_class
+from covid_unemp.model_store import warm_start_params
+
+BACKTEST_COLUMNS = ['state', 'cutoff', 'horizon', 'ds', 'y', 'yhat', 'yhat_lower', 'yhat_upper', 'ape', 'abs_error',
+                    'coverage', 'fit', 'fit_seconds']
+BACKTEST_SCHEMA = ('state string, cutoff timestamp, horizon int, ds timestamp, y double, yhat double, '
+                   'yhat_lower double, yhat_upper double, ape double, abs_error double, coverage double, fit string, '
+                   'fit_seconds double')
+
+COLD = 'cold'
+WARM = 'warm'
+
+
+def rolling_cutoffs(ds, horizon, period, initial):
+    """Cutoff dates every `period` observations of ds, the last one `horizon` observations before the end.
+
+    The first cutoff leaves at least `initial` observations for training. ds are
+    the dates of the series (of all series for a shared set of cutoffs).
+    """
+    dates = pd.Series(pd.to_datetime(pd.Series(ds)).unique()).sort_values().reset_index(drop=True)
+    last = len(dates) - 1 - horizon
+    return list(reversed([dates[i] for i in range(last, initial - 2, -period)]))
+
+
+def chunked(cutoffs, chunk_size):
+    """Consecutive cutoffs in chunks of chunk_size, the unit of work of a task."""
+    return [cutoffs[i:i + chunk_size] for i in range(0, len(cutoffs), chunk_size)]
+
+
+def _fit(params, regressors, train, previous):
+    def new_model():
+        model = prophet_class()(**(params or {}))
+        for name in regressors:
+            model.add_regressor(name)
+        return model
+
+    if previous is not None:
+        try:
+            return new_model().fit(train, init=warm_start_params(previous)), WARM
+        except Exception:
+            # e.g. fewer changepoints than the previous model, fit from scratch
+            pass
+    return new_model().fit(train), COLD
+
+
+def backtest_series(history, params=None, cutoffs=(), horizon=24, regressors=(), warm_start=True, min_train=2,
+                    state=None):
+    """Backtest one series (ds, y and the regressor columns) at the given cutoffs, in BACKTEST_COLUMNS.
+
+    Cutoffs with fewer than min_train observations before them or none after
+    them are skipped. The regressors of the evaluated dates are the observed ones.
+    """
+    regressors = list(regressors)
+    history = history[['ds', 'y'] + regressors].dropna().assign(ds=lambda df: pd.to_datetime(df['ds']))
+    history = history.sort_values('ds').reset_index(drop=True)
+    frames = []
+    previous = None
+    for cutoff in sorted(pd.to_datetime(pd.Series(list(cutoffs)))):
+        train = history[history['ds'] <= cutoff]
+        test = history[history['ds'] > cutoff].iloc[:horizon]
+        if len(train) < min_train or test.empty:
+            continue
+        start = time.perf_counter()
+        model, fit = _fit(params, regressors, train, previous if warm_start else None)
+        fit_seconds = time.perf_counter() - start
+        forecast = model.predict(test.drop(columns='y'))
+        y = test['y'].to_numpy(dtype='float64')
+        error = np.abs(y - forecast['yhat'].to_numpy())
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ape = np.where(y != 0, error / np.abs(y), np.nan)
+        frames.append(pd.DataFrame({
+            'state': state,
+            'cutoff': cutoff,
+            'horizon': np.arange(1, len(test) + 1, dtype='int32'),
+            'ds': test['ds'].to_numpy(),
+            'y': y,
+            'yhat': forecast['yhat'].to_numpy(),
+            'yhat_lower': forecast['yhat_lower'].to_numpy(),
+            'yhat_upper': forecast['yhat_upper'].to_numpy(),
+            'ape': ape,
+            'abs_error': error,
+            'coverage': ((y >= forecast['yhat_lower'].to_numpy()) & (y <= forecast['yhat_upper'].to_numpy()))
+            .astype('float64'),
+            'fit': fit,
+            'fit_seconds': fit_seconds,
+        }))
+        previous = model
+    if not frames:
+        return pd.DataFrame(columns=BACKTEST_COLUMNS)
+    return pd.concat(frames, ignore_index=True)[BACKTEST_COLUMNS]
+
+
+def _backtest_task(args):
+    return backtest_series(*args)
+
+
+def backtest_local(history, params=None, cutoffs=(), horizon=24, chunk_size=4, regressors=(), max_workers=None,
+                   state_col='state', warm_start=True, min_train=2):
+    """Backtest every state of the pandas frame history (state, ds, y, ...) in a process pool."""
+    history = history.assign(ds=pd.to_datetime(history['ds']))
+    tasks = []
+    for state, group in history.groupby(state_col):
+        for chunk in chunked(list(cutoffs), chunk_size):
+            # a task only needs the history up to the horizon of its last cutoff
+            until = group.loc[group['ds'] > chunk[-1], 'ds'].nsmallest(horizon).max()
+            rows = group if pd.isnull(until) else group[group['ds'] <= until]
+            tasks.append((rows, params, chunk, horizon, regressors, warm_start, min_train, state))
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(_backtest_task, tasks))
+    results = [r for r in results if not r.empty]
+    return pd.concat(results, ignore_index=True) if results else pd.DataFrame(columns=BACKTEST_COLUMNS)
+
+
+def backtest_spark(history, params=None, cutoffs=(), horizon=24, chunk_size=4, regressors=(), num_partitions=None,
+                   state_col='state', ds_col='ds', y_col='y', warm_start=True, min_train=2):
+    """Backtest every state of the Spark DataFrame history, one applyInPandas group per (state, chunk).
+
+    Every chunk of cutoffs is joined to the history up to the horizon of its
+    last cutoff (on the dates of all states) and the groups are hash
+    partitioned into num_partitions (default: the default parallelism).
+    Returns a Spark DataFrame with BACKTEST_SCHEMA.
+    """
+    from pyspark import SparkContext
+    from pyspark.sql import SparkSession
+    from pyspark.sql import functions as F
+
+    regressors = list(regressors)
+    chunks = chunked([pd.Timestamp(c) for c in cutoffs], chunk_size)
+    dates = sorted(pd.to_datetime([r[0] for r in history.select(ds_col).distinct().collect()]))
+    bounds = []
+    for i, chunk in enumerate(chunks):
+        after = [d for d in dates if d > chunk[-1]][:horizon]
+        bounds.append((i, (after[-1] if after else dates[-1]).to_pydatetime()))
+    spark = SparkSession.getActiveSession()
+    chunk_bounds = spark.createDataFrame(bounds, 'chunk int, until timestamp')
+
+    def evaluate(pdf):
+        state = pdf['state'].iloc[0]
+        return backtest_series(pdf, params, chunks[int(pdf['chunk'].iloc[0])], horizon, regressors, warm_start,
+                               min_train, state)
+
+    num_partitions = num_partitions or SparkContext.getOrCreate().defaultParallelism
+    series = history.select(F.col(state_col).alias('state'), F.col(ds_col).cast('timestamp').alias('ds'),
+                            F.col(y_col).alias('y'), *regressors)
+    return series.join(F.broadcast(chunk_bounds), F.col('ds') <= F.col('until')).drop('until')\
+        .repartition(num_partitions, 'state', 'chunk')\
+        .groupBy('state', 'chunk').applyInPandas(evaluate, schema=BACKTEST_SCHEMA)
+
+
+def performance(backtest, by=('state', 'horizon')):
+    """MAPE, MAE, RMSE and coverage of the backtest rows averaged per `by` (over the cutoffs), pandas or Spark."""
+    by = list(by)
+    if isinstance(backtest, pd.DataFrame):
+        grouped = backtest.assign(se=backtest['abs_error'] ** 2).groupby(by)
+        out = grouped.agg(cutoffs=('cutoff', 'nunique'), mape=('ape', 'mean'), mae=('abs_error', 'mean'),
+                          se=('se', 'mean'), coverage=('coverage', 'mean')).reset_index()
+        out['rmse'] = np.sqrt(out.pop('se'))
+        return out[by + ['cutoffs', 'mape', 'mae', 'rmse', 'coverage']]
+    from pyspark.sql import functions as F
+    return backtest.groupBy(*by).agg(F.countDistinct('cutoff').alias('cutoffs'), F.avg('ape').alias('mape'),
+                                     F.avg('abs_error').alias('mae'),
+                                     F.sqrt(F.avg(F.col('abs_error') * F.col('abs_error'))).alias('rmse'),
+                                     F.avg('coverage').alias('coverage'))
@@ -0,0 +1,55 @@
+"""Cleaning stage for the raw UI claims data.
+
+Everything here is built from Spark column expressions, so the rows never
+leave the JVM (the notebook used to run every cell through a Python UDF).
+"""
+from pyspark.sql.functions import col, regexp_replace, to_date, trim
+
+# dates in the claims file look like 01/03/1987; single digit month/day are accepted too
+CLAIMS_DATE_FORMAT = 'M/d/yyyy'
+
+# numeric columns of the claims data and the type they are cast to once cleaned
+CLAIMS_NUMERIC_COLUMNS = {
+    'Initial_Claims': 'long',
+    'Continued_Claims': 'long',
+    'Covered_Employment': 'long',
+    'Insured_Unemployment_Rate': 'double',
+}
+
+
+def strip_number(column):
+    """Column expression removing padding and thousands separators ("1,234  " -> "1234")."""
+    return regexp_replace(trim(col(column).cast('string')), ',', '')
+
+
+def parse_number(column, dtype):
+    """Clean `column` and cast it to `dtype`; unparsable values become null."""
+    return strip_number(column).cast(dtype)
+
+
+def parse_date(column, fmt=CLAIMS_DATE_FORMAT):
+    return to_date(trim(col(column).cast('string')), fmt)
+
+
+def claims_columns(numeric_columns=CLAIMS_NUMERIC_COLUMNS):
+    """(name, expression, raw column) of each column of the cleaned claims data.
+
+    The raw column is the one the expression parses, so a null result for a non
+    null raw value means the value could not be parsed.
+    """
+    return [
+        ('state', col('State'), None),
+        ('date', parse_date('Filed_week_ended'), 'Filed_week_ended'),
+        *[(c, parse_number(c, dtype), c) for c, dtype in numeric_columns.items()],
+        ('Reflecting_Week_Ended', parse_date('Reflecting_Week_Ended'), 'Reflecting_Week_Ended'),
+    ]
+
+
+def clean_claims(df, numeric_columns=CLAIMS_NUMERIC_COLUMNS):
+    """Clean the renamed raw claims data (see the DELTA cell in the notebook).
+
+    Returns state, date (the filed week), the numeric claim columns cast to their
+    types and Reflecting_Week_Ended as a date. Only the numeric columns are
+    stripped of commas, the state and date columns are left as they are.
+    """
+    return df.select(*[expr.alias(name) for name, expr, _ in claims_columns(numeric_columns)])
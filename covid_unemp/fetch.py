@@ -0,0 +1,192 @@
+"""Source files of the notebook, downloaded into a content-addressed cache.
+
+The notebook used to download every file with `wget` in `%sh` cells and move
+them to coviddata/ on every run. Here a file is stored once under the sha256 of
+its content (objects/ab/abcd...), and an index entry per source (index/<name>.json)
+records the object of the latest download with its ETag and Last-Modified
+headers. The returned paths are those of the objects, which are written to a
+temporary file and renamed, so a reader never sees a partial file and
+concurrent runs cannot move each other's files.
+
+Modes:
+
+    revalidate  entries younger than max_age are used as they are, older ones
+                are revalidated with a conditional GET (If-None-Match /
+                If-Modified-Since); a 304 keeps the cached object. When the
+                server cannot be reached or answers with a 5xx error the
+                cached object is used (stale); 4xx errors are raised
+    cached      the cached object is used without any request, sources that
+                are not cached yet are downloaded
+    offline     no request at all: the cached object, else the file bundled in
+                data/ (copied into the object store, so the path is under the
+                cache directory like the others), else FileNotFoundError
+
+`fetch_all` downloads several sources in parallel threads. A source with a
+pinned sha256 is verified after every download.
+"""
+import hashlib
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from covid_unemp import DATA_DIR
+
+REVALIDATE = 'revalidate'
+CACHED = 'cached'
+OFFLINE = 'offline'
+MODES = (REVALIDATE, CACHED, OFFLINE)
+
+
+class Source(object):
+    """A file to download: url, the file bundled with the repo (used offline) and an optional pinned sha256."""
+
+    def __init__(self, name, url, bundled=None, sha256=None):
+        self.name = name
+        self.url = url
+        self.bundled = bundled
+        self.sha256 = sha256
+
+    def __repr__(self):
+        return 'Source(%r, %r)' % (self.name, self.url)
+
+
+SOURCES = {s.name: s for s in [
+    Source('ui_claims', 'https://raw.githubusercontent.com/Roopana/CovidAnalysis/master/data/'
+                        'State_UI_claims_allstates_1987_Apr182020.csv'),
+    Source('covid_states', 'https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-states.csv'),
+    Source('population', 'https://github.com/Roopana/CovidAnalysis/raw/master/data/'
+                         'emp_civilian_nonInstPop_states_1976_2020.csv',
+           bundled=os.path.join(DATA_DIR, 'emp_civilian_nonInstPop_states_1976_2020.csv')),
+    Source('owid', 'https://covid.ourworldindata.org/data/owid-covid-data.csv'),
+]}
+
+
+class FetchCache(object):
+
+    def __init__(self, root, timeout=60.0):
+        self.root = root
+        self.timeout = timeout
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'index'), exist_ok=True)
+
+    def object_path(self, sha256):
+        return os.path.join(self.root, 'objects', sha256[:2], sha256)
+
+    def _index_path(self, name):
+        return os.path.join(self.root, 'index', name + '.json')
+
+    def entry(self, name):
+        """Index entry of the source name, None when it was never downloaded or its object is gone."""
+        try:
+            with open(self._index_path(name)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        path = self.object_path(entry['sha256'])
+        if not os.path.exists(path) or os.path.getsize(path) != entry['size']:
+            return None
+        return entry
+
+    def verify(self, entry):
+        """True when the object of entry still has the sha256 it is stored under."""
+        h = hashlib.sha256()
+        with open(self.object_path(entry['sha256']), 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        return h.hexdigest() == entry['sha256']
+
+    def _write_entry(self, name, entry):
+        path = self._index_path(name)
+        tmp = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+        with open(tmp, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp, path)
+
+    def _store(self, response):
+        """Stream response (or any binary file) into the object store; returns (sha256, size)."""
+        h = hashlib.sha256()
+        tmp = os.path.join(self.root, 'objects', '.%s.tmp' % uuid.uuid4().hex)
+        size = 0
+        try:
+            with open(tmp, 'wb') as f:
+                for block in iter(lambda: response.read(1 << 20), b''):
+                    h.update(block)
+                    f.write(block)
+                    size += len(block)
+            sha256 = h.hexdigest()
+            path = self.object_path(sha256)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return sha256, size
+
+    def _download(self, source, entry):
+        request = urllib.request.Request(source.url)
+        if entry is not None:
+            if entry.get('etag'):
+                request.add_header('If-None-Match', entry['etag'])
+            if entry.get('last_modified'):
+                request.add_header('If-Modified-Since', entry['last_modified'])
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                sha256, size = self._store(response)
+                headers = response.headers
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and entry is not None:
+                return dict(entry, checked_at=time.time()), 'not modified'
+            raise
+        if source.sha256 and sha256 != source.sha256:
+            raise ValueError('checksum of %s is %s, expected %s' % (source.url, sha256, source.sha256))
+        entry = {'url': source.url, 'sha256': sha256, 'size': size, 'etag': headers.get('ETag'),
+                 'last_modified': headers.get('Last-Modified'), 'fetched_at': time.time(), 'checked_at': time.time()}
+        return entry, 'downloaded'
+
+    def fetch(self, source, mode=REVALIDATE, max_age=0.0, verify=False):
+        """(local path of the content of source, status): cached, not modified, downloaded, stale or bundled.
+
+        With verify=True the cached object is hashed again before it is used
+        and downloaded again when it does not match.
+        """
+        if mode not in MODES:
+            raise ValueError('unknown mode %s, one of %s' % (mode, ', '.join(MODES)))
+        entry = self.entry(source.name)
+        if entry is not None and (entry['url'] != source.url or (verify and not self.verify(entry))):
+            entry = None
+        if mode == OFFLINE:
+            if entry is not None:
+                return self.object_path(entry['sha256']), 'cached'
+            if source.bundled and os.path.exists(source.bundled):
+                with open(source.bundled, 'rb') as f:
+                    sha256, _ = self._store(f)
+                return self.object_path(sha256), 'bundled'
+            raise FileNotFoundError('%s is neither cached nor bundled' % source.name)
+        if entry is not None and (mode == CACHED or time.time() - entry['checked_at'] < max_age):
+            return self.object_path(entry['sha256']), 'cached'
+        try:
+            entry, status = self._download(source, entry)
+        except urllib.error.HTTPError as e:
+            # a 4xx (e.g. the file moved) has to be fixed, a server error may be temporary
+            if entry is None or e.code < 500:
+                raise
+            return self.object_path(entry['sha256']), 'stale'
+        except (urllib.error.URLError, TimeoutError):
+            if entry is None:
+                raise
+            return self.object_path(entry['sha256']), 'stale'
+        self._write_entry(source.name, entry)
+        return self.object_path(entry['sha256']), status
+
+
+def fetch_all(sources, cache_dir, mode=REVALIDATE, max_age=0.0, verify=False, max_workers=4, timeout=60.0):
+    """Fetch the sources (Source objects or names of SOURCES) in parallel; returns {name: (path, status)}."""
+    cache = FetchCache(cache_dir, timeout)
+    sources = [SOURCES[s] if isinstance(s, str) else s for s in sources]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(lambda s: cache.fetch(s, mode, max_age, verify), sources))
+    return {s.name: r for s, r in zip(sources, results)}
@@ -0,0 +1,127 @@
+"""Prophet forecasts of one model per state, fitted in parallel.
+
+The same per-series function runs on Spark, one task per group with
+`groupBy('state').applyInPandas`, or locally on a ProcessPoolExecutor. Both
+return the forecasts with the fixed schema FORECAST_COLUMNS and one row of fit
+metrics per state (METRIC_COLUMNS).
+
+With a covid_unemp.model_store.ModelStore the models are reused (or warm
+started) across runs; the cache column of the metrics tells which.
+"""
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+FORECAST_COLUMNS = ['state', 'ds', 'yhat', 'yhat_lower', 'yhat_upper']
+METRIC_COLUMNS = ['state', 'n_obs', 'fit_seconds', 'predict_seconds', 'cache', 'seconds_saved', 'error']
+
+FORECAST_SCHEMA = 'state string, ds timestamp, yhat double, yhat_lower double, yhat_upper double'
+METRIC_SCHEMA = ('state string, n_obs long, fit_seconds double, predict_seconds double, cache string, '
+                 'seconds_saved double, error string')
+# applyInPandas returns forecast rows and one metrics row per state (the one with a null ds) in a single frame
+_OUTPUT_SCHEMA = ('state string, ds timestamp, yhat double, yhat_lower double, yhat_upper double, '
+                  'n_obs long, fit_seconds double, predict_seconds double, cache string, seconds_saved double, '
+                  'error string')
+
+# settings of the UI claims model of the notebook
+CLAIMS_MODEL = dict(interval_width=1, growth='linear', daily_seasonality=False, weekly_seasonality=True,
+                    yearly_seasonality=True, seasonality_mode='multiplicative')
+
+
+def prophet_class():
+    try:
+        from prophet import Prophet
+    except ImportError:
+        # releases before 1.0 were published as fbprophet
+        from fbprophet import Prophet
+    return Prophet
+
+
+def fit_forecast(history, params=None, periods=24, freq='MS', store=None, series_id=None):
+    """Fit a Prophet model on history (ds, y) and forecast `periods` ahead of it.
+
+    Returns the forecast (ds, yhat, yhat_lower, yhat_upper, history included) and
+    a dict of metrics (n_obs, fit_seconds, predict_seconds, cache, seconds_saved,
+    error). Series that cannot be fitted or predicted (e.g. fewer than two
+    observations, an optimizer failure) give an empty forecast and the type and
+    message of the error. With a model store the model is looked up (or warm
+    started) under series_id.
+    """
+    history = history[['ds', 'y']].dropna()
+    metrics = {'n_obs': len(history), 'fit_seconds': None, 'predict_seconds': None, 'cache': None,
+               'seconds_saved': None, 'error': None}
+    try:
+        start = time.perf_counter()
+        if store is None:
+            model = prophet_class()(**(params or {}))
+            model.fit(history)
+        else:
+            saved = store.stats['seconds_saved']
+            model, metrics['cache'] = store.fit(series_id, history, params)
+            metrics['seconds_saved'] = store.stats['seconds_saved'] - saved
+        metrics['fit_seconds'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        future = model.make_future_dataframe(periods=periods, freq=freq, include_history=True)
+        forecast = model.predict(future)[['ds', 'yhat', 'yhat_lower', 'yhat_upper']]
+        metrics['predict_seconds'] = time.perf_counter() - start
+    except Exception as e:
+        # e.g. a Stan optimization failure or a store I/O error, only this series is lost
+        metrics['error'] = '%s: %s' % (type(e).__name__, e)
+        forecast = pd.DataFrame(columns=['ds', 'yhat', 'yhat_lower', 'yhat_upper'])
+    return forecast, metrics
+
+
+def _forecast_state(state, history, params, periods, freq, store=None):
+    forecast, metrics = fit_forecast(history, params, periods, freq, store, state)
+    forecast.insert(0, 'state', state)
+    return forecast[FORECAST_COLUMNS], dict(metrics, state=state)
+
+
+def _forecast_group(args):
+    return _forecast_state(*args)
+
+
+def forecast_states_local(history, params=None, periods=24, freq='MS', max_workers=None, state_col='state',
+                          store=None):
+    """Forecast every state of the pandas frame history (state, ds, y) in a process pool.
+
+    Returns (forecasts, metrics) as pandas frames.
+    """
+    groups = [(state, group, params, periods, freq, store) for state, group in history.groupby(state_col)]
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(_forecast_group, groups))
+    forecasts = pd.concat([f for f, _ in results], ignore_index=True) if results else \
+        pd.DataFrame(columns=FORECAST_COLUMNS)
+    metrics = pd.DataFrame([m for _, m in results], columns=METRIC_COLUMNS)
+    return forecasts, metrics
+
+
+def forecast_states_spark(history, params=None, periods=24, freq='MS', num_partitions=None,
+                          state_col='state', ds_col='ds', y_col='y', store=None):
+    """Forecast every state of the Spark DataFrame history, one applyInPandas group per state.
+
+    The history is hash partitioned by state into num_partitions (default: the
+    default parallelism of the cluster) so that the fits are spread over all
+    cores. Returns (forecasts, metrics) as Spark DataFrames; the fitted output is
+    cached so that both can be used without fitting the models twice. A model
+    store has to be on a file system shared by the workers (e.g. /dbfs).
+    """
+    from pyspark import SparkContext
+    from pyspark.sql.functions import col
+
+    def fit_group(pdf):
+        forecast, metrics = _forecast_state(pdf['state'].iloc[0], pdf, params, periods, freq, store)
+        output = pd.concat([forecast, pd.DataFrame([metrics])], ignore_index=True)
+        output['n_obs'] = output['n_obs'].astype('Int64')
+        return output
+
+    num_partitions = num_partitions or SparkContext.getOrCreate().defaultParallelism
+    output = history.select(col(state_col).alias('state'), col(ds_col).alias('ds'), col(y_col).alias('y'))\
+        .repartition(num_partitions, 'state')\
+        .groupBy('state').applyInPandas(fit_group, schema=_OUTPUT_SCHEMA)\
+        .cache()
+    forecasts = output.where(col('ds').isNotNull()).select(*FORECAST_COLUMNS)
+    metrics = output.where(col('ds').isNull()).select(*METRIC_COLUMNS)
+    return forecasts, metrics
@@ -0,0 +1,129 @@
+"""Incremental, idempotent writes of the notebook's DELTA tables.
+
+`write_table` compares the incoming rows with what is already stored, keyed on
+(state, date), and only appends or MERGEs the rows that are new or changed.
+Running it twice on the same input writes nothing the second time. The keys
+that changed are returned so downstream tables can recompute only the affected
+weeks and months (see `affected_periods` and `restrict_to`).
+
+Delta tables are merged with delta-spark's DeltaTable API. Parquet can be used
+as a stand-in when Delta is not available (e.g. local tests): the affected
+partitions are rewritten instead of merged.
+"""
+from pyspark.sql import functions as F
+from pyspark.sql.utils import AnalysisException
+
+FULL = 'full'
+INCREMENTAL = 'incremental'
+
+# grains understood by affected_periods / restrict_to and the column each one adds
+PERIODS = {
+    'week': lambda date_col: F.to_date(F.date_trunc('week', F.col(date_col))),
+    'month': lambda date_col: F.trunc(F.col(date_col), 'month'),
+}
+
+
+def _as_list(columns):
+    if columns is None:
+        return []
+    return [columns] if isinstance(columns, str) else list(columns)
+
+
+def table_exists(spark, path, fmt='delta'):
+    if fmt == 'delta':
+        from delta.tables import DeltaTable
+        return DeltaTable.isDeltaTable(spark, path)
+    try:
+        spark.read.format(fmt).load(path).schema
+    except AnalysisException:
+        return False
+    return True
+
+
+def register_table(spark, name, path, fmt='delta'):
+    spark.sql("CREATE TABLE IF NOT EXISTS %s USING %s LOCATION '%s'" % (name, fmt, path))
+
+
+def with_period(df, grain, date_col='date'):
+    """Add a `grain` column ('week' or 'month') holding the first day of the period of date_col."""
+    return df.withColumn(grain, PERIODS[grain](date_col))
+
+
+def affected_periods(changed, grain, date_col='date', state_col='state'):
+    """Distinct (state, week|month) periods touched by the changed (state, date) keys."""
+    return with_period(changed, grain, date_col).select(state_col, grain).distinct()
+
+
+def restrict_to(df, periods, date_col='date'):
+    """Rows of df falling into one of the (state, week|month) periods."""
+    grain = [c for c in periods.columns if c in PERIODS][0]
+    return with_period(df, grain, date_col).join(periods, periods.columns, 'left_semi').drop(grain)
+
+
+def changed_rows(incoming, existing, keys=('state', 'date'), lookback_days=None, refresh=None,
+                 state_col='state', date_col='date'):
+    """Rows of incoming that are missing from existing or differ from the stored row with the same keys.
+
+    With lookback_days only incoming rows newer than (latest stored date of their
+    state - lookback_days) are compared, which keeps the comparison proportional to
+    the new data while still picking up revisions of the last few weeks. Rows in the
+    (state, week|month) periods of `refresh` are compared regardless of their age.
+    """
+    keys = list(keys)
+    value_cols = [c for c in incoming.columns if c not in keys]
+    if lookback_days is not None:
+        marks = existing.groupBy(state_col).agg(F.max(date_col).alias('_watermark'))
+        recent = F.col('_watermark').isNull() | (F.col(date_col) > F.date_sub('_watermark', lookback_days))
+        incoming = incoming.join(F.broadcast(marks), state_col, 'left')
+        if refresh is not None:
+            grain = [c for c in refresh.columns if c in PERIODS][0]
+            incoming = with_period(incoming, grain, date_col)\
+                .join(F.broadcast(refresh.withColumn('_refresh', F.lit(True))), refresh.columns, 'left')
+            recent = recent | F.col('_refresh').isNotNull()
+        incoming = incoming.where(recent)
+    stored = existing.select(*keys, F.xxhash64(*value_cols).alias('_stored_hash'))
+    return incoming.withColumn('_hash', F.xxhash64(*value_cols))\
+        .join(stored, keys, 'left')\
+        .where(F.col('_stored_hash').isNull() | (F.col('_hash') != F.col('_stored_hash')))\
+        .select(*existing.columns)
+
+
+def _overwrite(df, path, fmt, partition_by):
+    df.write.format(fmt).mode('overwrite').option('overwriteSchema', 'true').partitionBy(*partition_by).save(path)
+
+
+def write_table(spark, df, path, keys=('state', 'date'), mode=INCREMENTAL, fmt='delta', partition_by=None,
+                lookback_days=None, refresh=None, state_col='state', date_col='date'):
+    """Write df to the table at path and return the keys of the rows that were written.
+
+    mode='full' rewrites the whole table. mode='incremental' only writes rows that
+    are new or changed (see `changed_rows`), merging them on `keys`; the table is
+    created on the first run. The returned DataFrame of keys is materialized, so it
+    still describes this write after the table has been updated.
+    """
+    keys = list(keys)
+    partition_by = _as_list(partition_by)
+    if mode == FULL or not table_exists(spark, path, fmt):
+        _overwrite(df, path, fmt, partition_by)
+        # checkpointed like the incremental changes, a later write to the table must not change these keys
+        return spark.read.format(fmt).load(path).select(*keys).localCheckpoint()
+
+    existing = spark.read.format(fmt).load(path)
+    # materialize before writing, the comparison reads the table that is about to change
+    changes = changed_rows(df, existing, keys, lookback_days, refresh, state_col, date_col).localCheckpoint()
+    if changes.rdd.isEmpty():
+        return changes.select(*keys)
+
+    if fmt == 'delta':
+        from delta.tables import DeltaTable
+        condition = ' AND '.join('t.`%s` = s.`%s`' % (k, k) for k in keys)
+        DeltaTable.forPath(spark, path).alias('t').merge(changes.alias('s'), condition)\
+            .whenMatchedUpdateAll().whenNotMatchedInsertAll().execute()
+    else:
+        kept = existing
+        if partition_by:
+            kept = kept.join(changes.select(*partition_by).distinct(), partition_by, 'left_semi')
+        rewritten = kept.join(changes.select(*keys), keys, 'left_anti').unionByName(changes).localCheckpoint()
+        rewritten.write.format(fmt).mode('overwrite').option('partitionOverwriteMode', 'dynamic')\
+            .partitionBy(*partition_by).save(path)
+    return changes.select(*keys)
@@ -0,0 +1,40 @@
+"""Joins of the facts with the population dimension and with each other (Spark)."""
+from pyspark.sql.functions import col, weekofyear
+
+from covid_unemp.ingest import with_period
+from covid_unemp.population import join_population
+from covid_unemp.rollups import ALL_STATES
+
+
+def claims_with_population(claims, dim):
+    """UI claims with the population of their state and month, and the claims as % of the population."""
+    return join_population(claims, dim).select(
+        "state", "date", "Initial_Claims", "Continued_Claims", col("population"), col("Total_Employment"),
+        col("Total_Unemployment"),
+        (col("Initial_Claims")*100/col("population")).alias("Inital_Claims_as_%_of_population"),
+        (col("Continued_Claims")*100/col("population")).alias("Continued_Claims_as_%_of_population"),
+        (col("Total_Employment")*100/col("population")).alias("Employment_Rate"))
+
+
+def covid_with_population(covid, dim):
+    """COVID cases and deaths with their % of the population of the state (column names allowed by DELTA)."""
+    return join_population(covid, dim).select(
+        "date", "state", "cases", "deaths",
+        (col("cases")*100/col("population")).alias("cases_as_p_of_population"),
+        (col("deaths")*100/col("population")).alias("deaths_as_p_of_population"))
+
+
+def weekly_claims_covid(claims_joined, covid_rollup, since='2020-01-01'):
+    """UI claims since `since` joined with the COVID cases of the same state and week.
+
+    The weekly cases come from the COVID rollup (covid_unemp.rollups); weeks are
+    matched on their first day so that weeks of different years are not mixed up.
+    Weeks without cases get 0.
+    """
+    covid_week = covid_rollup.where((col("grain") == "week") & (col("state") != ALL_STATES)).select(
+        "state", col("period").alias("week"), "cases", "deaths",
+        col("cases_as_p_of_population").alias("cases_as_%_of_population"),
+        col("deaths_as_p_of_population").alias("deaths_as_%_of_population"))
+    claims = with_period(claims_joined.where(col("date") >= since), "week")\
+        .withColumn("week_of_year", weekofyear("date"))
+    return claims.join(covid_week, ['state', 'week'], 'left_outer').drop("week").na.fill(0)
@@ -0,0 +1,149 @@
+"""CSV loaders with declared schemas for the three sources of the analysis.
+
+Each file is read in a single pass with an explicit schema (no inferSchema scan).
+Padded values like "56.8   " are trimmed by the CSV reader and numbers with
+thousands separators are cleaned with native expressions, so the loaders return
+typed data ready for the joins. Rows that cannot be parsed are not silently
+turned into nulls: they are split off into a `rejected` DataFrame which can be
+added to a quarantine table with `quarantine`.
+"""
+from pyspark.sql.functions import coalesce, col, current_timestamp, lit, sha2, struct, to_json, when
+from pyspark.sql.types import DateType, DoubleType, IntegerType, LongType, StringType, StructField, StructType
+
+from covid_unemp.backends import Loaded
+from covid_unemp.cleaning import claims_columns
+from covid_unemp.ingest import table_exists
+
+CORRUPT_RECORD = '_corrupt_record'
+
+
+def _schema(*fields):
+    return StructType([StructField(name, dtype, True) for name, dtype in fields]
+                      + [StructField(CORRUPT_RECORD, StringType(), True)])
+
+
+# numbers of the claims file contain thousands separators, they are read as strings and cleaned
+CLAIMS_SCHEMA = _schema(
+    ('State', StringType()),
+    ('Filed_week_ended', StringType()),
+    ('Initial_Claims', StringType()),
+    ('Reflecting_Week_Ended', StringType()),
+    ('Continued_Claims', StringType()),
+    ('Covered_Employment', StringType()),
+    ('Insured_Unemployment_Rate', StringType()),
+)
+
+POPULATION_SCHEMA = _schema(
+    ('FIPS_Code', StringType()),
+    ('State_and_area', StringType()),
+    ('Year', IntegerType()),
+    ('Month', IntegerType()),
+    ('population', LongType()),
+    ('Total', LongType()),
+    ('Percent_of_population', DoubleType()),
+    ('Total_Employment', LongType()),
+    ('Employment_As_Percent_of_population', DoubleType()),
+    ('Total_Unemployment', LongType()),
+    ('Unemployment_Rate', DoubleType()),
+)
+
+COVID_STATES_SCHEMA = _schema(
+    ('date', DateType()),
+    ('state', StringType()),
+    ('fips', IntegerType()),
+    ('cases', LongType()),
+    ('deaths', LongType()),
+)
+
+
+def read_csv(spark, path, schema):
+    """Read a CSV file with a header using the declared schema; malformed rows land in _corrupt_record."""
+    return spark.read.format('csv')\
+        .option('header', 'true')\
+        .option('mode', 'PERMISSIVE')\
+        .option('columnNameOfCorruptRecord', CORRUPT_RECORD)\
+        .option('ignoreLeadingWhiteSpace', 'true')\
+        .option('ignoreTrailingWhiteSpace', 'true')\
+        .schema(schema)\
+        .load(path)
+
+
+def split_rejected(raw, columns, required, source):
+    """Parse raw into the given columns and split off the rows that fail.
+
+    columns is a list of (name, expression, raw column); a row is rejected when it
+    is malformed, when one of the required columns is null or when a raw value is
+    present but its expression returns null.
+    """
+    data_columns = [f.name for f in raw.schema.fields if f.name != CORRUPT_RECORD]
+    parsed = raw.select('*', *[expr.alias('_parsed_' + name) for name, expr, _ in columns])
+    checks = [when(col(CORRUPT_RECORD).isNotNull(), lit('malformed row'))]
+    checks += [when(col('_parsed_' + name).isNull(), lit('missing ' + name)) for name in required]
+    checks += [when(col('_parsed_' + name).isNull() & col(raw_column).isNotNull(), lit('unparsable ' + raw_column))
+               for name, _, raw_column in columns if raw_column]
+    parsed = parsed.withColumn('_reject_reason', coalesce(*checks))
+
+    data = parsed.where(col('_reject_reason').isNull())\
+        .select(*[col('_parsed_' + name).alias(name) for name, _, _ in columns])
+    rejected = parsed.where(col('_reject_reason').isNotNull())\
+        .select(lit(source).alias('source'), col('_reject_reason').alias('reason'),
+                col(CORRUPT_RECORD).alias('record'),
+                to_json(struct(*[col(c).cast('string') for c in data_columns])).alias('values'),
+                current_timestamp().alias('loaded_at'))
+    return Loaded(data, rejected)
+
+
+def _typed_columns(schema):
+    return [(f.name, col(f.name), None) for f in schema.fields if f.name != CORRUPT_RECORD]
+
+
+def load_claims(spark, path):
+    """UI claims: state, date, Initial_Claims, Continued_Claims, Covered_Employment,
+    Insured_Unemployment_Rate and Reflecting_Week_Ended, cleaned and typed."""
+    return split_rejected(read_csv(spark, path, CLAIMS_SCHEMA), claims_columns(), ['state', 'date'], 'claims')
+
+
+def load_population(spark, path):
+    """Monthly civilian non-institutional population (and employment) of the states."""
+    return split_rejected(read_csv(spark, path, POPULATION_SCHEMA), _typed_columns(POPULATION_SCHEMA),
+                          ['State_and_area', 'Year', 'Month'], 'population')
+
+
+def load_covid_states(spark, path):
+    """Daily cumulative COVID-19 cases and deaths per state (NYT us-states.csv)."""
+    return split_rejected(read_csv(spark, path, COVID_STATES_SCHEMA), _typed_columns(COVID_STATES_SCHEMA),
+                          ['date', 'state'], 'covid_states')
+
+
+def quarantine(rejected, path, fmt='delta'):
+    """Add rejected rows to the quarantine table at path, once per source and raw row.
+
+    Rows are keyed on (source, row_key), the sha256 of the malformed record or
+    of the values of the row; a row rejected again by a later run keeps its
+    first loaded_at.
+    """
+    from pyspark.sql import SparkSession
+    spark = SparkSession.getActiveSession()
+
+    def keyed(df):
+        return df.withColumn('row_key', sha2(coalesce(col('record'), col('values')), 256))\
+            .dropDuplicates(['source', 'row_key'])
+
+    rows = keyed(rejected)
+    if not table_exists(spark, path, fmt):
+        rows.write.format(fmt).mode('overwrite').save(path)
+        return
+    existing = spark.read.format(fmt).load(path)
+    if 'row_key' not in existing.columns:
+        # table of the append-only quarantine, rewritten once without its repeated rows
+        rows = keyed(existing).unionByName(rows).dropDuplicates(['source', 'row_key']).localCheckpoint()
+        rows.write.format(fmt).mode('overwrite').option('overwriteSchema', 'true').save(path)
+        return
+    if fmt == 'delta':
+        from delta.tables import DeltaTable
+        DeltaTable.forPath(spark, path).alias('t')\
+            .merge(rows.alias('s'), 't.source = s.source AND t.row_key = s.row_key')\
+            .whenNotMatchedInsertAll().execute()
+    else:
+        rows.join(existing.select('source', 'row_key'), ['source', 'row_key'], 'left_anti')\
+            .localCheckpoint().write.format(fmt).mode('append').save(path)
@@ -0,0 +1,186 @@
+"""On-disk store of fitted Prophet models, with warm-started refits.
+
+Models are keyed on (series id, hyperparameters, fingerprint of the training
+data). `ModelStore.fit` returns the stored model when the training data did
+not change. When the data only gained new points at the end, the model fitted
+on the previous data is used to warm-start the optimizer instead of fitting
+from scratch. Least recently used models are evicted when the store exceeds
+max_entries or max_bytes.
+
+Every model is kept as two files, <key>.json (metadata) and <key>.model.json
+(the serialized model), written atomically, so processes sharing the directory
+(the process pool or Spark tasks on a shared file system) do not need to
+coordinate.
+"""
+import hashlib
+import json
+import os
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from covid_unemp.forecasting import prophet_class
+
+HIT = 'hit'
+WARM = 'warm'
+MISS = 'miss'
+
+
+def _serializer():
+    try:
+        from prophet.serialize import model_from_json, model_to_json
+    except ImportError:
+        from fbprophet.serialize import model_from_json, model_to_json
+    return model_to_json, model_from_json
+
+
+def _digest(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+
+def warm_start_params(model):
+    """Fitted parameters of model in the form accepted by Prophet.fit(init=...)."""
+    params = {}
+    for name in ['k', 'm', 'sigma_obs']:
+        params[name] = model.params[name][0][0] if model.mcmc_samples == 0 else np.mean(model.params[name])
+    for name in ['delta', 'beta']:
+        params[name] = model.params[name][0] if model.mcmc_samples == 0 else np.mean(model.params[name], axis=0)
+    return params
+
+
+class ModelStore(object):
+
+    def __init__(self, root, max_entries=None, max_bytes=None):
+        self.root = root
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stats = Counter()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key, suffix='.json'):
+        return os.path.join(self.root, key + suffix)
+
+    def _entries(self, prefix=''):
+        entries = []
+        for name in os.listdir(self.root):
+            if name.startswith(prefix) and name.endswith('.json') and not name.endswith('.model.json'):
+                try:
+                    with open(os.path.join(self.root, name)) as f:
+                        entries.append(json.load(f))
+                except (OSError, ValueError):
+                    # removed or being written by another process
+                    continue
+        return entries
+
+    def _write(self, path, text):
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def load(self, key):
+        with open(self._path(key, '.model.json')) as f:
+            model = _serializer()[1](f.read())
+        os.utime(self._path(key))
+        return model
+
+    def save(self, key, model, meta):
+        model_json = _serializer()[0](model)
+        self._write(self._path(key, '.model.json'), model_json)
+        self._write(self._path(key), json.dumps(dict(meta, key=key, bytes=len(model_json))))
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used models until the store fits max_entries and max_bytes."""
+        if self.max_entries is None and self.max_bytes is None:
+            return
+        entries = []
+        for meta in self._entries():
+            try:
+                entries.append((os.path.getmtime(self._path(meta['key'])), meta))
+            except OSError:
+                continue
+        entries.sort(key=lambda e: e[0])
+        total = sum(meta['bytes'] for _, meta in entries)
+        while entries and ((self.max_entries is not None and len(entries) > self.max_entries)
+                           or (self.max_bytes is not None and total > self.max_bytes)):
+            _, meta = entries.pop(0)
+            total -= meta['bytes']
+            for suffix in ('.json', '.model.json'):
+                try:
+                    os.remove(self._path(meta['key'], suffix))
+                except OSError:
+                    pass
+            self.stats['evicted'] += 1
+
+    def fit(self, series_id, history, params=None, regressors=()):
+        """Return (model fitted on history, HIT | WARM | MISS).
+
+        history holds ds, y and the regressor columns; regressors are added to the
+        model with add_regressor before fitting.
+        """
+        columns = ['ds', 'y'] + list(regressors)
+        history = history[columns].sort_values('ds').reset_index(drop=True)
+        row_hashes = pd.util.hash_pandas_object(history, index=False).values
+        prefix = _digest(series_id, params or {}, list(regressors))
+        key = '%s-%s' % (prefix, hashlib.sha256(row_hashes.tobytes()).hexdigest()[:32])
+
+        if os.path.exists(self._path(key, '.model.json')):
+            start = time.perf_counter()
+            with open(self._path(key)) as f:
+                meta = json.load(f)
+            model = self.load(key)
+            self._count(HIT, meta['cold_seconds'] - (time.perf_counter() - start))
+            return model, HIT
+
+        # the latest model whose training data is a prefix of history
+        base = None
+        for meta in sorted(self._entries(prefix), key=lambda m: -m['n_obs']):
+            n = meta['n_obs']
+            if n < len(history) and hashlib.sha256(row_hashes[:n].tobytes()).hexdigest()[:32] == meta['fingerprint']:
+                base = meta
+                break
+
+        def new_model():
+            model = prophet_class()(**(params or {}))
+            for name in regressors:
+                model.add_regressor(name)
+            return model
+
+        start = time.perf_counter()
+        model, status = None, MISS
+        if base is not None:
+            try:
+                model = new_model().fit(history, init=warm_start_params(self.load(base['key'])))
+                status = WARM
+            except Exception:
+                # e.g. the parameter shapes changed (fewer changepoints), fit from scratch
+                model = None
+        if model is None:
+            model = new_model().fit(history)
+        seconds = time.perf_counter() - start
+
+        # cold_seconds estimates a fit from scratch, used to report the time saved by the store
+        cold_seconds = base['cold_seconds'] if status == WARM else seconds
+        self.save(key, model, {'series_id': series_id, 'n_obs': len(history), 'fingerprint': key.split('-')[1],
+                               'fit_seconds': seconds, 'cold_seconds': cold_seconds})
+        self._count(status, cold_seconds - seconds if status == WARM else 0.0)
+        return model, status
+
+    def _count(self, status, seconds_saved):
+        self.stats[status] += 1
+        self.stats['seconds_saved'] += max(seconds_saved, 0.0)
+
+    def report(self):
+        """Lookups of this instance: hits, warm starts, misses, hit rate and seconds saved."""
+        lookups = self.stats[HIT] + self.stats[WARM] + self.stats[MISS]
+        return {
+            'hits': self.stats[HIT],
+            'warm_starts': self.stats[WARM],
+            'misses': self.stats[MISS],
+            'hit_rate': self.stats[HIT] / float(lookups) if lookups else None,
+            'seconds_saved': self.stats['seconds_saved'],
+            'evicted': self.stats['evicted'],
+        }
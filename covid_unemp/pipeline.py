@@ -0,0 +1,87 @@
+"""The load -> join -> rollup stages of the notebook as one importable function.
+
+    python -m covid_unemp.pipeline --backend local --claims coviddata/State_UI_claims_allstates_1987_Apr182020.csv \
+        --covid coviddata/us-states.csv
+
+runs them without Databricks: on pandas (`local`) or on a local Spark session
+(`spark`), see covid_unemp.backends. The forecasts are not part of it, they take
+the pandas output (covid_unemp.forecasting).
+"""
+import argparse
+import os
+import time
+
+from covid_unemp import DATA_DIR
+from covid_unemp.backends import get_backend
+
+BUNDLED_POPULATION = os.path.join(DATA_DIR, 'emp_civilian_nonInstPop_states_1976_2020.csv')
+
+CLAIMS_MEASURES = ['Initial_Claims', 'Continued_Claims', 'Insured_Unemployment_Rate']
+COVID_MEASURES = ['cases', 'deaths', 'cases_as_p_of_population', 'deaths_as_p_of_population']
+COVID_UNEMP_MEASURES = ['Initial_Claims', 'cases', 'deaths']
+
+
+def run_pipeline(backend, claims_path, covid_path, population_path=BUNDLED_POPULATION, since='2020-01-01'):
+    """Run the stages on backend (a name or an instance) and return a dict of its frames.
+
+    Keys: claims, covid, population (the typed inputs), rejected (rows rejected per
+    source), population_dim, claims_joined, covid_joined, claims_rollup,
+    covid_rollup, covid_unemp and covid_unemp_rollup.
+    """
+    if isinstance(backend, str):
+        backend = get_backend(backend)
+    claims = backend.load_claims(claims_path)
+    covid = backend.load_covid_states(covid_path)
+    pop = backend.load_population(population_path)
+
+    latest = max(backend.max_value(claims.data, 'date'), backend.max_value(covid.data, 'date'))
+    dim = backend.population_dim(pop.data, latest)
+    claims_joined = backend.claims_with_population(claims.data, dim)
+    covid_joined = backend.covid_with_population(covid.data, dim)
+    covid_rollup = backend.build_rollup(covid_joined, COVID_MEASURES)
+    covid_unemp = backend.weekly_claims_covid(claims_joined, covid_rollup, since)
+    return {
+        'claims': claims.data,
+        'covid': covid.data,
+        'population': pop.data,
+        'rejected': {'claims': claims.rejected, 'covid_states': covid.rejected, 'population': pop.rejected},
+        'population_dim': dim,
+        'claims_joined': claims_joined,
+        'covid_joined': covid_joined,
+        'claims_rollup': backend.build_rollup(claims.data, CLAIMS_MEASURES),
+        'covid_rollup': covid_rollup,
+        'covid_unemp': covid_unemp,
+        'covid_unemp_rollup': backend.build_rollup(covid_unemp, COVID_UNEMP_MEASURES),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=['local', 'spark'], default='local')
+    parser.add_argument('--claims', required=True)
+    parser.add_argument('--covid', required=True)
+    parser.add_argument('--population', default=BUNDLED_POPULATION)
+    parser.add_argument('--since', default='2020-01-01')
+    parser.add_argument('--output', help='directory to write the results to as CSV files')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    backend = get_backend(args.backend)
+    results = run_pipeline(backend, args.claims, args.covid, args.population, args.since)
+    frames = {name: backend.to_pandas(df) for name, df in results.items() if name != 'rejected'}
+    elapsed = time.perf_counter() - start
+
+    for name, pdf in frames.items():
+        print('%-20s %9d rows' % (name, len(pdf)))
+    for source, rejected in results['rejected'].items():
+        print('%-20s %9d rows rejected' % (source, len(backend.to_pandas(rejected))))
+    print('%.2f seconds' % elapsed)
+
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        for name, pdf in frames.items():
+            pdf.to_csv(os.path.join(args.output, name + '.csv'), index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""Figures of the notebook and the report, drawn from data downsampled by the engine.
+
+The plotting cells used to pull every row of their DataFrame to the driver
+with toPandas() and let matplotlib group them. Here a figure is described by a
+`PlotSpec` and its data is reduced before it leaves Spark: per series, either
+with LTTB (largest triangle three buckets, run with applyInPandas on the
+executors) or with fixed buckets keeping the rows with the min and the max of
+the plotted value (one aggregation). Only those points are transferred, with
+Arrow. pandas frames (e.g. Prophet forecasts) are downsampled the same way.
+
+`draw` returns a matplotlib Figure on an Agg canvas, independent of the pyplot
+backend, so `render_report` can write the report figures to results/ without
+a display, recording the driver memory of each figure.
+"""
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from covid_unemp.profiling import peak_rss_mb, rss_mb
+
+LTTB = 'lttb'
+BUCKET = 'bucket'
+ARROW_ENABLED = 'spark.sql.execution.arrow.pyspark.enabled'
+
+
+class PlotSpec(object):
+    """One figure: data (a callable returning a Spark or pandas DataFrame) plotted as y over x.
+
+    y is a column or a list of columns, one line each; with series, one line per
+    series value (only the first y column is drawn). band is a pair of columns
+    drawn as a shaded interval and points a column drawn as dots (e.g. the
+    observed values of a forecast). At most max_points points per series are
+    transferred and drawn.
+    """
+
+    def __init__(self, name, data, x, y, series=None, title=None, kind='line', band=None, points=None,
+                 max_points=1000, method=LTTB, figsize=(15, 7)):
+        self.name = name
+        self.data = data
+        self.x = x
+        self.y = [y] if isinstance(y, str) else list(y)
+        self.series = series
+        self.title = title or name
+        self.kind = kind
+        self.band = list(band) if band else []
+        self.points = points
+        self.max_points = max_points
+        self.method = method
+        self.figsize = figsize
+
+    @property
+    def columns(self):
+        return self.y + self.band + ([self.points] if self.points else [])
+
+
+def lttb(x, y, n_out):
+    """Indices of the n_out points of (x, y) kept by largest triangle three buckets; x must be sorted."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    kept = np.empty(n_out, dtype='int64')
+    kept[0], kept[-1] = 0, n - 1
+    every = (n - 2) / float(n_out - 2)
+    a = 0
+    for i in range(n_out - 2):
+        start = int(np.floor(i * every)) + 1
+        end = int(np.floor((i + 1) * every)) + 1
+        next_end = min(int(np.floor((i + 2) * every)) + 1, n)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.nanargmax(area)) if not np.isnan(area).all() else start
+        kept[i + 1] = a
+    return kept
+
+
+def _numeric(values):
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.astype('int64').to_numpy(dtype='float64')
+    if values.dtype == object:
+        # dates of Spark DateType columns arrive as datetime.date
+        return pd.to_datetime(values).astype('int64').to_numpy(dtype='float64')
+    return pd.to_numeric(values).to_numpy(dtype='float64')
+
+
+def _lttb_frame(pdf, x, y, max_points):
+    pdf = pdf.dropna(subset=[x, y]).sort_values(x)
+    return pdf.iloc[lttb(_numeric(pdf[x]), pdf[y].to_numpy(dtype='float64'), max_points)]
+
+
+def _bucket_frame(pdf, x, y, max_points):
+    pdf = pdf.dropna(subset=[x, y]).sort_values(x).reset_index(drop=True)
+    if pdf.empty:
+        return pdf
+    xs = _numeric(pdf[x])
+    buckets = max(max_points // 2, 1)
+    width = (xs.max() - xs.min()) / buckets if len(xs) else 0
+    bucket = np.minimum(((xs - xs.min()) / width).astype('int64'), buckets - 1) if width else np.zeros(len(xs), 'int64')
+    grouped = pdf[y].groupby(bucket)
+    return pdf.loc[sorted(set(grouped.idxmin()) | set(grouped.idxmax()))]
+
+
+def _downsample_pandas(pdf, x, columns, series, max_points, method):
+    reduce = _lttb_frame if method == LTTB else _bucket_frame
+    keep = ([series] if series else []) + [x] + [c for c in columns if c != x]
+    pdf = pdf[keep]
+    if series is None:
+        return reduce(pdf, x, columns[0], max_points).reset_index(drop=True)
+    return pd.concat([reduce(group, x, columns[0], max_points) for _, group in pdf.groupby(series, sort=True)],
+                     ignore_index=True)
+
+
+def _downsample_spark(df, x, columns, series, max_points, method):
+    from pyspark.sql import functions as F
+
+    keep = ([series] if series else []) + [x] + [c for c in columns if c != x]
+    df = df.select(*['`%s`' % c for c in keep])
+    if method == LTTB:
+        schema = df.schema
+        group = series or '_group'
+        if series is None:
+            df = df.withColumn('_group', F.lit(0))
+        reduced = df.groupBy(group).applyInPandas(
+            lambda pdf: _lttb_frame(pdf[keep], x, columns[0], max_points), schema=schema)
+        return reduced
+
+    # fixed buckets over the x range of every series, keeping the rows with the min and the max of y
+    y = columns[0]
+    if df.schema[x].dataType.typeName() in ('date', 'timestamp'):
+        xs = F.col('`%s`' % x).cast('timestamp').cast('double')
+    else:
+        xs = F.col('`%s`' % x).cast('double')
+    buckets = max(max_points // 2, 1)
+    df = df.where(F.col('`%s`' % y).isNotNull()).withColumn('_x', xs)
+    keys = [series] if series else []
+    bounds = df.groupBy(*keys).agg(F.min('_x').alias('_lo'), F.max('_x').alias('_hi'))
+    df = df.join(F.broadcast(bounds), keys) if keys else df.crossJoin(F.broadcast(bounds))
+    width = (F.col('_hi') - F.col('_lo')) / buckets
+    bucket = F.when(width > 0, F.least(F.floor((F.col('_x') - F.col('_lo')) / width), F.lit(buckets - 1)))\
+        .otherwise(F.lit(0))
+    row = F.struct(*[F.col('`%s`' % c) for c in [y] + [c for c in keep if c != y]])
+    extremes = df.groupBy(*keys + [bucket.alias('_bucket')])\
+        .agg(F.min(row).alias('_min'), F.max(row).alias('_max'))\
+        .select(F.explode(F.array('_min', '_max')).alias('_row')).distinct()
+    return extremes.select(*[F.col('_row')['`%s`' % c].alias(c) for c in keep])
+
+
+def downsample(df, x, y, series=None, max_points=1000, method=LTTB):
+    """At most max_points rows of each series of df, selected on the first y column.
+
+    Works on a Spark DataFrame (reduced by the engine) or a pandas frame. The
+    other y columns are carried along with the selected rows.
+    """
+    columns = [y] if isinstance(y, str) else list(y)
+    if isinstance(df, pd.DataFrame):
+        return _downsample_pandas(df, x, columns, series, max_points, method)
+    return _downsample_spark(df, x, columns, series, max_points, method)
+
+
+def to_pandas(df):
+    """pandas frame of df, transferred with Arrow when df is a Spark DataFrame.
+
+    Arrow is enabled on the session for the transfer only, the previous
+    setting is restored afterwards.
+    """
+    if isinstance(df, pd.DataFrame):
+        return df
+    conf = df.sparkSession.conf
+    previous = conf.get(ARROW_ENABLED, None)
+    conf.set(ARROW_ENABLED, 'true')
+    try:
+        return df.toPandas()
+    finally:
+        if previous is None:
+            conf.unset(ARROW_ENABLED)
+        else:
+            conf.set(ARROW_ENABLED, previous)
+
+
+def fetch(spec):
+    """The downsampled data of spec as a pandas frame sorted on x."""
+    df = downsample(spec.data(), spec.x, spec.columns, spec.series, spec.max_points, spec.method)
+    return to_pandas(df).sort_values(([spec.series] if spec.series else []) + [spec.x]).reset_index(drop=True)
+
+
+def _plot(ax, kind, x, y, label):
+    if kind == 'bar':
+        ax.bar(x, y, label=label)
+    else:
+        ax.plot(x, y, label=label)
+
+
+def draw(spec, pdf=None):
+    """matplotlib Figure of spec (on an Agg canvas), drawn from pdf or from fetch(spec)."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    if pdf is None:
+        pdf = fetch(spec)
+    fig = Figure(figsize=spec.figsize)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    if spec.series:
+        # series are drawn separately, their downsampled x values differ
+        for name, group in pdf.groupby(spec.series, sort=True):
+            _plot(ax, spec.kind, group[spec.x], group[spec.y[0]], str(name))
+    else:
+        for c in spec.y:
+            _plot(ax, spec.kind, pdf[spec.x], pdf[c], c)
+    if spec.band:
+        ax.fill_between(pdf[spec.x], pdf[spec.band[0]], pdf[spec.band[1]], alpha=0.2)
+    if spec.points:
+        ax.plot(pdf[spec.x], pdf[spec.points], 'k.', markersize=3, label=spec.points)
+    ax.set_title(spec.title)
+    ax.tick_params(axis='x', labelrotation=90)
+    ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
+    fig.tight_layout()
+    return fig
+
+
+def _arrow_mb():
+    try:
+        import pyarrow
+    except ImportError:
+        return None
+    return pyarrow.total_allocated_bytes() / (1024.0 * 1024.0)
+
+
+def render_report(specs, out_dir='results', dpi=100):
+    """Draw every spec to out_dir/<name>.png without a display.
+
+    Returns one dict per figure: name, path, points (rows transferred to the
+    driver), seconds and the memory of the driver process, which includes
+    pyarrow and the native buffers of pandas and matplotlib: rss_increase_mb
+    (resident set after the figure was saved minus before),
+    peak_rss_increase_mb (increase of the high-water mark of the process, 0
+    when the figure stayed below an earlier peak) and arrow_mb (bytes allocated
+    by the pyarrow memory pool once the data was fetched, None without pyarrow).
+    The JVM of the driver is not included.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rows = []
+    for spec in specs:
+        path = os.path.join(out_dir, spec.name + '.png')
+        rss, peak = rss_mb(), peak_rss_mb()
+        start = time.perf_counter()
+        pdf = fetch(spec)
+        arrow = _arrow_mb()
+        fig = draw(spec, pdf)
+        fig.savefig(path, dpi=dpi)
+        seconds = time.perf_counter() - start
+        rss_after = rss_mb()
+        rows.append({'name': spec.name, 'path': path, 'points': len(pdf), 'seconds': seconds,
+                     'rss_increase_mb': rss_after - rss if rss is not None and rss_after is not None else None,
+                     'peak_rss_increase_mb': peak_rss_mb() - peak, 'arrow_mb': arrow})
+    return rows
@@ -0,0 +1,55 @@
+"""Population dimension shared by the claims and COVID joins.
+
+The population data is monthly and tiny (~28k rows), so it is turned once into
+a dimension keyed by (state, year_month), with year_month an integer yyyymm,
+and broadcast to every join. Joining on these two equality keys lets Spark use
+a broadcast hash join instead of shuffling both sides on computed year()/month()
+expressions.
+"""
+from pyspark.sql import Window
+from pyspark.sql import functions as F
+
+# columns of the population data carried into the dimension
+POPULATION_COLUMNS = ['population', 'Total', 'Total_Employment', 'Total_Unemployment', 'Unemployment_Rate']
+
+
+def year_month(date):
+    """Integer yyyymm key of a date column."""
+    return F.year(date) * 100 + F.month(date)
+
+
+def population_dim(pop, until=None, columns=POPULATION_COLUMNS):
+    """Build the (state, year_month) population dimension from the population table.
+
+    Every state gets one row per month from its first month in the data up to
+    the month of `until` (e.g. the latest date of the facts). Months without
+    data, such as the months after the latest release, are filled forward with
+    the last known values and flagged with extrapolated = true.
+    """
+    base = pop.select(F.col('State_and_area').alias('state'),
+                      F.expr('make_date(Year, Month, 1)').alias('month'), *columns)
+    end = F.max('month')
+    if until is not None:
+        end = F.greatest(end, F.trunc(F.lit(until).cast('date'), 'month'))
+    calendar = base.groupBy('state').agg(F.min('month').alias('first'), end.alias('last'))\
+        .select('state', F.explode(F.sequence('first', 'last', F.expr('interval 1 month'))).alias('month'))
+
+    window = Window.partitionBy('state').orderBy('month')
+    filled = calendar.join(base.withColumn('_observed', F.lit(True)), ['state', 'month'], 'left')
+    return filled.select(
+        'state',
+        year_month(F.col('month')).alias('year_month'),
+        F.year('month').alias('Year'),
+        F.month('month').alias('Month'),
+        *[F.last(c, ignorenulls=True).over(window).alias(c) for c in columns],
+        F.col('_observed').isNull().alias('extrapolated'),
+    )
+
+
+def join_population(facts, dim, date_col='date', state_col='state', how='left_outer'):
+    """Join the facts to the broadcast population dimension on (state, month of date_col)."""
+    keyed = facts.withColumn('year_month', year_month(F.col(date_col)))
+    dim = dim.drop('Year', 'Month', 'extrapolated')
+    if state_col != 'state':
+        dim = dim.withColumnRenamed('state', state_col)
+    return keyed.join(F.broadcast(dim), [state_col, 'year_month'], how).drop('year_month')
@@ -0,0 +1,247 @@
+"""Per-stage profile of a run of the notebook.
+
+    profiler = Profiler(spark=spark)
+    with profiler.stage("load claims", "load") as s:
+        claims = load_claims(spark, path).data
+        s.output(claims)
+    ...
+    profiler.export("/dbfs/FileStore/profiles")
+    print(profiler.flame_table())
+
+Every stage records its wall time, the CPU time and resident memory of the
+driver Python process, the row and partition counts of the frames passed to
+input()/output() and, on Spark, the metrics of the jobs it ran (shuffle
+read/write, spill, executor run and CPU time) from the REST API of the Spark
+UI. The jobs are attributed with a job group per stage and their metrics are
+only fetched when the profile is exported, so the stages themselves pay for a
+few clock readings. Stages nest; the flame table shows each stage with its
+inclusive and self time.
+
+A disabled profiler returns the same no-op stage for every call.
+"""
+import datetime
+import json
+import os
+import resource
+import time
+import urllib.error
+import urllib.request
+import uuid
+from contextlib import contextmanager
+
+import pandas as pd
+
+KINDS = ('load', 'clean', 'join', 'write', 'aggregate', 'fit', 'predict', 'plot')
+
+SPARK_METRICS = ('jobs', 'tasks', 'input_bytes', 'output_bytes', 'shuffle_read_bytes', 'shuffle_write_bytes',
+                 'spill_bytes', 'executor_run_ms', 'executor_cpu_ms', 'peak_execution_memory')
+
+
+def _rest(spark):
+    sc = spark.sparkContext
+    if not sc.uiWebUrl:
+        return None
+    base = '%s/api/v1/applications/%s' % (sc.uiWebUrl, sc.applicationId)
+
+    def get(path):
+        with urllib.request.urlopen(base + path) as response:
+            return json.load(response)
+    return get
+
+
+def job_group_metrics(spark, job_groups, timeout=10.0):
+    """{job group: metrics summed over the stages of its jobs} from the Spark UI REST API, {} without a UI.
+
+    The UI is updated asynchronously, running jobs of the groups are waited for up to timeout seconds.
+    """
+    get = _rest(spark)
+    if get is None:
+        return {}
+    job_groups = set(job_groups)
+    deadline = time.time() + timeout
+    while True:
+        jobs = [j for j in get('/jobs') if j.get('jobGroup') in job_groups]
+        if all(j['status'] != 'RUNNING' for j in jobs) or time.time() > deadline:
+            break
+        time.sleep(0.2)
+
+    totals = {g: dict.fromkeys(SPARK_METRICS, 0) for g in job_groups}
+    stages = {}
+    for j in jobs:
+        totals[j['jobGroup']]['jobs'] += 1
+        for stage_id in j['stageIds']:
+            stages[stage_id] = j['jobGroup']
+    for stage_id, group in sorted(stages.items()):
+        try:
+            attempts = get('/stages/%d' % stage_id)
+        except urllib.error.HTTPError:
+            # skipped stages that were never submitted
+            continue
+        t = totals[group]
+        for a in attempts:
+            t['tasks'] += a.get('numCompleteTasks', 0)
+            t['input_bytes'] += a.get('inputBytes', 0)
+            t['output_bytes'] += a.get('outputBytes', 0)
+            t['shuffle_read_bytes'] += a.get('shuffleReadBytes', 0)
+            t['shuffle_write_bytes'] += a.get('shuffleWriteBytes', 0)
+            t['spill_bytes'] += a.get('memoryBytesSpilled', 0) + a.get('diskBytesSpilled', 0)
+            t['executor_run_ms'] += a.get('executorRunTime', 0)
+            t['executor_cpu_ms'] += a.get('executorCpuTime', 0) // 1000000
+            t['peak_execution_memory'] += a.get('peakExecutionMemory', 0)
+    return totals
+
+
+def spark_stage_metrics(spark, job_group, timeout=10.0):
+    """Metrics of the jobs of one job group (see job_group_metrics)."""
+    return job_group_metrics(spark, [job_group], timeout).get(job_group, {})
+
+
+def rss_mb():
+    """Resident set of this process in MB (from /proc), None where it is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024.0 * 1024.0)
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss_mb():
+    """High-water mark of the resident set of this process in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _count(frame, count):
+    """(rows, partitions) of a Spark or pandas frame or a row count; Spark rows are only counted with count=True."""
+    if frame is None:
+        return None, None
+    if isinstance(frame, int):
+        return frame, None
+    if isinstance(frame, pd.DataFrame):
+        return len(frame), None
+    return (frame.count() if count else None), frame.rdd.getNumPartitions()
+
+
+class _StageRecord(object):
+
+    def __init__(self, profiler, name, kind, parent, depth):
+        self.profiler = profiler
+        self.name = name
+        self.kind = kind
+        self.parent = parent
+        self.depth = depth
+        self.job_group = 'profile-%s-%d' % (profiler.run_id, len(profiler.records))
+        self.record = {'stage': name, 'kind': kind, 'parent': parent, 'depth': depth, 'job_group': self.job_group,
+                       'rows_in': None, 'partitions_in': None, 'rows_out': None, 'partitions_out': None}
+
+    def input(self, frame, count=False):
+        """Record the rows (counted only with count=True for Spark) and partitions of an input."""
+        self.record['rows_in'], self.record['partitions_in'] = _count(frame, count)
+
+    def output(self, frame, count=False):
+        """Record the rows (counted only with count=True for Spark) and partitions of the output."""
+        self.record['rows_out'], self.record['partitions_out'] = _count(frame, count)
+
+
+class _DisabledStage(object):
+    """What a disabled profiler returns: a context manager and stage record doing nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def input(self, frame, count=False):
+        pass
+
+    def output(self, frame, count=False):
+        pass
+
+
+_DISABLED = _DisabledStage()
+
+
+class Profiler(object):
+
+    def __init__(self, spark=None, enabled=True, run_id=None):
+        self.spark = spark
+        self.enabled = enabled
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.started_at = datetime.datetime.now()
+        self.records = []
+        self._open = []
+        self._start = time.perf_counter()
+
+    def stage(self, name, kind=None):
+        """Context manager profiling the code of one stage; kind is one of KINDS."""
+        if not self.enabled:
+            return _DISABLED
+        return self._stage(name, kind)
+
+    @contextmanager
+    def _stage(self, name, kind):
+        parent = self._open[-1] if self._open else None
+        stage = _StageRecord(self, name, kind, parent.name if parent else None, len(self._open))
+        self.records.append(stage.record)
+        self._open.append(stage)
+        sc = self.spark.sparkContext if self.spark is not None else None
+        if sc is not None:
+            sc.setJobGroup(stage.job_group, name)
+        start, cpu_start, peak_start = time.perf_counter(), time.process_time(), peak_rss_mb()
+        try:
+            yield stage
+        finally:
+            stage.record.update({
+                'start_seconds': start - self._start,
+                'seconds': time.perf_counter() - start,
+                'python_cpu_seconds': time.process_time() - cpu_start,
+                'rss_mb': rss_mb(),
+                'peak_rss_increase_mb': peak_rss_mb() - peak_start,
+            })
+            self._open.pop()
+            if sc is not None:
+                if parent is not None:
+                    sc.setJobGroup(parent.job_group, parent.name)
+                else:
+                    sc.setLocalProperty('spark.jobGroup.id', None)
+                    sc.setLocalProperty('spark.job.description', None)
+
+    def profile(self):
+        """The records of the stages, with the Spark metrics of their own jobs (not of nested stages)."""
+        records = [dict(r) for r in self.records]
+        metrics = job_group_metrics(self.spark, [r['job_group'] for r in records]) if self.spark is not None else {}
+        for r in records:
+            r.update(metrics.get(r['job_group'], {}))
+        return records
+
+    def export(self, out_dir, records=None):
+        """Write the profile of the run to out_dir/profile-<run_id>.json and return its path."""
+        records = records if records is not None else self.profile()
+        os.makedirs(out_dir, exist_ok=True)
+        path = os.path.join(out_dir, 'profile-%s.json' % self.run_id)
+        with open(path, 'w') as f:
+            json.dump({'run_id': self.run_id, 'started_at': self.started_at.isoformat(timespec='seconds'),
+                       'application_id': self.spark.sparkContext.applicationId if self.spark is not None else None,
+                       'stages': records}, f, indent=1, default=str)
+        return path
+
+    def flame_table(self, records=None, width=40):
+        """Text table of the stages in run order, indented by nesting, with inclusive and self time."""
+        records = [r for r in (records if records is not None else self.records) if 'seconds' in r]
+        if not records:
+            return ''
+        total = sum(r['seconds'] for r in records if r['depth'] == 0) or 1.0
+        lines = ['%-44s %-9s %9s %9s %6s  %s' % ('stage', 'kind', 'seconds', 'self', '%', '')]
+        for i, r in enumerate(records):
+            # children directly follow their parent in the records, deeper by one
+            children = 0.0
+            for child in records[i + 1:]:
+                if child['depth'] <= r['depth']:
+                    break
+                if child['depth'] == r['depth'] + 1:
+                    children += child['seconds']
+            share = r['seconds'] / total
+            lines.append('%-44s %-9s %9.2f %9.2f %5.1f%%  %s' % (
+                ('  ' * r['depth'] + r['stage'])[:44], r['kind'] or '', r['seconds'], r['seconds'] - children,
+                100 * share, '#' * int(round(share * width))))
+        return '\n'.join(lines)
@@ -0,0 +1,103 @@
+"""Materialized rollups of the fact tables by state x day/week/month.
+
+A rollup holds one row per (grain, state, period) with the sums of the measures,
+where state is ALL_STATES for the totals over all states and period is the first
+day of the period (the date itself for the 'day' grain). It is computed in one
+pass with GROUPING SETS, stored as a table partitioned by grain and refreshed
+incrementally: only the days, weeks and months touched by changed fact rows are
+aggregated again and merged (see covid_unemp.ingest).
+
+The notebook's monthly, weekly and all states views are slices of these tables
+(`rollup_slice`) instead of group-bys over the full facts.
+"""
+import uuid
+
+from pyspark.sql import functions as F
+
+from covid_unemp.ingest import FULL, INCREMENTAL, PERIODS, table_exists, with_period, write_table
+
+GRAINS = ('day', 'week', 'month')
+ALL_STATES = 'All States'
+ROLLUP_KEYS = ('grain', 'state', 'period')
+
+
+def build_rollup(spark, facts, measures, date_col='date', state_col='state', grains=GRAINS):
+    """Aggregate the measures of facts for every grain, per state and over all states.
+
+    Columns: grain, state, period, n_rows, first_date, last_date and one sum per measure
+    (named like the measure).
+    """
+    facts = facts.select(F.col(state_col).alias('_state'), F.col(date_col).alias('_date'), *measures)
+    for grain in grains:
+        facts = facts.withColumn(grain, F.col('_date') if grain == 'day' else PERIODS[grain]('_date'))
+    view = '_rollup_facts_%s' % uuid.uuid4().hex
+    facts.createOrReplaceTempView(view)
+
+    sets = ', '.join('(_state, {0}), ({0})'.format(g) for g in grains)
+    grain = 'CASE %s END' % ' '.join("WHEN grouping({0}) = 0 THEN '{0}'".format(g) for g in grains)
+    sums = ', '.join('sum(`{0}`) AS `{0}`'.format(m) for m in measures)
+    rollup = spark.sql("""
+        SELECT {grain} AS grain,
+               CASE WHEN grouping(_state) = 1 THEN '{all}' ELSE _state END AS state,
+               coalesce({periods}) AS period,
+               count(*) AS n_rows, min(_date) AS first_date, max(_date) AS last_date, {sums}
+        FROM {view}
+        GROUP BY GROUPING SETS ({sets})""".format(grain=grain, all=ALL_STATES, periods=', '.join(grains),
+                                                  sums=sums, view=view, sets=sets))
+    # the plan is resolved, the view is not needed anymore
+    spark.catalog.dropTempView(view)
+    return rollup
+
+
+def _affected_cells(changed, date_col, grains):
+    """(grain, period) of every rollup cell containing one of the changed dates."""
+    dates = changed.select(F.col(date_col).alias('_date')).distinct()
+    cells = [dates.select(F.lit(g).alias('grain'),
+                          (F.col('_date') if g == 'day' else PERIODS[g]('_date')).alias('period'))
+             for g in grains]
+    result = cells[0]
+    for c in cells[1:]:
+        result = result.unionByName(c)
+    return result.distinct()
+
+
+def refresh_rollup(spark, facts, path, measures, changed=None, mode=INCREMENTAL, fmt='delta',
+                   date_col='date', state_col='state', grains=GRAINS):
+    """Write the rollup of facts to the table at path and return the changed rollup keys.
+
+    In incremental mode `changed` holds the (state, date) keys of the fact rows that
+    changed since the last refresh (as returned by write_table). Only the facts of
+    the affected weeks and months are aggregated again, and only the cells of the
+    affected periods are merged.
+    """
+    if mode == FULL or changed is None or not table_exists(spark, path, fmt):
+        return write_table(spark, build_rollup(spark, facts, measures, date_col, state_col, grains), path,
+                           keys=ROLLUP_KEYS, mode=FULL, fmt=fmt, partition_by='grain')
+
+    cells = F.broadcast(_affected_cells(changed, date_col, grains))
+    subset = facts
+    coarse = [g for g in grains if g != 'day']
+    for grain in coarse:
+        periods = cells.where(F.col('grain') == grain).select(F.col('period').alias(grain), F.lit(True).alias('_' + grain))
+        subset = with_period(subset, grain, date_col).join(periods, grain, 'left')
+    if coarse:
+        subset = subset.where(F.coalesce(*[F.col('_' + g) for g in coarse]).isNotNull())
+    else:
+        subset = subset.join(changed.select(date_col).distinct(), date_col, 'left_semi')
+    subset = subset.select(*facts.columns)
+
+    rollup = build_rollup(spark, subset, measures, date_col, state_col, grains).join(cells, ['grain', 'period'], 'left_semi')
+    return write_table(spark, rollup, path, keys=ROLLUP_KEYS, mode=INCREMENTAL, fmt=fmt, partition_by='grain')
+
+
+def rollup_slice(rollup, grain, state=ALL_STATES, start=None, end=None):
+    """Rows of the rollup for one grain and state (ALL_STATES for the totals, None for every state),
+    optionally limited to periods in [start, end], ordered by period."""
+    df = rollup.where(F.col('grain') == grain)
+    if state is not None:
+        df = df.where(F.col('state') == state)
+    if start is not None:
+        df = df.where(F.col('period') >= start)
+    if end is not None:
+        df = df.where(F.col('period') <= end)
+    return df.orderBy('state', 'period')
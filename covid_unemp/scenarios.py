@@ -0,0 +1,144 @@
+"""What-if scenarios of the regressors of a fitted forecast model, evaluated in one vectorized pass.
+
+The forecast of the UI claims model with COVID cases as regressor is linear in
+the regressor at every date: Prophet standardizes the regressor and adds it
+to the additive terms (or, in multiplicative mode, multiplies the trend by
+1 + its term), and the batch forecaster does the same. `ScenarioEngine`
+therefore predicts the future frame once per regressor with the regressor
+set to 0 and to 1, which gives the intercept a(t) and the slope b(t) of every
+date. A matrix of regressor paths (scenarios x dates) is then evaluated as
+
+    yhat = a + paths * b
+
+with numpy, instead of one predict call per scenario. `bands` summarizes the
+scenarios as quantiles per week. `scaled_paths`, `shifted_paths` and
+`sampled_paths` build scenario matrices from a baseline path.
+"""
+import time
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+def _predict(model, future):
+    # the intervals of the predictions are not needed, Prophet skips simulating them without uncertainty samples
+    samples = getattr(model, 'uncertainty_samples', None)
+    if samples is not None:
+        model.uncertainty_samples = 0
+    try:
+        return model.predict(future)
+    finally:
+        if samples is not None:
+            model.uncertainty_samples = samples
+
+
+class ScenarioEngine(object):
+    """Scenarios of the regressors of model (Prophet or BatchForecaster) over the dates of future.
+
+    future is the frame the model would predict (ds and the regressor
+    columns); its regressor values are the baseline scenario, used by
+    predict_baseline and for the columns not given in evaluate.
+    """
+
+    def __init__(self, model, future, regressors=None):
+        self.model = model
+        self.future = future.reset_index(drop=True)
+        self.regressors = list(regressors or self._model_regressors(model))
+        self.ds = pd.to_datetime(self.future['ds'])
+        start = time.perf_counter()
+        self.intercept = _predict(model, self.future.assign(**dict.fromkeys(self.regressors, 0.0)))['yhat']\
+            .to_numpy(dtype='float64')
+        self.slopes = {}
+        for name in self.regressors:
+            unit = self.future.assign(**dict.fromkeys(self.regressors, 0.0)).assign(**{name: 1.0})
+            self.slopes[name] = _predict(model, unit)['yhat'].to_numpy(dtype='float64') - self.intercept
+        self.setup_seconds = time.perf_counter() - start
+        self.last_seconds = None
+
+    @staticmethod
+    def _model_regressors(model):
+        if hasattr(model, 'extra_regressors'):
+            return list(model.extra_regressors)
+        return list(model.regressors)
+
+    def baseline(self, name=None):
+        """The regressor path of future (of the only regressor when name is None)."""
+        return self.future[name or self.regressors[0]].to_numpy(dtype='float64')
+
+    def evaluate(self, paths):
+        """yhat of every scenario, a (scenarios x dates) array.
+
+        paths is a (scenarios x dates) array of the only regressor or a dict of
+        such arrays per regressor; regressors not in the dict keep their baseline.
+        """
+        start = time.perf_counter()
+        if not isinstance(paths, dict):
+            paths = {self.regressors[0]: paths}
+        n = max(np.atleast_2d(p).shape[0] for p in paths.values())
+        yhat = np.broadcast_to(self.intercept, (n, len(self.intercept))).copy()
+        for name in self.regressors:
+            values = np.atleast_2d(np.asarray(paths[name], dtype='float64')) if name in paths else self.baseline(name)
+            yhat += values * self.slopes[name]
+        self.last_seconds = time.perf_counter() - start
+        return yhat
+
+    def latency_per_1000(self, paths, repeat=5):
+        """Median seconds to evaluate 1,000 of the scenarios of paths."""
+        n = np.atleast_2d(next(iter(paths.values())) if isinstance(paths, dict) else paths).shape[0]
+        times = []
+        for _ in range(repeat):
+            self.evaluate(paths)
+            times.append(self.last_seconds)
+        return float(np.median(times)) * 1000.0 / n
+
+    def bands(self, paths, quantiles=QUANTILES, noise=False, seed=0):
+        """Quantiles of the scenarios per week (weeks starting on Monday, the mean of the dates of a week).
+
+        With noise=True every scenario gets the observation noise of the model,
+        estimated from the width of its forecast interval at each date.
+        """
+        yhat = self.evaluate(paths)
+        if noise:
+            yhat = yhat + np.random.RandomState(seed).normal(size=yhat.shape) * self._noise_sd()
+        week = (self.ds - pd.to_timedelta(self.ds.dt.weekday, unit='D')).to_numpy()
+        weekly = pd.DataFrame(yhat.T, index=week).groupby(level=0).mean()
+        out = pd.DataFrame(np.quantile(weekly.to_numpy(), quantiles, axis=1).T, index=weekly.index,
+                           columns=['q%02d' % round(100 * q) for q in quantiles])
+        out.insert(0, 'mean', weekly.mean(axis=1))
+        out.insert(0, 'scenarios', yhat.shape[0])
+        return out.rename_axis('week').reset_index()
+
+    def _noise_sd(self):
+        forecast = self.model.predict(self.future)
+        z = NormalDist().inv_cdf(0.5 + min(getattr(self.model, 'interval_width', 0.8), 0.998) / 2)
+        return ((forecast['yhat_upper'] - forecast['yhat_lower']).to_numpy(dtype='float64') / (2 * z))
+
+
+def scaled_paths(base, factors, start=0):
+    """One scenario per factor: base multiplied by the factor from index start on."""
+    base = np.asarray(base, dtype='float64')
+    paths = np.tile(base, (len(factors), 1))
+    paths[:, start:] *= np.asarray(factors, dtype='float64')[:, None]
+    return paths
+
+
+def shifted_paths(base, shifts, start=0):
+    """One scenario per shift: the part of base from start on delayed (> 0) or advanced (< 0) by shift dates."""
+    base = np.asarray(base, dtype='float64')
+    paths = np.tile(base, (len(shifts), 1))
+    index = np.arange(start, len(base))
+    for i, shift in enumerate(shifts):
+        paths[i, start:] = base[np.clip(index - int(shift), 0, len(base) - 1)]
+    return paths
+
+
+def sampled_paths(base, n, sigma=0.1, start=0, seed=0):
+    """n scenarios of base multiplied from start on by a log-normal random walk with steps of sd sigma."""
+    base = np.asarray(base, dtype='float64')
+    steps = np.random.RandomState(seed).normal(0.0, sigma, size=(n, len(base) - start))
+    paths = np.tile(base, (n, 1))
+    paths[:, start:] *= np.exp(np.cumsum(steps, axis=1))
+    return paths
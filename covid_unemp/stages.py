@@ -0,0 +1,201 @@
+"""Stage graph of the intermediates shared by the cells of the notebook.
+
+Spark recomputes the whole lineage of a DataFrame on every action (show,
+display, collect, toPandas, writes) unless it is persisted. A stage declares
+how its DataFrame is built from other stages, its storage level, its
+partitioning and the cells that consume it:
+
+    stages = StageGraph()
+    stages.add('claims', lambda: spark.sql('SELECT * from unempClaimData_delta'),
+               partition_by='state', consumers=['final view', 'claims rollup'])
+    with stages.consume('final view', 'claims', actions=2) as (claims,):
+        claims.show(5)
+        claims.agg(max_('date')).collect()
+
+A stage is built on first use; a persisted stage is then materialized with a
+count(), so it is fully cached before any cell reads it. It is unpersisted as
+soon as its last consumer (cell or persisted downstream stage) has finished,
+so a stage has to be declared before the last consumer of its inputs finishes;
+`add` raises when an input was already released.
+
+`report` tells how many times each stage is expected to be computed, derived
+from the declared actions: once for a persisted stage, once per action over a
+stage that is not persisted or over a downstream stage that is not persisted
+either. With StageGraph(measure=True) (benchmarks) the computations are also
+measured: the plan of every stage passes its partitions through a mapInArrow
+that adds 1 to an accumulator of the stage per partition computed, below the
+cache, so reads of cached partitions are not counted and a recomputation (e.g.
+after cached partitions were evicted) is. This sends every row of the stages
+through a Python worker, which is why it is off by default. The measured count
+(partitions computed / number of partitions) is reported next to the expected
+one; actions that only read some partitions (show) give fractions.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from pyspark import StorageLevel
+
+
+def _as_list(values):
+    if values is None:
+        return []
+    return [values] if isinstance(values, str) else list(values)
+
+
+class Stage(object):
+
+    def __init__(self, name, build, inputs, storage, partition_by, num_partitions, consumers):
+        self.name = name
+        self.build = build
+        self.inputs = inputs
+        self.storage = storage
+        self.partition_by = partition_by
+        self.num_partitions = num_partitions
+        self.consumers = consumers
+        self.consumed = []
+        self.frame = None
+        self.materialized = False
+        self.released = False
+        self.expected = 0
+        self.partitions_computed = None
+
+    @property
+    def persisted(self):
+        return self.storage is not None
+
+
+def _counted(df, accumulator):
+    """df passing through a Python map that adds 1 to accumulator for every partition it computes."""
+    def count_partition(batches):
+        accumulator.add(1)
+        for batch in batches:
+            yield batch
+    if hasattr(df, 'mapInArrow'):
+        return df.mapInArrow(count_partition, df.schema)
+    # before Spark 3.3
+    return df.mapInPandas(count_partition, df.schema)
+
+
+class StageGraph(object):
+
+    def __init__(self, measure=False):
+        """With measure=True the stages are wrapped to count their computations (see the module docstring)."""
+        self.stages = OrderedDict()
+        self.measure = measure
+
+    def add(self, name, build, inputs=(), storage=StorageLevel.MEMORY_AND_DISK, partition_by=None,
+            num_partitions=None, consumers=()):
+        """Declare a stage built by build(*frames of inputs).
+
+        storage=None leaves the stage unpersisted. With partition_by the DataFrame
+        is hash partitioned on these columns (into num_partitions, default
+        spark.sql.shuffle.partitions) before it is persisted. consumers are the
+        names of the cells using the stage; stages with the stage among their
+        inputs are consumers as well.
+        """
+        for i in inputs:
+            if i not in self.stages:
+                raise KeyError('unknown input stage %s of %s' % (i, name))
+            if self.stages[i].released:
+                raise RuntimeError('input stage %s of %s was already released, declare %s before the last consumer '
+                                   'of %s finishes' % (i, name, name, i))
+        self.stages[name] = Stage(name, build, list(inputs), storage, _as_list(partition_by), num_partitions,
+                                  list(consumers))
+        return self
+
+    def get(self, name):
+        """DataFrame of the stage, built on first use; a persisted stage is also cached with a count()."""
+        stage = self.stages[name]
+        if stage.frame is None:
+            df = stage.build(*[self.get(i) for i in stage.inputs])
+            if stage.partition_by:
+                df = df.repartition(*([stage.num_partitions] if stage.num_partitions else []) + stage.partition_by)
+            if self.measure:
+                stage.partitions_computed = df.sparkSession.sparkContext.accumulator(0)
+                df = _counted(df, stage.partitions_computed)
+            if stage.persisted:
+                df = df.persist(stage.storage)
+            stage.frame = df
+            if stage.persisted:
+                # a full action, show() or display() would only cache the partitions they read
+                df.count()
+                self._compute(name)
+        return stage.frame
+
+    @contextmanager
+    def consume(self, consumer, *names, **kwargs):
+        """Yield the frames of the named stages to the cell `consumer`, which runs `actions` actions on them.
+
+        When the block finishes the expected computations of the actions are
+        added and every stage without pending consumers is unpersisted.
+        """
+        actions = kwargs.pop('actions', 1)
+        if kwargs:
+            raise TypeError('unexpected arguments %s' % ', '.join(kwargs))
+        yield tuple(self.get(name) for name in names)
+        for name in names:
+            for _ in range(actions):
+                self._compute(name)
+            self.stages[name].consumed.append(consumer)
+        self._release_finished()
+
+    def _compute(self, name):
+        stage = self.stages[name]
+        if stage.persisted and stage.materialized and not stage.released:
+            return
+        stage.expected += 1
+        if stage.persisted and not stage.released:
+            stage.materialized = True
+        for i in stage.inputs:
+            self._compute(i)
+
+    def _dependents(self, name):
+        return [s for s in self.stages.values() if name in s.inputs]
+
+    def pending(self, name):
+        """Consumers of the stage that did not finish yet."""
+        stage = self.stages[name]
+        pending = [c for c in stage.consumers if c not in stage.consumed]
+        pending += [d.name for d in self._dependents(name)
+                    if not (d.released or (d.persisted and d.materialized))]
+        return pending
+
+    def _release_finished(self):
+        # downstream stages are declared after their inputs, releasing them first can free their inputs
+        for stage in reversed(list(self.stages.values())):
+            if stage.frame is not None and not stage.released and not self.pending(stage.name):
+                self.release(stage.name)
+
+    def release(self, name):
+        stage = self.stages[name]
+        if stage.persisted and stage.frame is not None:
+            stage.frame.unpersist()
+        stage.released = True
+
+    def close(self):
+        """Unpersist every stage, e.g. at the end of the run."""
+        for name in reversed(list(self.stages)):
+            if not self.stages[name].released:
+                self.release(name)
+
+    def report(self):
+        """One dict per stage: storage level, partitioning, consumers, times computed (measured and expected)
+        and whether it was released."""
+        rows = []
+        for stage in self.stages.values():
+            partitions = stage.frame.rdd.getNumPartitions() if stage.frame is not None else None
+            measured = stage.partitions_computed.value if stage.partitions_computed is not None else None
+            rows.append({
+                'stage': stage.name,
+                'inputs': ', '.join(stage.inputs),
+                'storage': str(stage.storage) if stage.persisted else 'none',
+                'partition_by': ', '.join(stage.partition_by),
+                'partitions': partitions,
+                'consumers': ', '.join(stage.consumers),
+                'consumed_by': ', '.join(stage.consumed),
+                'partitions_computed': measured,
+                'computed': round(measured / float(partitions), 2) if measured is not None and partitions else None,
+                'expected': stage.expected,
+                'released': stage.released,
+            })
+        return rows
@@ -0,0 +1,164 @@
+"""Summary statistics of metrics computed in a single aggregation pass.
+
+`summarize` returns, per group and metric, what the notebook used to get from
+describe() plus one `WHERE x == (SELECT MAX(x) ...)` query per extreme: count,
+mean, stddev, min, max, approximate quantiles and the rows holding the minimum
+and maximum (argmin/argmax, every tied row). The statistics and the extreme
+values of all metrics are computed in one aggregation; the rows holding the
+extremes are then selected by one filter over the data joined to the extremes
+of its group, so the data is scanned twice whatever the number of metrics.
+"""
+from collections import OrderedDict, namedtuple
+
+import pandas as pd
+from pyspark.sql import functions as F
+from pyspark.sql.types import StructField, StructType
+
+QUANTILES = (0.25, 0.5, 0.75)
+
+# argmin/argmax are lists of dicts of the key columns and the metric, one per row holding the extreme (ties
+# included, ordered on the keys; empty without rows)
+MetricSummary = namedtuple('MetricSummary', ['count', 'mean', 'stddev', 'min', 'max', 'quantiles', 'argmin', 'argmax'])
+
+
+class Summary(object):
+    """Statistics of every group (a tuple of the group_by values, () without grouping) and metric."""
+
+    def __init__(self, metrics, group_by, groups):
+        self.metrics = metrics
+        self.group_by = group_by
+        self.groups = groups
+
+    def __getitem__(self, metric):
+        """MetricSummary of metric, without grouping."""
+        return self.groups[()][metric]
+
+    def group(self, *values):
+        return self.groups[tuple(values)]
+
+    def describe(self):
+        """describe()-like pandas frame: one row per statistic, one column per (group, metric)."""
+        columns = OrderedDict()
+        for group, stats in self.groups.items():
+            for metric in self.metrics:
+                s = stats[metric]
+                values = OrderedDict([('count', s.count), ('mean', s.mean), ('stddev', s.stddev), ('min', s.min)])
+                values.update(('%g%%' % (q * 100), v) for q, v in s.quantiles.items())
+                values['max'] = s.max
+                columns[' '.join(str(g) for g in group + (metric,))] = pd.Series(values)
+        return pd.DataFrame(columns)
+
+
+def _key(c):
+    return F.col('`%s`' % c)
+
+
+def summarize(df, metrics, group_by=(), keys=None, quantiles=QUANTILES, accuracy=10000, latest=None):
+    """Statistics of the metric columns of df, per group_by group, in one aggregation and one filter pass.
+
+    keys are the columns reported with argmin/argmax (default: all columns
+    that are neither metrics nor group_by); every row holding the extreme is
+    reported, ties are not broken. With latest (e.g. 'date') argmin and argmax
+    are taken among the rows with the latest value of that column only (e.g.
+    the states with most cases on the last day), the other statistics over all
+    rows.
+    """
+    metrics = list(metrics)
+    group_by = list(group_by)
+    if keys is None:
+        keys = [c for c in df.columns if c not in metrics and c not in group_by]
+    keys = [k for k in keys if k not in metrics]
+    if latest is not None and latest not in keys:
+        keys = [latest] + keys
+
+    aggs = []
+    for i, m in enumerate(metrics):
+        value = _key(m)
+        aggs += [F.count(value).alias('count_%d' % i), F.mean(value).alias('mean_%d' % i),
+                 F.stddev(value).alias('stddev_%d' % i), F.min(value).alias('min_%d' % i),
+                 F.max(value).alias('max_%d' % i)]
+        if quantiles:
+            aggs.append(F.expr('percentile_approx(`%s`, array(%s), %d)'
+                               % (m, ', '.join(str(q) for q in quantiles), accuracy)).alias('quantiles_%d' % i))
+        if latest is not None:
+            # extremes among the rows of the latest value with a metric; the minimum is the maximum of the negation
+            aggs += [F.max(F.when(value.isNotNull(), F.struct(_key(latest).alias('o'), (-value).alias('v'))))
+                     .alias('argmin_%d' % i),
+                     F.max(F.when(value.isNotNull(), F.struct(_key(latest).alias('o'), value.alias('v'))))
+                     .alias('argmax_%d' % i)]
+
+    grouped = df.groupBy(*[_key(g) for g in group_by]) if group_by else df.groupBy()
+    results = grouped.agg(*aggs).collect()
+    # (latest value or None, metric value) of every group, metric and extreme
+    extremes = {}
+    for r in results:
+        group = tuple(r[g] for g in group_by)
+        for i, m in enumerate(metrics):
+            if latest is None:
+                extremes[group, i, 'argmin'] = (None, r['min_%d' % i])
+                extremes[group, i, 'argmax'] = (None, r['max_%d' % i])
+                continue
+            for name in ('argmin', 'argmax'):
+                extreme = r['%s_%d' % (name, i)]
+                if extreme is None:
+                    extremes[group, i, name] = (None, None)
+                else:
+                    extremes[group, i, name] = (extreme['o'], -extreme['v'] if name == 'argmin' else extreme['v'])
+    rows = _extreme_rows(df, metrics, group_by, keys, latest, extremes)
+
+    groups = OrderedDict()
+    for r in results:
+        group = tuple(r[g] for g in group_by)
+        stats = OrderedDict()
+        for i, m in enumerate(metrics):
+            stats[m] = MetricSummary(
+                count=r['count_%d' % i], mean=r['mean_%d' % i], stddev=r['stddev_%d' % i],
+                min=r['min_%d' % i], max=r['max_%d' % i],
+                quantiles=OrderedDict(zip(quantiles, r['quantiles_%d' % i] or [None] * len(quantiles)))
+                if quantiles else OrderedDict(),
+                argmin=rows[group, i, 'argmin'], argmax=rows[group, i, 'argmax'])
+        groups[group] = stats
+    return Summary(metrics, group_by, groups)
+
+
+def _extreme_rows(df, metrics, group_by, keys, latest, extremes):
+    """{(group, metric index, argmin/argmax): [dict of keys and metric]} of the rows of df holding the extremes."""
+    fields = [StructField('_g_%d' % j, df.schema[g].dataType, True) for j, g in enumerate(group_by)]
+    for i, m in enumerate(metrics):
+        fields += [StructField('_%s_%d' % (name, i), df.schema[m].dataType, True) for name in ('argmin', 'argmax')]
+        if latest is not None:
+            fields.append(StructField('_latest_%d' % i, df.schema[latest].dataType, True))
+    values = []
+    for group in OrderedDict.fromkeys(g for g, _, _ in extremes):
+        row = list(group)
+        for i in range(len(metrics)):
+            row += [extremes[group, i, 'argmin'][1], extremes[group, i, 'argmax'][1]]
+            if latest is not None:
+                row.append(extremes[group, i, 'argmax'][0])
+        values.append(tuple(row))
+    bounds = F.broadcast(df.sparkSession.createDataFrame(values, StructType(fields)))
+
+    if group_by:
+        on = [_key(g).eqNullSafe(F.col('_g_%d' % j)) for j, g in enumerate(group_by)]
+        joined = df.join(bounds, on)
+    else:
+        joined = df.crossJoin(bounds)
+    holds = []
+    for i, m in enumerate(metrics):
+        extreme = (_key(m) == F.col('_argmin_%d' % i)) | (_key(m) == F.col('_argmax_%d' % i))
+        holds.append(extreme & (_key(latest) == F.col('_latest_%d' % i)) if latest is not None else extreme)
+    condition = holds[0]
+    for h in holds[1:]:
+        condition = condition | h
+    columns = list(OrderedDict.fromkeys(group_by + keys + metrics))
+    selected = joined.where(condition).select(*[_key(c) for c in columns]).orderBy(*[_key(k) for k in keys])
+
+    rows = {key: [] for key in extremes}
+    for r in selected.collect():
+        group = tuple(r[g] for g in group_by)
+        for i, m in enumerate(metrics):
+            for name in ('argmin', 'argmax'):
+                o, v = extremes[group, i, name]
+                if v is not None and r[m] == v and (latest is None or r[latest] == o):
+                    rows[group, i, name].append(dict([(k, r[k]) for k in keys], **{m: v}))
+    return rows
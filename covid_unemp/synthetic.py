@@ -0,0 +1,214 @@
+"""Deterministic synthetic UI claims, population and COVID data at any scale.
+
+`Scale` sets the number of entities (states, or counties for larger runs), the
+years of claims history and the claims frequency (weekly as filed, or daily).
+The generators return pandas frames with the columns and types of the loaded
+data of the notebook:
+
+    claims(scale)        -> unempClaimData_final (state, date, Initial_Claims, ...)
+    population(scale)    -> unempPopData (FIPS_Code, State_and_area, Year, Month, ...)
+    covid_states(scale)  -> covid_states_raw (date, state, fips, cases, deaths)
+
+and `write_csv` writes them in the format of the source files (thousands
+separators, M/d/yyyy dates, padded values), so the loaders and the cleaning can
+be benchmarked as well. Every entity has its own random state derived from
+(seed, table, entity), so the data does not depend on how it is chunked.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+CLAIMS_COLUMNS = ['state', 'date', 'Initial_Claims', 'Continued_Claims', 'Covered_Employment',
+                  'Insured_Unemployment_Rate', 'Reflecting_Week_Ended']
+POPULATION_COLUMNS = ['FIPS_Code', 'State_and_area', 'Year', 'Month', 'population', 'Total', 'Percent_of_population',
+                      'Total_Employment', 'Employment_As_Percent_of_population', 'Total_Unemployment',
+                      'Unemployment_Rate']
+COVID_STATES_COLUMNS = ['date', 'state', 'fips', 'cases', 'deaths']
+
+# headers of the source files
+CLAIMS_HEADER = ['State', 'Filed week ended', 'Initial Claims', 'Reflecting Week Ended', 'Continued Claims',
+                 'Covered Employment', 'Insured Unemployment Rate']
+POPULATION_HEADER = ['FIPS Code', 'State and area', 'Year', 'Month', 'Civilian non-institutional population', 'Total',
+                     'Percent of population', 'Total Employment ', 'Employment As Percent of population',
+                     'Total Unemployment', 'Unemployment Rate']
+
+_CLAIMS, _POPULATION, _COVID = 1, 2, 3
+# the states, DC, Puerto Rico and the Virgin Islands
+STATES = 53
+
+
+class Scale(object):
+    """entities x years x frequency of the generated data.
+
+    Claims are generated from `end - years` to end, weekly (weeks ending on
+    Saturday, like the filed weeks) or daily (freq='D'). Population is monthly
+    and stops two months before end, like the real release; COVID cases are
+    daily from covid_start.
+    """
+
+    def __init__(self, entities=STATES, years=33, freq='W-SAT', end='2020-05-30', covid_start='2020-01-21', seed=0):
+        self.entities = entities
+        self.years = years
+        self.freq = freq
+        self.end = pd.Timestamp(end)
+        self.start = self.end - pd.DateOffset(years=years)
+        self.covid_start = pd.Timestamp(covid_start)
+        self.seed = seed
+
+    @classmethod
+    def factor(cls, factor, **kwargs):
+        """The state level data (53 entities) times factor, e.g. factor=60 is about county level."""
+        return cls(entities=STATES * factor, **kwargs)
+
+    def names(self):
+        return ['State %05d' % (i + 1) for i in range(self.entities)]
+
+    def __repr__(self):
+        return 'Scale(entities=%d, years=%s, freq=%r)' % (self.entities, self.years, self.freq)
+
+
+def _rng(scale, table, entity):
+    return np.random.RandomState([scale.seed, table, entity])
+
+
+def _level(scale, entity):
+    # weekly initial claims of the entity in normal times, shared by all tables
+    return float(np.exp(_rng(scale, 0, entity).uniform(6, 11)))
+
+
+def _claims_entity(scale, i, name, dates):
+    rng = _rng(scale, _CLAIMS, i)
+    level = _level(scale, i) * (1.0 if scale.freq != 'D' else 1 / 7.0)
+    years = (dates - scale.start).days.to_numpy() / 365.25
+    season = 1 + 0.25 * np.sin(2 * np.pi * dates.dayofyear.to_numpy() / 365.25 + rng.uniform(0, 2 * np.pi))
+    cycle = 1 + 0.3 * np.sin(2 * np.pi * years / rng.uniform(7, 11) + rng.uniform(0, 2 * np.pi))
+    weeks_since_shock = (dates - pd.Timestamp('2020-03-14')).days.to_numpy() / 7.0
+    shock = np.where(weeks_since_shock >= 0, 1 + rng.uniform(5, 20) * np.exp(-weeks_since_shock / 8.0), 1.0)
+    initial = np.round(level * season * cycle * shock * rng.lognormal(0, 0.1, len(dates))).astype('int64')
+    continued = np.round(initial * rng.uniform(3, 6) * rng.lognormal(0, 0.05, len(dates))).astype('int64')
+    covered = np.round(level * rng.uniform(80, 120) * (1 + 0.01 * years)).astype('int64')
+    return pd.DataFrame({
+        'state': name,
+        'date': dates,
+        'Initial_Claims': initial,
+        'Continued_Claims': continued,
+        'Covered_Employment': covered,
+        'Insured_Unemployment_Rate': np.round(continued * 100.0 / covered, 2),
+        'Reflecting_Week_Ended': dates - pd.Timedelta(days=7),
+    })[CLAIMS_COLUMNS]
+
+
+def _population_entity(scale, i, name, months):
+    rng = _rng(scale, _POPULATION, i)
+    years = (months - scale.start).days.to_numpy() / 365.25
+    population = np.round(_level(scale, i) * rng.uniform(150, 250) * (1 + 0.01 * years)).astype('int64')
+    rate = np.round(5 + 2 * np.sin(2 * np.pi * years / rng.uniform(7, 11) + rng.uniform(0, 2 * np.pi)), 1)
+    total = np.round(population * rng.uniform(0.6, 0.68)).astype('int64')
+    unemployment = np.round(total * rate / 100).astype('int64')
+    employment = total - unemployment
+    return pd.DataFrame({
+        'FIPS_Code': '%05d' % (i + 1),
+        'State_and_area': name,
+        'Year': months.year.astype('int32'),
+        'Month': months.month.astype('int32'),
+        'population': population,
+        'Total': total,
+        'Percent_of_population': np.round(total * 100.0 / population, 1),
+        'Total_Employment': employment,
+        'Employment_As_Percent_of_population': np.round(employment * 100.0 / population, 1),
+        'Total_Unemployment': unemployment,
+        'Unemployment_Rate': rate,
+    })[POPULATION_COLUMNS]
+
+
+def _covid_entity(scale, i, name, days):
+    rng = _rng(scale, _COVID, i)
+    t = np.arange(len(days))
+    size = _level(scale, i) * rng.uniform(0.2, 4)
+    cases = np.round(size / (1 + np.exp(-rng.uniform(0.1, 0.3) * (t - rng.uniform(40, 80))))).astype('int64')
+    deaths = np.round(cases * rng.uniform(0.01, 0.06)).astype('int64')
+    df = pd.DataFrame({'date': days, 'state': name, 'fips': i + 1, 'cases': cases, 'deaths': deaths})
+    # like the NYT data, a state appears from its first case on
+    return df[df['cases'] > 0][COVID_STATES_COLUMNS]
+
+
+def _chunks(scale, make, periods, chunk_entities):
+    names = scale.names()
+    for first in range(0, scale.entities, chunk_entities):
+        yield pd.concat([make(scale, i, names[i], periods) for i in range(first, min(first + chunk_entities,
+                                                                                       scale.entities))],
+                        ignore_index=True)
+
+
+def iter_claims(scale, chunk_entities=100):
+    return _chunks(scale, _claims_entity, pd.date_range(scale.start, scale.end, freq=scale.freq), chunk_entities)
+
+
+def iter_population(scale, chunk_entities=100):
+    last = (scale.end - pd.DateOffset(months=2)).to_period('M').start_time
+    months = pd.date_range(scale.start.to_period('M').start_time, last, freq='MS')
+    return _chunks(scale, _population_entity, months, chunk_entities)
+
+
+def iter_covid_states(scale, chunk_entities=100):
+    return _chunks(scale, _covid_entity, pd.date_range(scale.covid_start, scale.end, freq='D'), chunk_entities)
+
+
+def claims(scale):
+    return pd.concat(iter_claims(scale), ignore_index=True)
+
+
+def population(scale):
+    return pd.concat(iter_population(scale), ignore_index=True)
+
+
+def covid_states(scale):
+    return pd.concat(iter_covid_states(scale), ignore_index=True)
+
+
+def _thousands(values):
+    return values.map('{:,}'.format)
+
+
+def _raw_claims(df):
+    return pd.DataFrame({
+        'State': df['state'],
+        'Filed week ended': df['date'].dt.strftime('%m/%d/%Y'),
+        'Initial Claims': _thousands(df['Initial_Claims']),
+        'Reflecting Week Ended': df['Reflecting_Week_Ended'].dt.strftime('%m/%d/%Y'),
+        'Continued Claims': _thousands(df['Continued_Claims']),
+        'Covered Employment': _thousands(df['Covered_Employment']),
+        'Insured Unemployment Rate': df['Insured_Unemployment_Rate'],
+    })
+
+
+def _raw_population(df):
+    raw = df.copy()
+    for c in ['Percent_of_population', 'Employment_As_Percent_of_population', 'Unemployment_Rate']:
+        # the percentages of the release are padded with spaces
+        raw[c] = raw[c].map('{:<7}'.format)
+    raw['Month'] = raw['Month'].map('{:02d}'.format)
+    raw.columns = POPULATION_HEADER
+    return raw
+
+
+def _raw_covid(df):
+    return df.assign(date=df['date'].dt.strftime('%Y-%m-%d'))
+
+
+def write_csv(scale, out_dir, chunk_entities=100):
+    """Write claims.csv, population.csv and us-states.csv in the format of the source files; returns their paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    outputs = {
+        'claims': ('claims.csv', iter_claims, _raw_claims),
+        'population': ('population.csv', iter_population, _raw_population),
+        'covid_states': ('us-states.csv', iter_covid_states, _raw_covid),
+    }
+    paths = {}
+    for source, (name, generate, raw) in outputs.items():
+        path = os.path.join(out_dir, name)
+        for n, chunk in enumerate(generate(scale, chunk_entities)):
+            raw(chunk).to_csv(path, mode='w' if n == 0 else 'a', header=n == 0, index=False)
+        paths[source] = path
+    return paths
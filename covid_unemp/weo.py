@@ -0,0 +1,168 @@
+"""IMF World Economic Outlook (WEO) data as a long table, cached as partitioned Parquet.
+
+data/WEOApr2020all.csv is wide: one row per country and indicator (subject)
+with one column per year, quoted notes, values like "1,234.5" or "n/a" and
+footnote rows at the end. `load_weo` reads it in chunks (the whole wide table
+is never held as strings), unpivots every chunk to
+
+    country, iso, subject_code, subject, units, scale, year, value, estimate
+
+with value parsed by vectorized string operations, and caches the result as
+Parquet partitioned by subject_code next to a fingerprint of the source file.
+Later runs read the cache (only the partitions of the requested subjects)
+without parsing the CSV. `macro_regressors` turns indicators of a country into
+regressor columns of a forecast frame.
+"""
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from covid_unemp import DATA_DIR
+
+WEO_FILE = os.path.join(DATA_DIR, 'WEOApr2020all.csv')
+WEO_CACHE_DIR = os.path.join(DATA_DIR, 'cache')
+WEO_ENCODING = 'latin-1'
+
+# indicators used as macro regressors: unemployment rate and real GDP growth
+UNEMPLOYMENT_RATE = 'LUR'
+GDP_GROWTH = 'NGDP_RPCH'
+
+ID_COLUMNS = {
+    'Country': 'country',
+    'ISO': 'iso',
+    'WEO Subject Code': 'subject_code',
+    'Subject Descriptor': 'subject',
+    'Units': 'units',
+    'Scale': 'scale',
+}
+ESTIMATES_START_AFTER = 'Estimates Start After'
+LONG_COLUMNS = ['country', 'iso', 'subject_code', 'subject', 'units', 'scale', 'year', 'value', 'estimate']
+MISSING_VALUES = ['n/a', '--', '']
+
+
+def parse_values(values):
+    """Floats of WEO value strings: thousands separators removed, "n/a" and "--" are NaN."""
+    values = values.astype(str).str.strip().str.replace(',', '', regex=False)
+    return pd.to_numeric(values.where(~values.isin(MISSING_VALUES + ['nan'])), errors='coerce')
+
+
+def _long(chunk, years):
+    # footnote rows at the end of the file have no subject code
+    chunk = chunk[chunk['WEO Subject Code'].notna() & chunk['ISO'].notna()]
+    if chunk.empty:
+        return pd.DataFrame(columns=LONG_COLUMNS)
+    wide = chunk[list(ID_COLUMNS) + [ESTIMATES_START_AFTER] + years].rename(columns=ID_COLUMNS)
+    long = wide.melt(id_vars=list(ID_COLUMNS.values()) + [ESTIMATES_START_AFTER], value_vars=years,
+                     var_name='year', value_name='value')
+    long['year'] = long['year'].astype('int16')
+    long['value'] = parse_values(long['value'])
+    # years after the last actual data are IMF estimates or projections
+    last_actual = pd.to_numeric(long.pop(ESTIMATES_START_AFTER), errors='coerce')
+    long['estimate'] = (long['year'] > last_actual).fillna(False).astype(bool)
+    return long.dropna(subset=['value'])[LONG_COLUMNS]
+
+
+def read_weo_csv(path=WEO_FILE, chunksize=256):
+    """Yield the long rows of the WEO CSV file, one frame per chunk of chunksize wide rows."""
+    header = pd.read_csv(path, encoding=WEO_ENCODING, nrows=0).columns
+    years = [c for c in header if c.isdigit()]
+    dtypes = dict.fromkeys(header, str)
+    for chunk in pd.read_csv(path, encoding=WEO_ENCODING, dtype=dtypes, keep_default_na=False, na_values=[''],
+                             usecols=list(ID_COLUMNS) + [ESTIMATES_START_AFTER] + years, chunksize=chunksize):
+        yield _long(chunk, years)
+
+
+def _fingerprint(path):
+    stat = os.stat(path)
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return {'file': os.path.basename(path), 'size': stat.st_size, 'sha256': h.hexdigest()}
+
+
+def cache_path(path, cache_dir):
+    return os.path.join(cache_dir, os.path.splitext(os.path.basename(path))[0] + '.parquet')
+
+
+def _cache_valid(cache, fingerprint):
+    try:
+        with open(os.path.join(cache, '_source.json')) as f:
+            return json.load(f) == fingerprint
+    except (OSError, ValueError):
+        return False
+
+
+def build_cache(path=WEO_FILE, cache_dir=WEO_CACHE_DIR, chunksize=256):
+    """Parse the CSV in chunks and write the long table to cache_dir as Parquet partitioned by subject_code."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    cache = cache_path(path, cache_dir)
+    fingerprint = _fingerprint(path)
+    # written next to the cache and swapped in, readers never see a partial cache
+    tmp = '%s.%s.tmp' % (cache, uuid.uuid4().hex)
+    schema = None
+    for i, long in enumerate(read_weo_csv(path, chunksize)):
+        if long.empty:
+            continue
+        table = pa.Table.from_pandas(long, preserve_index=False)
+        schema = schema or table.schema
+        pq.write_to_dataset(table.cast(schema), tmp, partition_cols=['subject_code'],
+                            basename_template='part-%05d-{i}.parquet' % i)
+    with open(os.path.join(tmp, '_source.json'), 'w') as f:
+        json.dump(fingerprint, f)
+    if os.path.exists(cache):
+        shutil.rmtree(cache)
+    os.replace(tmp, cache)
+    return cache
+
+
+def read_cache(cache, subjects=None, isos=None):
+    """Long WEO rows from the Parquet cache, only reading the partitions of subjects (codes)."""
+    import pyarrow.parquet as pq
+
+    filters = []
+    if subjects is not None:
+        filters.append(('subject_code', 'in', list(subjects)))
+    if isos is not None:
+        filters.append(('iso', 'in', list(isos)))
+    table = pq.read_table(cache, filters=filters or None)
+    df = table.to_pandas()
+    df['subject_code'] = df['subject_code'].astype(str)
+    return df[LONG_COLUMNS].sort_values(['iso', 'subject_code', 'year']).reset_index(drop=True)
+
+
+def load_weo(path=WEO_FILE, cache_dir=WEO_CACHE_DIR, subjects=None, isos=None, refresh=False, chunksize=256):
+    """Long WEO table (LONG_COLUMNS), parsed once and then read from the Parquet cache.
+
+    The cache is rebuilt when the source file changed (size and sha256) or with refresh=True.
+    """
+    cache = cache_path(path, cache_dir)
+    if refresh or not _cache_valid(cache, _fingerprint(path)):
+        build_cache(path, cache_dir, chunksize)
+    return read_cache(cache, subjects, isos)
+
+
+def macro_regressors(weo, ds, iso='USA', subjects=(UNEMPLOYMENT_RATE, GDP_GROWTH)):
+    """Frame with ds and one column per subject code holding the yearly value of iso for the year of ds.
+
+    ds are the dates of a forecast frame (history and future); dates after the
+    last year of the data keep the value of that year.
+    """
+    ds = pd.to_datetime(pd.Series(ds)).reset_index(drop=True)
+    out = pd.DataFrame({'ds': ds})
+    rows = weo[(weo['iso'] == iso) & weo['subject_code'].isin(subjects)]
+    for subject in subjects:
+        yearly = rows[rows['subject_code'] == subject].set_index('year')['value'].sort_index()
+        if yearly.empty:
+            raise KeyError('no WEO values of %s for %s' % (subject, iso))
+        years = np.clip(ds.dt.year.to_numpy(), yearly.index.min(), yearly.index.max())
+        out[subject] = yearly.reindex(range(yearly.index.min(), yearly.index.max() + 1)).ffill()\
+            .reindex(years).to_numpy()
+    return out
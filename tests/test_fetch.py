@@ -0,0 +1,204 @@
+"""covid_unemp.fetch against a local HTTP server with ETag/Last-Modified revalidation.
+
+    python -m unittest tests.test_fetch
+"""
+import collections
+import functools
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib.error
+from email.utils import formatdate
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from covid_unemp.fetch import CACHED, OFFLINE, SOURCES, FetchCache, Source, fetch_all
+
+
+class Handler(SimpleHTTPRequestHandler):
+    """Serves the files of its directory with an ETag (sha256 of the content) and 304 on a matching If-None-Match.
+
+    Paths in errors are answered with their status code instead.
+    """
+
+    requests = None
+    errors = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        self.requests[self.path] += 1
+        if self.path in self.errors:
+            self.send_error(self.errors[self.path])
+            return
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as f:
+            body = f.read()
+        etag = '"%s"' % hashlib.sha256(body).hexdigest()
+        last_modified = formatdate(os.path.getmtime(path), usegmt=True)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FetchCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.served = os.path.join(self.dir, 'served')
+        os.makedirs(self.served)
+        self.cache_dir = os.path.join(self.dir, 'cache')
+        self.requests = collections.Counter()
+        self.errors = {}
+        handler = type('CountingHandler', (Handler,), {'requests': self.requests, 'errors': self.errors})
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(handler, directory=self.served))
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.write('a.csv', b'state,value\nNY,1\n')
+
+    def tearDown(self):
+        self.stop_server()
+        shutil.rmtree(self.dir)
+
+    def stop_server(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+
+    def write(self, name, content):
+        with open(os.path.join(self.served, name), 'wb') as f:
+            f.write(content)
+
+    def source(self, name='a.csv', **kwargs):
+        port = self.server.server_address[1] if self.server is not None else 1
+        return Source(name, 'http://127.0.0.1:%d/%s' % (port, name), **kwargs)
+
+    def content(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_download_then_not_modified(self):
+        cache = FetchCache(self.cache_dir)
+        path, status = cache.fetch(self.source())
+        self.assertEqual(status, 'downloaded')
+        self.assertEqual(self.content(path), b'state,value\nNY,1\n')
+        self.assertEqual(path, cache.object_path(hashlib.sha256(b'state,value\nNY,1\n').hexdigest()))
+
+        again, status = cache.fetch(self.source())
+        self.assertEqual(status, 'not modified')
+        self.assertEqual(again, path)
+        self.assertEqual(self.requests['/a.csv'], 2)
+
+    def test_max_age_cached_and_offline_make_no_request(self):
+        cache = FetchCache(self.cache_dir)
+        path, _ = cache.fetch(self.source())
+        self.assertEqual(cache.fetch(self.source(), max_age=3600), (path, 'cached'))
+        self.assertEqual(cache.fetch(self.source(), mode=CACHED), (path, 'cached'))
+        self.assertEqual(cache.fetch(self.source(), mode=OFFLINE), (path, 'cached'))
+        self.assertEqual(self.requests['/a.csv'], 1)
+
+    def test_offline_bundled_fallback(self):
+        bundled = os.path.join(self.dir, 'bundled.csv')
+        with open(bundled, 'wb') as f:
+            f.write(b'bundled\n')
+        cache = FetchCache(self.cache_dir)
+        path, status = cache.fetch(self.source(bundled=bundled), mode=OFFLINE)
+        self.assertEqual(status, 'bundled')
+        self.assertEqual(path, cache.object_path(hashlib.sha256(b'bundled\n').hexdigest()))
+        self.assertEqual(self.content(path), b'bundled\n')
+        with self.assertRaises(FileNotFoundError):
+            cache.fetch(self.source('b.csv'), mode=OFFLINE)
+        self.assertEqual(sum(self.requests.values()), 0)
+
+    def test_bundled_files_do_not_depend_on_the_working_directory(self):
+        cwd = os.getcwd()
+        os.chdir(self.dir)
+        try:
+            path, status = FetchCache(self.cache_dir).fetch(SOURCES['population'], mode=OFFLINE)
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(status, 'bundled')
+        self.assertTrue(path.startswith(self.cache_dir))
+
+    def test_changed_file_is_a_new_object(self):
+        cache = FetchCache(self.cache_dir)
+        old, _ = cache.fetch(self.source())
+        self.write('a.csv', b'state,value\nNY,2\n')
+        new, status = cache.fetch(self.source())
+        self.assertEqual(status, 'downloaded')
+        self.assertNotEqual(new, old)
+        self.assertEqual(self.content(new), b'state,value\nNY,2\n')
+        self.assertEqual(self.content(old), b'state,value\nNY,1\n')
+
+    def test_pinned_checksum_mismatch(self):
+        cache = FetchCache(self.cache_dir)
+        with self.assertRaises(ValueError):
+            cache.fetch(self.source(sha256='0' * 64))
+        self.assertIsNone(cache.entry('a.csv'))
+
+    def test_corrupted_object_is_downloaded_again_with_verify(self):
+        cache = FetchCache(self.cache_dir)
+        path, _ = cache.fetch(self.source())
+        with open(path, 'r+b') as f:
+            f.write(b'X')
+        self.assertEqual(cache.fetch(self.source(), mode=CACHED), (path, 'cached'))
+        again, status = cache.fetch(self.source(), mode=CACHED, verify=True)
+        self.assertEqual(status, 'downloaded')
+        self.assertEqual(again, path)
+        self.assertEqual(self.content(path), b'state,value\nNY,1\n')
+        self.assertEqual(self.requests['/a.csv'], 2)
+
+    def test_unreachable_server_uses_the_stale_object(self):
+        cache = FetchCache(self.cache_dir, timeout=5.0)
+        source = self.source()
+        path, _ = cache.fetch(source)
+        self.stop_server()
+        self.assertEqual(cache.fetch(source), (path, 'stale'))
+
+    def test_server_error_uses_the_stale_object(self):
+        cache = FetchCache(self.cache_dir)
+        path, _ = cache.fetch(self.source())
+        self.errors['/a.csv'] = 503
+        self.assertEqual(cache.fetch(self.source()), (path, 'stale'))
+
+    def test_client_error_is_raised(self):
+        cache = FetchCache(self.cache_dir)
+        cache.fetch(self.source())
+        self.errors['/a.csv'] = 404
+        with self.assertRaises(urllib.error.HTTPError):
+            cache.fetch(self.source())
+
+    def test_fetch_all_in_parallel(self):
+        names = ['f%d.csv' % i for i in range(8)]
+        for i, name in enumerate(names):
+            self.write(name, ('file %d\n' % i).encode())
+        sources = [self.source(name) for name in names]
+        fetched = fetch_all(sources, self.cache_dir, max_workers=4)
+        self.assertEqual(sorted(fetched), names)
+        for i, name in enumerate(names):
+            path, status = fetched[name]
+            self.assertEqual(status, 'downloaded')
+            self.assertEqual(self.content(path), ('file %d\n' % i).encode())
+        self.assertEqual({n: self.requests['/' + n] for n in names}, dict.fromkeys(names, 1))
+        again = fetch_all(sources, self.cache_dir, max_workers=4)
+        self.assertEqual({n: s for n, (_, s) in again.items()}, dict.fromkeys(names, 'not modified'))
+
+
+if __name__ == '__main__':
+    unittest.main()
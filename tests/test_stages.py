@@ -0,0 +1,101 @@
+"""covid_unemp.stages release order, on stand-ins of Spark DataFrames that count their builds.
+
+    python -m unittest tests.test_stages
+"""
+import collections
+import types
+import unittest
+
+from pyspark import StorageLevel
+
+from covid_unemp.stages import StageGraph
+
+
+class Frame(object):
+    """Stand-in of a DataFrame recording whether it is persisted."""
+
+    def __init__(self, name, *inputs):
+        self.name = name
+        self.inputs = inputs
+        self.persisted = False
+        self.rdd = types.SimpleNamespace(getNumPartitions=lambda: 1)
+
+    def repartition(self, *columns):
+        return self
+
+    def persist(self, storage):
+        self.persisted = True
+        return self
+
+    def unpersist(self):
+        self.persisted = False
+        return self
+
+    def count(self):
+        return 0
+
+
+class StageGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self.builds = collections.Counter()
+
+    def builder(self, name):
+        def build(*inputs):
+            self.builds[name] += 1
+            return Frame(name, *inputs)
+        return build
+
+    def notebook_graph(self):
+        # the stages of covid_UiClaims.py, declared before the first consumer of covid_raw finishes
+        stages = StageGraph()
+        stages.add('covid_raw', self.builder('covid_raw'), consumers=['covid view', 'population dim'])
+        stages.add('population_dim', self.builder('population_dim'), storage=StorageLevel.MEMORY_ONLY,
+                   consumers=['population dim view'])
+        stages.add('covid_pop', self.builder('covid_pop'), inputs=['covid_raw', 'population_dim'],
+                   partition_by='state', consumers=['covid pop view', 'covid delta'])
+        return stages
+
+    def test_input_is_kept_until_its_dependent_is_built(self):
+        stages = self.notebook_graph()
+        with stages.consume('covid view', 'covid_raw'):
+            pass
+        with stages.consume('population dim', 'covid_raw') as (raw,):
+            pass
+        self.assertFalse(stages.stages['covid_raw'].released)
+        self.assertTrue(raw.persisted)
+        with stages.consume('covid pop view', 'covid_pop') as (covid_pop,):
+            self.assertIs(covid_pop.inputs[0], raw)
+        # covid_pop is cached, covid_raw has no pending consumer left
+        self.assertTrue(stages.stages['covid_raw'].released)
+        self.assertFalse(raw.persisted)
+        with stages.consume('covid delta', 'covid_pop'):
+            pass
+        self.assertEqual(self.builds, {'covid_raw': 1, 'population_dim': 1, 'covid_pop': 1})
+        self.assertEqual({r['stage']: r['expected'] for r in stages.report()},
+                         {'covid_raw': 1, 'population_dim': 1, 'covid_pop': 1})
+        self.assertTrue(stages.stages['covid_pop'].released)
+        # population dim view did not run yet
+        self.assertFalse(stages.stages['population_dim'].released)
+
+    def test_dependent_declared_after_its_input_was_released(self):
+        stages = StageGraph()
+        stages.add('covid_raw', self.builder('covid_raw'), consumers=['population dim'])
+        stages.add('population_dim', self.builder('population_dim'), consumers=['population dim view'])
+        with stages.consume('population dim', 'covid_raw'):
+            pass
+        self.assertTrue(stages.stages['covid_raw'].released)
+        with self.assertRaises(RuntimeError):
+            stages.add('covid_pop', self.builder('covid_pop'), inputs=['covid_raw', 'population_dim'])
+
+    def test_not_persisted_stage_is_computed_per_action(self):
+        stages = StageGraph()
+        stages.add('claims', self.builder('claims'), storage=None, consumers=['final view'])
+        with stages.consume('final view', 'claims', actions=2):
+            pass
+        self.assertEqual(stages.report()[0]['expected'], 2)
+        self.assertIsNone(stages.report()[0]['computed'])
+
+
+if __name__ == '__main__':
+    unittest.main()